@@ -95,6 +95,31 @@ class SeasonsConfig:
     # Set soil_unbalance_limit to 0 to reproduce the original environment. Set it to 1/3 for having self-balancing environments (recommended).
     soil_unbalance_limit = 1 / 3  # @param [0, "1/3"] {type:"raw"}
 
+    # How nutrients diffuse in process_energy. "stencil" gives the same results as
+    # "patches" up to floating point errors and is faster on wide grids.
+    diffusion_kernel = "patches"  # @param ['patches', 'stencil', 'implicit']
+    # Diffusion sub-steps per step. "implicit" is stable with a single one.
+    diffusion_substeps = 1
+    # How gravity is processed. Both are meant to give identical results,
+    # "parallel" does not go line by line. Check with scripts/check_step_kernels.py
+    # before switching.
+    gravity_kernel = "scan"  # @param ['scan', 'parallel']
+    # How structural integrity is processed. All are meant to give identical
+    # results, "converge" stops once the structural integrity is stable. Check
+    # with scripts/check_step_kernels.py before switching.
+    structural_integrity_kernel = "reference"  # @param ['reference', 'fused', 'converge']
+    # Perceive the grid once per step and only update what changed between stages.
+    share_perception = True
+    # Run agent logic only over the part of the grid holding agents.
+    active_region = True
+    # Run agent logic sparsely with a budget chosen from the observed number of
+    # agents. This changes the random numbers agents get, so results are only
+    # statistically the same as the dense computation.
+    sparse_budget = False
+    # Place all seeds of a step at once instead of one after the other. This also
+    # changes the random numbers used, so results are only statistically the same.
+    batched_seed_placement = False
+
     agent_model = "minimal"  # @param ['minimal', 'extended']
     mutator_type = "basic"  # @param ['basic', 'randomly_adaptive']
 
@@ -28,6 +28,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import copy
+import math
 from collections import namedtuple
 from functools import partial
 from typing import Callable, Iterable
@@ -198,30 +199,89 @@ def perceive_neighbors(env: Environment, etd: EnvTypeDef) -> PerceivedData:
   If one wants to explore behaviors where agent_ids are not used by agents, it 
   is the responsibility of the agent logic to not use such information.
   """
-  # The convolution patches input has to be 4d and float.
-  # Use out_of_bounds padding.
-  pad_type_grid = jp.pad(env.type_grid, 1,
+  return PerceivedData(_perceive_types(env.type_grid, etd),
+                       _perceive_states(env.state_grid),
+                       _perceive_ids(env.agent_id_grid))
+
+
+# Positions of the 9 neighbors of a cell in a grid padded by 1, in the order of
+# PerceivedData: (-1, -1), (-1, 0), ..., (1, 1).
+NEIGH_PAD_OFFSETS = tuple((dy, dx) for dy in range(3) for dx in range(3))
+
+
+def _neighbor_slices(pad_x, h, w):
+  """Return the 9 [h, w, ...] neighbor views of a grid padded by 1."""
+  return [pad_x[dy:dy+h, dx:dx+w] for dy, dx in NEIGH_PAD_OFFSETS]
+
+
+def _perceive_types(type_grid, etd):
+  # Types and agent ids are gathered with shifted slices in their own dtype,
+  # so they stay exact for any value. Use out_of_bounds padding.
+  h, w = type_grid.shape
+  pad_type_grid = jp.pad(type_grid, 1,
                          constant_values=etd.types.OUT_OF_BOUNDS)
-  neigh_type = jax.lax.conv_general_dilated_patches(
-      pad_type_grid[None, :, :, None].astype(jp.float32),
-      (3, 3), (1, 1), "VALID", dimension_numbers=("NHWC", "OIHW", "NHWC")
-      )[0].astype(jp.uint32)
+  return jp.stack(_neighbor_slices(pad_type_grid, h, w), -1)
+
 
+def _perceive_states(state_grid):
   neigh_state = jax.lax.conv_general_dilated_patches(
-      env.state_grid[None,:],
+      state_grid[None,:],
       (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
   # We want to have [h,w,9,c] so that the indexing is intuitive and consistent
   # for all neigh vectors.
-  env_state_size = env.state_grid.shape[-1]
-  neigh_state = neigh_state.reshape(
+  env_state_size = state_grid.shape[-1]
+  return neigh_state.reshape(
       neigh_state.shape[:2] + (env_state_size, 9)).transpose((0, 1, 3, 2))
 
-  neigh_id = jax.lax.conv_general_dilated_patches(
-      env.agent_id_grid[None, :, :, None].astype(jp.float32),
-      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC")
-      )[0].astype(jp.uint32)
 
-  return PerceivedData(neigh_type, neigh_state, neigh_id)
+def _perceive_ids(agent_id_grid):
+  h, w = agent_id_grid.shape
+  return jp.stack(_neighbor_slices(jp.pad(agent_id_grid, 1), h, w), -1)
+
+
+# Sharing perception between stages.
+# step_env perceives the grid before the reproduce, parallel and exclusive
+# updates. With a shared perception, it is computed once before the first of
+# them and then updated after every stage that mutated the grid in between:
+# every part of PerceivedData (types, states and agent ids) is only perceived
+# again if its grid changed, which is checked on device. Stages declare the
+# grids they may write in STAGE_WRITES, the others are not even compared.
+STAGE_WRITES = {
+    "reproduce": ("type_grid", "state_grid", "agent_id_grid"),
+    "parallel": ("type_grid", "state_grid"),
+    "energy": ("type_grid", "state_grid", "agent_id_grid"),
+}
+
+
+def update_perception(
+    perc: PerceivedData, old_env: Environment, new_env: Environment,
+    etd: EnvTypeDef, written=("type_grid", "state_grid", "agent_id_grid")
+    ) -> PerceivedData:
+  """Return the PerceivedData of new_env, given perc, the one of old_env.
+
+  Only the grids in written can differ between old_env and new_env. Each of
+  them is perceived again only if it actually changed. The result is identical
+  to perceive_neighbors(new_env, etd).
+  """
+  perceive_fs = {
+      "type_grid": lambda grid: _perceive_types(grid, etd),
+      "state_grid": _perceive_states,
+      "agent_id_grid": _perceive_ids,
+  }
+  parts = []
+  for grid_name, neigh in zip(("type_grid", "state_grid", "agent_id_grid"),
+                              perc):
+    if grid_name not in written:
+      parts.append(neigh)
+      continue
+    old_grid = getattr(old_env, grid_name)
+    new_grid = getattr(new_env, grid_name)
+    parts.append(jax.lax.cond(
+        (old_grid != new_grid).any(),
+        lambda grid, neigh, f=perceive_fs[grid_name]: f(grid),
+        lambda grid, neigh: neigh,
+        new_grid, neigh))
+  return PerceivedData(*parts)
 
 
 ### ExclusiveOp related functions.
@@ -245,6 +305,53 @@ def vectorize_agent_cell_f(
       split_2d(key, h, w), perc)
 
 
+# AgentCompaction.
+# The flat positions of up to n_sparse_max agent cells, found by a prefix sum
+# over the grid instead of sorting it.
+#  idx: [n_sparse_max] flat cell indices. Unused slots hold h*w, which is out of
+#    bounds, so scatters drop them.
+#  n_agents: the number of agent cells (it may be larger than n_sparse_max).
+#  is_agent: [h*w] the agent cells the compaction was computed from.
+# A compaction stays usable when agents die, since the ops of non agent cells
+# are empty, but has to be computed again when new agents appear. See
+# update_agent_compaction.
+if "AgentCompaction" not in globals():
+  AgentCompaction = namedtuple("AgentCompaction", "idx n_agents is_agent")
+
+
+def compact_agents(env_type_grid, etd: EnvTypeDef, n_sparse_max: int
+                   ) -> AgentCompaction:
+  """Return the AgentCompaction of the agent cells of env_type_grid.
+
+  If there are more than n_sparse_max agents, the ones with the lowest flat
+  indices are kept.
+  """
+  is_agent_flat = etd.is_agent_fn(env_type_grid.flatten())
+  n_cells = is_agent_flat.shape[0]
+  # the slot of every agent cell, in order.
+  slots = jp.cumsum(is_agent_flat, dtype=jp.int32) - 1
+  idx = jp.full([n_sparse_max], n_cells, dtype=jp.int32).at[
+      jp.where(is_agent_flat, slots, n_sparse_max)].set(
+          jp.arange(n_cells, dtype=jp.int32), mode="drop")
+  return AgentCompaction(idx, is_agent_flat.sum(), is_agent_flat)
+
+
+def update_agent_compaction(
+    compaction: AgentCompaction, env_type_grid, etd: EnvTypeDef
+    ) -> AgentCompaction:
+  """Return a compaction valid for env_type_grid, reusing compaction if it is.
+
+  It is computed again only if env_type_grid has agents that compaction does
+  not know about.
+  """
+  is_agent_flat = etd.is_agent_fn(env_type_grid.flatten())
+  has_new_agents = (is_agent_flat & jp.logical_not(compaction.is_agent)).any()
+  return jax.lax.cond(
+      has_new_agents,
+      lambda: compact_agents(env_type_grid, etd, compaction.idx.shape[0]),
+      lambda: compaction)
+
+
 def compute_sparse_agent_cell_f(
     key: KeyType,
     cell_f: (Callable[[KeyType, PerceivedData, AgentProgramType],
@@ -255,7 +362,8 @@ def compute_sparse_agent_cell_f(
     perc: PerceivedData,
     env_type_grid, programs: AgentProgramType, etd: EnvTypeDef,
     n_sparse_max: int,
-    b_pos=None):
+    b_pos=None,
+    compaction: AgentCompaction|None = None):
   """Compute a sparse agent cell_f.
 
   This works for ExclusiveOp, ParallelOp and ReproduceOp.
@@ -264,13 +372,16 @@ def compute_sparse_agent_cell_f(
 
   if it is used for a ReproduceOp, b_pos needs to be set, being a flat list of 
   (y,x) positions.
+  The agent cells come from compaction if given, so that stages can share it,
+  and are compacted from env_type_grid otherwise.
   """
   # get the args of alive cells.
   # note that cell_f will not work by itself if the cell is not an agent.
-  is_agent_flat = etd.is_agent_fn(env_type_grid.flatten())
-  # leftmost are not agents, rightmost are agents.
-  sorted_agent_idx = jp.argsort(is_agent_flat)
-  sparse_idx = sorted_agent_idx[-n_sparse_max:]
+  if compaction is None:
+    compaction = compact_agents(env_type_grid, etd, n_sparse_max)
+  n_cells = env_type_grid.size
+  # unused slots compute (and then drop) the last cell.
+  sparse_idx = jp.minimum(compaction.idx, n_cells - 1)
 
   # compute, sparsely, cell_f
   v_part_cell_f = vmap(partial(cell_f, programs=programs))
@@ -284,15 +395,153 @@ def compute_sparse_agent_cell_f(
     sparse_output_tree = v_part_cell_f(
         v_keys, sparse_perc_flat, b_pos[sparse_idx])
 
-  # scatter the result.
+  # scatter the result, writing only the agent cells.
   # we also need to reshape so that it is [h, w, ...] shape.
   return jax.tree_util.tree_map(
-      lambda x: jax.ops.segment_sum(
-          x, sparse_idx, num_segments=is_agent_flat.shape[0]).reshape(
+      lambda x: jp.zeros((n_cells,) + x.shape[1:], x.dtype).at[
+          compaction.idx].set(x, mode="drop").reshape(
               env_type_grid.shape + x.shape[1:]),
       sparse_output_tree)
 
 
+# Active region.
+# Agents usually live in a small part of the grid. In active region mode, agent
+# functions run only over the bounding box of all agents, grown by
+# ACTIVE_REGION_MARGIN cells on every side. To avoid recompiling for every box
+# size, the box is rounded up to one of a few static window sizes, fractions
+# ACTIVE_REGION_BUCKETS of the grid height and width, and lax.switch runs the
+# window of that size. The last bucket is the whole grid, the dense fallback.
+# Cells outside of the window are not agents, so their outputs are the empty
+# (zero) ops, and the results are identical to the dense computation.
+ACTIVE_REGION_BUCKETS = (0.25, 0.5, 1.)
+ACTIVE_REGION_MARGIN = 2
+
+
+def _bucket_sizes(size, buckets):
+  return tuple(sorted({min(size, max(1, int(math.ceil(size * f))))
+                       for f in buckets} | {size}))
+
+
+def _active_extent(is_agent_line, size, margin):
+  """Return the first index and the length of the active part of a line."""
+  any_agent = is_agent_line.any()
+  first = jp.argmax(is_agent_line)
+  last = size - 1 - jp.argmax(is_agent_line[::-1])
+  length = jp.where(any_agent, last - first + 1 + 2 * margin, 0)
+  return first - margin, length
+
+
+def compute_active_agent_cell_f(
+    key: KeyType,
+    cell_f: (Callable[[KeyType, PerceivedData, AgentProgramType],
+                     ExclusiveOp|ParallelOp] |
+             Callable[[
+                 KeyType, PerceivedData, CellPositionType, AgentProgramType],
+                      ReproduceOp]),
+    perc: PerceivedData,
+    env_type_grid, programs: AgentProgramType, etd: EnvTypeDef,
+    b_pos=None,
+    active_buckets=ACTIVE_REGION_BUCKETS,
+    margin=ACTIVE_REGION_MARGIN):
+  """Compute an agent cell_f only over the window of the grid holding agents.
+
+  This works for ExclusiveOp, ParallelOp and ReproduceOp, and gives the same
+  result as the dense vectorized cell_f, random keys included.
+  Note that the cell_f *requires* to have the proper argument name 'programs',
+  so this is an informal interface.
+
+  if it is used for a ReproduceOp, b_pos needs to be set, being a [h, w, 2]
+  grid of (y,x) positions.
+  """
+  h, w = env_type_grid.shape
+  is_agent = etd.is_agent_fn(env_type_grid)
+  row_start, row_length = _active_extent(is_agent.any(1), h, margin)
+  col_start, col_length = _active_extent(is_agent.any(0), w, margin)
+  heights = _bucket_sizes(h, active_buckets)
+  widths = _bucket_sizes(w, active_buckets)
+  # the smallest bucket that fits, boxes larger than the grid use the grid.
+  height_idx = jp.minimum(
+      jp.searchsorted(jp.array(heights), row_length), len(heights) - 1)
+  width_idx = jp.minimum(
+      jp.searchsorted(jp.array(widths), col_length), len(widths) - 1)
+  branch = height_idx * len(widths) + width_idx
+
+  keys = split_2d(key, h, w)
+  v_part_cell_f = vmap2(partial(cell_f, programs=programs))
+  args = (keys, perc) if b_pos is None else (keys, perc, b_pos)
+
+  def make_window_f(bh, bw):
+    def window_f(args):
+      y = jp.clip(row_start, 0, h - bh)
+      x = jp.clip(col_start, 0, w - bw)
+      window_args = jax.tree_util.tree_map(
+          lambda a: jax.lax.dynamic_slice(
+              a, (y, x) + (0,) * (a.ndim - 2), (bh, bw) + a.shape[2:]),
+          args)
+      window_out = v_part_cell_f(*window_args)
+      # scatter the result into an otherwise empty [h, w, ...] output.
+      return jax.tree_util.tree_map(
+          lambda o: jax.lax.dynamic_update_slice(
+              jp.zeros((h, w) + o.shape[2:], o.dtype), o,
+              (y, x) + (0,) * (o.ndim - 2)),
+          window_out)
+    return window_f
+
+  return jax.lax.switch(
+      branch, [make_window_f(bh, bw) for bh in heights for bw in widths], args)
+
+
+def compute_agent_cell_f(
+    key: KeyType,
+    cell_f: (Callable[[KeyType, PerceivedData, AgentProgramType],
+                     ExclusiveOp|ParallelOp] |
+             Callable[[
+                 KeyType, PerceivedData, CellPositionType, AgentProgramType],
+                      ReproduceOp]),
+    perc: PerceivedData,
+    env_type_grid, programs: AgentProgramType, etd: EnvTypeDef,
+    n_sparse_max: int|None = None,
+    active_region=False,
+    sparse_fallback=False,
+    b_pos=None,
+    compaction: AgentCompaction|None = None):
+  """Compute an agent cell_f for the whole grid, the way the update asks for.
+
+  If n_sparse_max is None, cell_f runs densely, or over the active region if
+  active_region is True. Otherwise it runs sparsely for up to n_sparse_max
+  agents. If sparse_fallback is True, steps with more agents than that run
+  densely instead, so that no agent is skipped. Sparse runs use compaction if
+  given, see compute_sparse_agent_cell_f.
+
+  if it is used for a ReproduceOp, b_pos needs to be set, being a [h, w, 2]
+  grid of (y,x) positions.
+  """
+  h, w = env_type_grid.shape
+
+  def dense_f(key, perc):
+    if active_region:
+      return compute_active_agent_cell_f(
+          key, cell_f, perc, env_type_grid, programs, etd, b_pos)
+    if b_pos is None:
+      return vectorize_agent_cell_f(cell_f, h, w)(key, perc, programs)
+    return vectorize_reproduce_f(cell_f, h, w)(key, perc, b_pos, programs)
+
+  if n_sparse_max is None:
+    return dense_f(key, perc)
+  if compaction is None:
+    compaction = compact_agents(env_type_grid, etd, n_sparse_max)
+
+  def sparse_f(key, perc):
+    return compute_sparse_agent_cell_f(
+        key, cell_f, perc, env_type_grid, programs, etd, n_sparse_max,
+        None if b_pos is None else b_pos.reshape((h*w, 2)), compaction)
+
+  if not sparse_fallback:
+    return sparse_f(key, perc)
+  return jax.lax.cond(
+      compaction.n_agents > n_sparse_max, dense_f, sparse_f, key, perc)
+
+
 def make_material_exclusive_interface(
     cell_type, cell_f: Callable[[KeyType, PerceivedData, EnvConfig], ExclusiveOp],
     config: EnvConfig) -> Callable[[KeyType, PerceivedData], ExclusiveOp]:
@@ -444,7 +693,11 @@ def execute_and_aggregate_exclusive_ops(
                             Callable[[KeyType, PerceivedData], ExclusiveOp]]],
     agent_excl_f: Callable[[
         KeyType, PerceivedData, AgentProgramType], ExclusiveInterface],
-    n_sparse_max: int|None = None
+    n_sparse_max: int|None = None,
+    perc: PerceivedData|None = None,
+    active_region=False,
+    sparse_fallback=False,
+    compaction: AgentCompaction|None = None
     ) -> ExclusiveOp:
   """Execute all exclusive functions and aggregate them all into a single
   ExclusiveOp for each cell.
@@ -460,9 +713,19 @@ def execute_and_aggregate_exclusive_ops(
   It then aggregates the resulting ExclusiveOp for each cell.
   Aggregation can be done because *only one function*, at most, will be allowed
   to output nonzero values for each cell.
+  If perc is given, it must be the PerceivedData of env, and it is used instead
+  of perceiving env again.
+  If active_region is True and n_sparse_max is None, agent operations are only
+  computed over the part of the grid holding agents, with identical results.
+  See compute_active_agent_cell_f.
+  If sparse_fallback is True, agent operations are computed densely instead of
+  sparsely whenever more than n_sparse_max agents are alive.
+  If compaction is given, sparse computations use it instead of compacting the
+  agent cells of env again.
   """
   etd = config.etd
-  perc = perceive_neighbors(env, etd)
+  if perc is None:
+    perc = perceive_neighbors(env, etd)
   h, w = env.type_grid.shape
   v_excl_fs = [vectorize_cell_exclusive_f(
       make_material_exclusive_interface(t, f, config), h, w) for (t, f)
@@ -470,12 +733,9 @@ def execute_and_aggregate_exclusive_ops(
 
   agent_excl_intf_f = make_agent_exclusive_interface(agent_excl_f, config)
   k1, key = jr.split(key)
-  if n_sparse_max is None:
-    v_agent_excl_f = vectorize_agent_cell_f(agent_excl_intf_f, h, w)
-    agent_excl_op = v_agent_excl_f(k1, perc, programs)
-  else:
-    agent_excl_op = compute_sparse_agent_cell_f(
-        k1, agent_excl_intf_f, perc, env.type_grid, programs, etd, n_sparse_max)
+  agent_excl_op = compute_agent_cell_f(
+      k1, agent_excl_intf_f, perc, env.type_grid, programs, etd, n_sparse_max,
+      active_region, sparse_fallback, compaction=compaction)
 
   k1, key = jr.split(key)
   excl_ops = [f(k, perc) for k, f in
@@ -500,8 +760,12 @@ def _cell_choose_random_action(key, excl_op_neighs):
 
 
 def env_exclusive_decision(
-    key: KeyType, env: Environment, excl_op: ExclusiveOp):
+    key: KeyType, env: Environment, excl_op: ExclusiveOp, return_audit=False):
   """Choose up to one excl_op for each cell and execute them, updating the env.
+
+  If return_audit is True, also return a dict with the nutrients (per nutrient
+  kind) destroyed by the chosen ops: what the cells they replaced held minus
+  what they wrote.
   """
   h, w, chn = env.state_grid.shape
 
@@ -514,40 +778,14 @@ def env_exclusive_decision(
     can be chosen to be executed.
     """
     # input is either (h,w,9) or (h,w,9,c)
-    ndim = x.ndim
-    x_shape = x.shape
-    old_dtype = x.dtype
-    if old_dtype == jp.uint32:
-      # convert to f32 and then back to uint.
-      x = x.astype(jp.float32)
-    if ndim == 4:
-      x = x.reshape(x_shape[:-2]+(-1,))
-    neigh_state = jax.lax.conv_general_dilated_patches(
-        x[None,:], (3, 3), (1, 1), "SAME",
-        dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
-    # make it (h, w, k, 9)
-    # where k is either 9 or 9*c
-    neigh_state = neigh_state.reshape(
-        neigh_state.shape[:-1] + (x.shape[-1], 9))
-    # reshape accordingly for the case ndim is 4:
-    if ndim == 4:
-      neigh_state = neigh_state.reshape(
-          neigh_state.shape[:-2] + x_shape[-2:] + (9,)).transpose(
-              (0, 1, 2, 4, 3))
-    # now it's either (h,w,9,9) or (h,w,9,9,c).
-    # The leftmost '9' refers to the position of the cell's neighbors.
-    # the rightmost '9' indicates the exclusive op slice of the neighbor, which
-    # in turn targets 9 neighbors.
-    # We want to get only the slice that targets this cell.
-    # the pairing is inverted, since (-1,-1) of the actor reflects to a (1,1)
-    # on the target.
-    NEIGH_PAIRING = jp.stack([jp.arange(0, 9), jp.arange(8, -1, -1)], 0)
-    neigh_state = vmap2(lambda x: x[NEIGH_PAIRING[0], NEIGH_PAIRING[1]])(
-        neigh_state)
-
-    if old_dtype == jp.uint32:
-      neigh_state = neigh_state.astype(jp.uint32)
-    return neigh_state
+    # Slice n of an ExclusiveOp targets the neighbor at offset n, so the slice
+    # n that targets this cell comes from the neighbor at the inverted offset:
+    # (-1,-1) of the actor reflects to a (1,1) on the target.
+    # Slices are gathered in the input dtype, so uint32 values stay exact.
+    pad_x = jp.pad(x, ((1, 1), (1, 1)) + ((0, 0),) * (x.ndim - 2))
+    return jp.stack(
+        [pad_x[2-dy:2-dy+h, 2-dx:2-dx+w, n]
+         for n, (dy, dx) in enumerate(NEIGH_PAD_OFFSETS)], 2)
 
   excl_op_neighs = jax.tree_util.tree_map(
       extract_patches_that_target_cell, excl_op)
@@ -616,7 +854,19 @@ def env_exclusive_decision(
   new_agent_id_grid = (new_agent_id_grid * (1 - t_upd_mask_uint32)
                        + t_upd_id * t_upd_mask_uint32)
 
-  return Environment(new_type_grid, new_state_grid, new_agent_id_grid)
+  env_out = Environment(new_type_grid, new_state_grid, new_agent_id_grid)
+  if return_audit:
+    # actor updates go first, so targets replace what actors left.
+    en_slice = slice(evm.EN_ST, evm.EN_ST+2)
+    a_m, t_m = a_upd_mask[..., None], t_upd_mask[..., None]
+    a_en = a_upd_state[..., en_slice]
+    t_en = t_upd_state[..., en_slice]
+    old_en = env.state_grid[..., en_slice]
+    after_actor_en = old_en * (1. - a_m) + a_en * a_m
+    replaced = (old_en * a_m + after_actor_en * t_m).sum((0, 1))
+    written = (a_en * a_m + t_en * t_m).sum((0, 1))
+    return env_out, {"overwritten": replaced - written}
+  return env_out
 
 
 def env_perform_exclusive_update(
@@ -626,7 +876,12 @@ def env_perform_exclusive_update(
                             Callable[[KeyType, PerceivedData], ExclusiveOp]]],
     agent_excl_f: Callable[[
         KeyType, PerceivedData, AgentProgramType], ExclusiveInterface],
-    n_sparse_max: int|None = None
+    n_sparse_max: int|None = None,
+    perc: PerceivedData|None = None,
+    active_region=False,
+    sparse_fallback=False,
+    compaction: AgentCompaction|None = None,
+    return_audit=False
     ) -> Environment:
   """Perform exclusive operations in the environment.
 
@@ -646,16 +901,26 @@ def env_perform_exclusive_update(
       is an integer, instead, we perform a sparse computation masked by actual
       agent cells. Note that this is capped and if more agents are alive, an 
       undefined subset of agent cells will be run.
+    perc: optionally, the PerceivedData of env, to avoid perceiving it again.
+    active_region: if True (and n_sparse_max is None), agent_excl_f is only
+      performed over the part of the grid holding agents. The results are the
+      same as the dense computation.
+    sparse_fallback: if True, agent_excl_f is performed densely instead of
+      sparsely whenever more than n_sparse_max agents are alive.
+    compaction: optionally, an AgentCompaction valid for env, shared with
+      other stages.
+    return_audit: if True, also return a dict with the nutrients (per nutrient
+      kind) destroyed by overwriting cells. See env_exclusive_decision.
   Returns:
-    an updated environment.
+    an updated environment. If return_audit is True, also the audit dict.
   """
   k1, key = jr.split(key)
   excl_op = execute_and_aggregate_exclusive_ops(
-      k1, env, programs, config, excl_fs, agent_excl_f, n_sparse_max)
+      k1, env, programs, config, excl_fs, agent_excl_f, n_sparse_max, perc,
+      active_region, sparse_fallback, compaction)
 
   key, key1 = jr.split(key)
-  env = env_exclusive_decision(key1, env, excl_op)
-  return env
+  return env_exclusive_decision(key1, env, excl_op, return_audit)
 
 
 ### PARALLEL OPERATIONS
@@ -748,7 +1013,12 @@ def env_perform_parallel_update(
     config: EnvConfig,
     par_f: Callable[[
         KeyType, PerceivedData, AgentProgramType], ParallelInterface],
-    n_sparse_max: int|None = None
+    n_sparse_max: int|None = None,
+    return_audit=False,
+    perc: PerceivedData|None = None,
+    active_region=False,
+    sparse_fallback=False,
+    compaction: AgentCompaction|None = None
     ) -> Environment:
   """Perform parallel operations in the environment.
   
@@ -764,23 +1034,31 @@ def env_perform_parallel_update(
       input a parallel program and outputs a ParallelInterface.
     n_sparse_max: either an int or None. If set to int, we will use a budget for
       the amounts of agent operations allowed at each step.
+    return_audit: if True, also return a dict with the nutrients (per nutrient
+      kind) removed by clipping to the caps and spent on specialization.
+    perc: optionally, the PerceivedData of env, to avoid perceiving it again.
+    active_region: if True (and n_sparse_max is None), par_f is only performed
+      over the part of the grid holding agents. The results are the same as
+      the dense computation.
+    sparse_fallback: if True, par_f is performed densely instead of sparsely
+      whenever more than n_sparse_max agents are alive.
+    compaction: optionally, an AgentCompaction valid for env, shared with
+      other stages.
   Returns:
-    an updated environment.
+    an updated environment. If return_audit is True, also the audit dict.
   """
   # First compute the ParallelOp for each cell.
   h, w = env.type_grid.shape
 
   etd = config.etd
-  perc = perceive_neighbors(env, etd)
+  if perc is None:
+    perc = perceive_neighbors(env, etd)
 
   par_interface_f = make_agent_parallel_interface( par_f, config)
   k1, key = jr.split(key)
-  if n_sparse_max is None:
-    v_par_interface_f = vectorize_agent_cell_f(par_interface_f, h, w)
-    par_op = v_par_interface_f(k1, perc, programs)
-  else:
-    par_op = compute_sparse_agent_cell_f(
-      k1, par_interface_f, perc, env.type_grid, programs, etd, n_sparse_max)
+  par_op = compute_agent_cell_f(
+    k1, par_interface_f, perc, env.type_grid, programs, etd, n_sparse_max,
+    active_region, sparse_fallback, compaction=compaction)
 
   # Then process them.
   mask, denergy_neigh, dstate, new_type = par_op
@@ -803,11 +1081,12 @@ def env_perform_parallel_update(
                      for n, s in enumerate(MAP_TO_NEIGH_SLICING)], 2)
 
   denergy = map_to_neigh(denergy_neigh).sum(2)
-  new_en = env.state_grid[:, :, evm.EN_ST : evm.EN_ST+2] + denergy
+  unclipped_en = env.state_grid[:, :, evm.EN_ST : evm.EN_ST+2] + denergy
   # energy state cap is different based on whether the cell is an agent or not.
   is_agent_e = etd.is_agent_fn(env.type_grid).astype(jp.float32)[..., None]
-  new_en = (new_en.clip(0., config.material_nutrient_cap) * (1. - is_agent_e) +
-            new_en.clip(0., config.nutrient_cap) * is_agent_e)
+  new_en = (
+      unclipped_en.clip(0., config.material_nutrient_cap) * (1. - is_agent_e) +
+      unclipped_en.clip(0., config.nutrient_cap) * is_agent_e)
 
   # note that this is not the totality of all states. For instance, structural 
   # integrity exists.
@@ -819,6 +1098,11 @@ def env_perform_parallel_update(
   new_state_grid = env.state_grid.at[:, :, evm.EN_ST:].set(new_en_state)
 
   env = Environment(new_type_grid, new_state_grid, env.agent_id_grid)
+  if return_audit:
+    # denergy is conserved among agents, except for specialization costs.
+    audit = {"clipped": (unclipped_en - new_en).sum((0, 1)),
+             "spent": -denergy.sum((0, 1))}
+    return env, audit
   return env
 
 
@@ -954,7 +1238,8 @@ def _select_random_position_for_seed_within_range(
 
 
 def env_try_place_one_seed(
-    key: KeyType, env: Environment, op_info, config: EnvConfig):
+    key: KeyType, env: Environment, op_info, config: EnvConfig,
+    return_audit=False):
   """Try to place one seed in the environment.
   
   For this op to be successful, fertile soil in the neighborhood must be
@@ -962,10 +1247,15 @@ def env_try_place_one_seed(
   If it is, a new seed (two unspecialized cells) are placed in the environment.
   Their age is reset to zero, and they may have a different agent_id than their
   parent, if mutation was set to true.
+  If return_audit is True, also return the nutrients (per nutrient kind) the
+  seed holds minus what its two cells held before.
   """
   mask, pos, stored_en, aid = op_info
   etd = config.etd
 
+  def no_seed_fn(env):
+    return env, jp.zeros([2])
+
   def true_fn(env):
     best_idx_per_column, column_m = find_fertile_soil(env.type_grid, etd)
     t_column, column_valid = _select_random_position_for_seed_within_range(
@@ -974,31 +1264,120 @@ def env_try_place_one_seed(
 
     def true_fn2(env):
       t_row = best_idx_per_column[t_column]
-      return evm.place_seed(
+      new_env = evm.place_seed(
           env, t_column, config, row_optional=t_row, aid=aid,
           custom_agent_init_nutrient=stored_en/2)
+      seed_rows = jp.stack([t_row, t_row + 1])
+      seeded = (
+          new_env.state_grid[seed_rows, t_column, evm.EN_ST : evm.EN_ST+2] -
+          env.state_grid[seed_rows, t_column, evm.EN_ST : evm.EN_ST+2]).sum(0)
+      return new_env, seeded
 
-    return jax.lax.cond(column_valid, true_fn2, lambda env: env, env)
+    return jax.lax.cond(column_valid, true_fn2, no_seed_fn, env)
 
-  return jax.lax.cond(mask, true_fn, lambda env: env, env)
+  env, seeded = jax.lax.cond(mask, true_fn, no_seed_fn, env)
+  if return_audit:
+    return env, seeded
+  return env
 
 
-def env_try_place_seeds(key, env, b_op_info, config):
+def env_try_place_seeds(key, env, b_op_info, config, return_audit=False):
   """Try to place seeds in the environment.
   
   These are performed sequentially. Note that some ops may be masked and
   therefore be noops.
+  If return_audit is True, also return the nutrients (per nutrient kind) added
+  by all seeds, see env_try_place_one_seed.
   """
   def body_f(carry, op_info):
-    env, key = carry
+    env, key, seeded = carry
     key, ku = jr.split(key)
-    env = env_try_place_one_seed(ku, env, op_info, config)
-    return (env, key), 0
-
-  (env, key), _ = jax.lax.scan(body_f, (env, key), b_op_info)
+    env, op_seeded = env_try_place_one_seed(
+        ku, env, op_info, config, return_audit=True)
+    return (env, key, seeded + op_seeded), 0
+
+  (env, key, seeded), _ = jax.lax.scan(
+      body_f, (env, key, jp.zeros([2])), b_op_info)
+  if return_audit:
+    return env, seeded
   return env
 
 
+# Batched seed placement.
+# env_try_place_seeds places seeds one after the other, looking for fertile soil
+# in the whole grid every time. A seed uses up the fertile soil of its column,
+# so env_try_place_seeds_batched finds fertile soil once, and every op picks a
+# random fertile column in its range at the same time. When several ops pick
+# the same column, the first op (the one the sequential version would place
+# first) gets it, and the others pick again among the columns left, for up to
+# SEED_PLACEMENT_ROUNDS rounds. Then all seeds are placed with one scatter.
+# Ops that still have no column after the last round are dropped.
+SEED_PLACEMENT_ROUNDS = 3
+
+
+def env_try_place_seeds_batched(
+    key, env, b_op_info, config, return_audit=False,
+    n_rounds=SEED_PLACEMENT_ROUNDS):
+  """Try to place seeds in the environment, all at once.
+
+  This is a parallel alternative to env_try_place_seeds, which takes the same
+  inputs and is statistically equivalent to it.
+  """
+  mask, pos, stored_en, aid = b_op_info
+  etd = config.etd
+  h, w = env.type_grid.shape
+  n_ops = mask.shape[0]
+  op_idxs = jp.arange(n_ops)
+  best_idx_per_column, column_m = find_fertile_soil(env.type_grid, etd)
+
+  pending = mask > 0
+  columns = jp.zeros([n_ops], dtype=jp.int32)
+  for ku in jr.split(key, n_rounds):
+    t_column, column_valid = vmap(
+        lambda k, center: _select_random_position_for_seed_within_range(
+            k, center, config.reproduce_min_dist, config.reproduce_max_dist,
+            column_m))(jr.split(ku, n_ops), pos[:, 1])
+    claiming = pending & column_valid
+    # the lowest op index claiming a column wins it.
+    claims = jp.full([w], n_ops).at[jp.where(claiming, t_column, w)].min(
+        op_idxs, mode="drop")
+    won = claiming & (claims[t_column] == op_idxs)
+    columns = jp.where(won, t_column, columns)
+    pending = pending & jp.logical_not(won)
+    column_m = column_m & jp.logical_not(claims < n_ops)
+  placed = mask.astype(bool) & jp.logical_not(pending)
+
+  # Every seed takes two cells in its column: rows t_row and t_row+1.
+  t_rows = best_idx_per_column[columns]
+  rows = jp.stack([t_rows, t_rows + 1], -1)
+  cols = jp.stack([columns, columns], -1)
+  # place_seed on the two cells alone, so seeds get exactly what it writes.
+  seed_cells = vmap(
+      lambda rows, cols, aid, stored_en: evm.place_seed(
+          Environment(env.type_grid[rows, cols][:, None],
+                      env.state_grid[rows, cols][:, None],
+                      env.agent_id_grid[rows, cols][:, None]),
+          0, config, row_optional=0, aid=aid,
+          custom_agent_init_nutrient=stored_en/2))(rows, cols, aid, stored_en)
+  # seeds that were not placed write out of bounds, and are dropped.
+  rows = jp.where(placed[:, None], rows, h)
+  env_out = Environment(
+      env.type_grid.at[rows, cols].set(
+          seed_cells.type_grid[..., 0], mode="drop"),
+      env.state_grid.at[rows, cols].set(
+          seed_cells.state_grid[:, :, 0], mode="drop"),
+      env.agent_id_grid.at[rows, cols].set(
+          seed_cells.agent_id_grid[..., 0], mode="drop"))
+  if return_audit:
+    seed_en = seed_cells.state_grid[:, :, 0, evm.EN_ST : evm.EN_ST+2]
+    # the columns of placed seeds are distinct, so no cell is counted twice.
+    old_en = env.state_grid[jp.minimum(rows, h-1), cols,
+                            evm.EN_ST : evm.EN_ST+2]
+    seeded = (placed[:, None, None] * (seed_en - old_en)).sum((0, 1))
+    return env_out, seeded
+  return env_out
+
+
 def _select_subset_of_reproduce_ops(
     key, b_repr_op, neigh_type, config, select_sexual_repr):
   # Only a small subset of possible ReproduceOps are selected at each step.
@@ -1047,7 +1426,13 @@ def env_perform_reproduce_update(
     split_mutator_params_f = None,
     get_sex_f: (Callable[[AgentProgramType], AgentProgramType] | None) = None,
     n_sparse_max: int|None = None,
-    return_metrics=False):
+    return_metrics=False,
+    perc: PerceivedData|None = None,
+    active_region=False,
+    sparse_fallback=False,
+    compaction: AgentCompaction|None = None,
+    batched_seed_placement=False,
+    return_audit=False):
   """Perform reproduce operations in the environment.
 
   This is the function that should be used for high level step_env design.
@@ -1084,25 +1469,37 @@ def env_perform_reproduce_update(
       the amounts of agent operations allowed at each step.
     return_metrics: if True, return metrics about whether reproduction occurred,
       and who are the parents and children.
+    perc: optionally, the PerceivedData of env, to avoid perceiving it again.
+    active_region: if True (and n_sparse_max is None), repr_f is only performed
+      over the part of the grid holding agents. The results are the same as
+      the dense computation.
+    sparse_fallback: if True, repr_f is performed densely instead of sparsely
+      whenever more than n_sparse_max agents are alive.
+    compaction: optionally, an AgentCompaction valid for env, shared with
+      other stages.
+    batched_seed_placement: if True, seeds are placed all at once with
+      env_try_place_seeds_batched instead of one after the other.
+    return_audit: if True, also return a dict with the nutrients (per nutrient
+      kind) held by the destroyed flowers, and added by the placed seeds.
   Returns:
     an updated environment. if mutate_programs is True, it also returns 
-    the updated programs.
+    the updated programs. If return_audit is True, these are followed by the
+    audit dict.
   """
   assert enable_asexual_reproduction or enable_sexual_reproduction
   etd = config.etd
-  perc = perceive_neighbors(env, etd)
+  try_place_seeds_f = (env_try_place_seeds_batched if batched_seed_placement
+                       else env_try_place_seeds)
+  if perc is None:
+    perc = perceive_neighbors(env, etd)
   h, w = env.type_grid.shape
 
   b_pos = jp.stack(jp.meshgrid(jp.arange(h), jp.arange(w), indexing="ij"), -1)
   repr_interface_f = make_agent_reproduce_interface(repr_f, config)
   k1, key = jr.split(key)
-  if n_sparse_max is None:
-    v_repr_f = vectorize_reproduce_f(repr_interface_f, h, w)
-    b_repr_op = v_repr_f(k1, perc, b_pos, repr_programs)
-  else:
-    b_repr_op = compute_sparse_agent_cell_f(
-      k1, repr_interface_f, perc, env.type_grid, repr_programs, etd,
-      n_sparse_max, b_pos.reshape((h*w, 2)))
+  b_repr_op = compute_agent_cell_f(
+    k1, repr_interface_f, perc, env.type_grid, repr_programs, etd,
+    n_sparse_max, active_region, sparse_fallback, b_pos, compaction)
 
   # Only a small subset of possible ReproduceOps are selected at each step.
   # sexual and asexual reproductions are treated independently.
@@ -1238,17 +1635,22 @@ def env_perform_reproduce_update(
 
   if return_metrics:
     metrics = {}
+  audit = {"destroyed": jp.zeros([2]), "seeded": jp.zeros([2])}
     
   if enable_asexual_reproduction:
     ## Asexual reproduction
     # these positions (if mask says yes) are then selected to reproduce.
     # A seed is spawned if possible.
     k1, key = jr.split(key)
-    env = env_try_place_seeds(
+    env, seeded = try_place_seeds_f(
         k1, env,
         (selected_mask, selected_pos, selected_stored_en, repr_aid),
-        config)
+        config, return_audit=True)
+    audit["seeded"] += seeded
     # The flower is destroyed, regardless of whether the operation succeeds.
+    audit["destroyed"] += (
+        selected_mask[:, None] *
+        env.state_grid[spx, spy, evm.EN_ST : evm.EN_ST+2]).sum(0)
     n_selected_mask = 1 - selected_mask
     n_selected_mask_uint = n_selected_mask.astype(jp.uint32)
     env = Environment(
@@ -1275,15 +1677,19 @@ def env_perform_reproduce_update(
                    selected_pos_sx[1::2] * (1 - pos_m))
 
     k1, key = jr.split(key)
-    env = env_try_place_seeds(
+    env, seeded = try_place_seeds_f(
         k1, env,
         (pair_repr_mask_sx, repr_pos_sx, pair_stored_en_sx, repr_aid_sx),
-        config)
+        config, return_audit=True)
+    audit["seeded"] += seeded
     # The flower is destroyed, regardless of whether the operation succeeds.
     # update the selected_mask_sx, since some flowers may not have been actually
     # selected.
     # mutation_mask_sx is the outcome of a pair, so you need to repeat it twice.
     destroy_mask_sx = jp.repeat(pair_repr_mask_sx, 2, axis=-1)
+    audit["destroyed"] += (
+        destroy_mask_sx[:, None] *
+        env.state_grid[spx_sx, spy_sx, evm.EN_ST : evm.EN_ST+2]).sum(0)
     n_destroy_mask_sx = 1 - destroy_mask_sx
     n_destroy_mask_sx_uint = n_destroy_mask_sx.astype(jp.uint32)
     env = Environment(
@@ -1302,6 +1708,8 @@ def env_perform_reproduce_update(
           repr_aid_sx)
 
   result = (env, programs) if mutate_programs else env
+  if return_audit:
+    result = (result, audit)
   if return_metrics:
     return result, metrics
   return result
@@ -1313,7 +1721,7 @@ def intercept_reproduce_ops(
     config: EnvConfig,
     repr_f: Callable[[KeyType, PerceivedData, AgentProgramType],
                      ReproduceInterface],
-    min_repr_energy_requirement):
+    min_repr_energy_requirement, return_audit=False):
   """Intercept reproduce ops to still destroy flowers but cause no reproduction.
   
   Instead, return a counter of 'successful' reproductions happening.
@@ -1337,9 +1745,11 @@ def intercept_reproduce_ops(
       type. This is a user-defined value to determine whether the user believes
       that the seed had enough nutrients to be able to grow. If the seed has
       less energy, we consider that a failed reproduction.
+    return_audit: if True, also return a dict with the nutrients (per nutrient
+      kind) held by the destroyed flowers, like env_perform_reproduce_update.
   Returns:
     an updated environment, and a counter determining the number of successful
-    reproductions.
+    reproductions. If return_audit is True, also the audit dict.
   """
   etd = config.etd
   perc = perceive_neighbors(env, etd)
@@ -1366,6 +1776,8 @@ def intercept_reproduce_ops(
   n_successful_repr = (selected_mask*has_enough_stored_energy).sum()
 
   # The flower is destroyed, regardless of whether the operation succeeds.
+  destroyed = (selected_mask[:, None] *
+               env.state_grid[spx, spy, evm.EN_ST : evm.EN_ST+2]).sum(0)
   n_selected_mask = 1 - selected_mask
   n_selected_mask_uint = n_selected_mask.astype(jp.uint32)
   env = Environment(
@@ -1378,6 +1790,9 @@ def intercept_reproduce_ops(
           n_selected_mask_uint * env.agent_id_grid[spx, spy]) # default id 0.
   )
 
+  if return_audit:
+    return env, n_successful_repr, {"destroyed": destroyed,
+                                    "seeded": jp.zeros([2])}
   return env, n_successful_repr
 
 
@@ -1426,7 +1841,68 @@ def _line_gravity(env, x, w, etd):
   return Environment(new_type_grid, new_state_grid, new_agent_id_grid), 0
 
 
-def env_process_gravity(env: Environment, etd: EnvTypeDef) -> Environment:
+# Gravity kernels.
+# "scan" applies gravity on every line, from bottom to top, with a lax.scan.
+#   This is the reference.
+# "parallel" computes which cells fall in every column at once. Since lines are
+#   processed from the bottom, a cell falls iff it can fall and the cell below
+#   it is intangible or falls too. That is an associative recurrence, solved
+#   with a reverse associative scan over the rows, and every column of falling
+#   cells then moves down by one while the intangible cell below it moves to
+#   its top. Cells are only moved, so the results are identical.
+GRAVITY_KERNELS = ("scan", "parallel")
+
+
+def _compose_falling(lower, upper):
+  # Cells fall iff a | (b & the cell below falls). Composes the rule of the
+  # upper rows after the one of the lower rows.
+  lower_a, lower_b = lower
+  upper_a, upper_b = upper
+  return upper_a | (upper_b & lower_a), upper_b & lower_b
+
+
+def _parallel_gravity(env, etd):
+  type_grid, state_grid, agent_id_grid = env
+  h = type_grid.shape[0]
+  # self needs to be affected by gravity and either crumbling or not structural.
+  can_fall = (
+      (type_grid[..., None] == etd.gravity_mats).any(-1) &
+      ((state_grid[:, :, 0] <= 0.) |
+       (type_grid[..., None] != etd.structural_mats).all(-1)))
+  # down needs to be intangible. Nothing falls off the bottom line.
+  is_down_intangible = jp.pad(
+      (type_grid[1:, :, None] == etd.intangible_mats).any(-1), ((0, 1), (0, 0)))
+  # Scanning in reverse composes the rules from the bottom line up.
+  falls, _ = jax.lax.associative_scan(
+      _compose_falling, (can_fall & is_down_intangible, can_fall),
+      reverse=True, axis=0)
+
+  rows = jp.arange(h)[:, None]
+  # For the top of every column of falling cells, the intangible cell below it.
+  first_still_below = jax.lax.cummin(
+      jp.where(falls, h, rows), axis=0, reverse=True)
+  falls_from_above = jp.pad(falls[:-1], ((1, 0), (0, 0)))
+  source_rows = jp.where(
+      falls_from_above, rows - 1, jp.where(falls, first_still_below, rows))
+  return Environment(
+      jp.take_along_axis(type_grid, source_rows, 0),
+      jp.take_along_axis(state_grid, source_rows[..., None], 0),
+      jp.take_along_axis(agent_id_grid, source_rows, 0))
+
+
+def gravity_kernel_mismatches(env: Environment, etd: EnvTypeDef):
+  """Return the number of cells where the "parallel" and "scan" gravity differ.
+
+  Any cell whose type, state or agent id differs counts. This should be zero.
+  """
+  reference = env_process_gravity(env, etd, gravity_kernel="scan")
+  candidate = env_process_gravity(env, etd, gravity_kernel="parallel")
+  return ((reference.type_grid != candidate.type_grid) |
+          (reference.state_grid != candidate.state_grid).any(-1) |
+          (reference.agent_id_grid != candidate.agent_id_grid)).sum()
+
+
+def env_process_gravity(env: Environment, etd: EnvTypeDef, gravity_kernel="scan") -> Environment:
   """Process gravity in the input env.
   
   Only materials subject to gravity (env.GRAVITY_MATS) can fall.
@@ -1435,7 +1911,15 @@ def env_process_gravity(env: Environment, etd: EnvTypeDef) -> Environment:
   
   Create a new env by applying gravity on every line, from bottom to top.
   Nit: right now, you can't fall off, so we start from the second to bottom.
+
+  gravity_kernel is one of GRAVITY_KERNELS. "parallel" gives the same result
+  as the line by line "scan", without h sequential steps.
   """
+  if gravity_kernel not in GRAVITY_KERNELS:
+    raise ValueError(f"Unknown gravity kernel {gravity_kernel}, expected "
+                     f"one of {GRAVITY_KERNELS}")
+  if gravity_kernel == "parallel":
+    return _parallel_gravity(env, etd)
   h, w = env.type_grid.shape
   env, _ = jax.lax.scan(
       partial(_line_gravity, w=w, etd=etd),
@@ -1506,6 +1990,102 @@ def process_structural_integrity_n_times(
       None, n)
   return env
 
+
+# Structural integrity kernels.
+# "reference" runs process_structural_integrity n times, rewriting state_grid
+#   every pass.
+# "fused" runs the n passes on the [h, w] structural integrity field only, with
+#   the masks and decays computed once, and writes state_grid once.
+# "converge" is "fused", but stops as soon as a pass does not change the field.
+#   A pass only depends on the field and the (fixed) types, so every later pass
+#   would not change it either.
+# All kernels give identical results, see structural_integrity_mismatches.
+STRUCTURAL_INTEGRITY_KERNELS = ("reference", "fused", "converge")
+
+
+def _max_3x3(x):
+  """Return the max of the 3x3 neighbourhood of every cell of a [h, w] grid."""
+  # Like max_pool, cells outside of the grid are ignored.
+  x = jp.pad(x, 1, constant_values=-jp.inf)
+  rows = jp.maximum(jp.maximum(x[:-2], x[1:-1]), x[2:])
+  return jp.maximum(jp.maximum(rows[:, :-2], rows[:, 1:-1]), rows[:, 2:])
+
+
+def _make_structural_integrity_pass(type_grid, config):
+  """Return the update of the structural integrity field for type_grid."""
+  etd = config.etd
+  is_immovable = type_grid == etd.types.IMMOVABLE
+  propagates_structure = (type_grid[..., None] == etd.propagate_structure_mats
+                          ).any(-1)
+  immovable_f = is_immovable.astype(jp.float32)
+  propagates_f = (propagates_structure & (jp.logical_not(is_immovable))
+                  ).astype(jp.float32)
+  decay = etd.structure_decay_mats[type_grid]
+
+  def structural_integrity_pass(field):
+    # Same operations as process_structural_integrity.
+    propagated_int = (_max_3x3(field) - decay).clip(0)
+    return (immovable_f * config.struct_integrity_cap +
+            propagates_f * (propagated_int))
+  return structural_integrity_pass
+
+
+def process_structural_integrity_fused(
+    env: Environment, config: EnvConfig, n, converge=False):
+  """Process up to n steps of structural integrity, writing state_grid once.
+
+  If converge is True, stop as soon as the structural integrity is stable.
+  The result is identical to process_structural_integrity_n_times.
+  """
+  if n == 0:
+    return env
+  structural_integrity_pass = _make_structural_integrity_pass(
+      env.type_grid, config)
+  field = env.state_grid[:, :, evm.STR_IDX]
+  if converge:
+    def cond_fn(carry):
+      i, _, changed = carry
+      return (i < n) & changed
+
+    def body_fn(carry):
+      i, field, _ = carry
+      new_field = structural_integrity_pass(field)
+      return i + 1, new_field, (new_field != field).any()
+
+    _, field, _ = jax.lax.while_loop(
+        cond_fn, body_fn, (0, field, jp.array(True)))
+  else:
+    field = jax.lax.fori_loop(
+        0, n, lambda i, field: structural_integrity_pass(field), field)
+  return evm.update_env_state_grid(
+      env, env.state_grid.at[:, :, evm.STR_IDX].set(field))
+
+
+def process_structural_integrity_with_kernel(
+    env: Environment, config: EnvConfig, n, structural_integrity_kernel):
+  """Process n steps of structural integrity with one of STRUCTURAL_INTEGRITY_KERNELS."""
+  if structural_integrity_kernel not in STRUCTURAL_INTEGRITY_KERNELS:
+    raise ValueError(
+        f"Unknown structural integrity kernel {structural_integrity_kernel}, "
+        f"expected one of {STRUCTURAL_INTEGRITY_KERNELS}")
+  if structural_integrity_kernel == "reference":
+    return process_structural_integrity_n_times(env, config, n)
+  return process_structural_integrity_fused(
+      env, config, n, converge=structural_integrity_kernel == "converge")
+
+
+def structural_integrity_mismatches(
+    env: Environment, config: EnvConfig, n=5,
+    structural_integrity_kernel="converge"):
+  """Return the number of cells where a kernel and the reference differ.
+
+  This should be zero.
+  """
+  reference = process_structural_integrity_n_times(env, config, n)
+  candidate = process_structural_integrity_with_kernel(
+      env, config, n, structural_integrity_kernel)
+  return (reference.state_grid != candidate.state_grid).any(-1).sum()
+
 # agents interact with the environment.
 # They can be energy based, but I will make that an optional configuration.
 
@@ -1516,7 +2096,183 @@ def process_structural_integrity_n_times(
 # I might eventually refactor that to remove 'energy' everywhere.
 
 
-def process_energy(env: Environment, config: EnvConfig, soil_diffusion_rate = 0.1, air_diffusion_rate = 0.1) -> Environment:
+# NutrientAudit.
+# Per step report of where nutrients came from and where they went. Every field
+# has one value per nutrient kind: [earth, air].
+#  initial, final: total nutrients in the grid at the start and end of the step.
+#  injected: generated by IMMOVABLE and SUN cells through diffusion.
+#  absorbed: moved from earth and air into roots and leaves. This is a transfer,
+#    so it does not change the total.
+#  dissipated, leaked: lost by agents by living and aging.
+#  clipped: removed by clipping to nutrient_cap and material_nutrient_cap.
+#  discarded: held by cells that cannot store that nutrient kind.
+#  spent: paid by agents to change specialization.
+#  died: held by agents that died and were converted into materials. This is a
+#    transfer, so it does not change the total.
+#  reproduced: destroyed by reproduction (flowers destroyed minus seeds placed).
+#  overwritten: destroyed by cells being replaced, that is exclusive ops
+#    (including spawn costs) and soil balancing.
+# Every field other than initial and final is reported by the stage itself from
+# the cells it writes, never as a difference of totals, so the residual checks
+# all stages, see nutrient_audit_residual. Structural integrity, gravity and
+# aging report nothing, since they must preserve nutrients.
+if "NutrientAudit" not in globals():
+  NutrientAudit = namedtuple(
+      "NutrientAudit",
+      "initial final injected absorbed dissipated leaked clipped discarded "
+      "spent died reproduced overwritten")
+
+
+def total_nutrients(env: Environment):
+  """Return the total nutrients in the grid, one value per nutrient kind."""
+  return env.state_grid[:, :, evm.EN_ST : evm.EN_ST+2].sum((0, 1))
+
+
+def nutrient_audit_residual(audit: NutrientAudit):
+  """Return the nutrients that are not accounted for by a NutrientAudit.
+
+  This should be zero up to floating point errors. Works on stacked audits too.
+  """
+  return (audit.initial + audit.injected - audit.dissipated - audit.leaked -
+          audit.clipped - audit.discarded - audit.spent - audit.reproduced -
+          audit.overwritten - audit.final)
+
+
+### Diffusion kernels.
+# process_energy sums masked 3x3 neighbourhoods of the nutrients.
+# "patches" extracts every neighbourhood as a [h, w, 9] tensor with
+#   conv_general_dilated_patches and reduces it. This is the reference.
+# "stencil" computes the same sums with padded shifted slices, using that
+#   sum_k (n_k - n) * m_k = sum_k n_k * m_k - n * sum_k m_k, so no patch tensors
+#   are built. Results agree up to floating point errors, see
+#   diffusion_kernel_error.
+# "implicit" takes backward Euler steps instead of explicit ones: every sub-step
+#   solves (I - rate * L) n' = n with conjugate gradients, where L is the masked
+#   3x3 diffusion operator among earth (or air) cells, and IMMOVABLE (or SUN)
+#   cells are fixed sources at their nutrient cap. It is stable for any rate, so
+#   a single sub-step replaces many explicit ones. It is a different time
+#   discretization, so it only agrees with the explicit kernels as the number
+#   of sub-steps grows.
+DIFFUSION_KERNELS = ("patches", "stencil", "implicit")
+# Conjugate gradient settings of the implicit kernel. The system is diagonally
+# dominant, so it converges in a few iterations for the usual rates.
+IMPLICIT_DIFFUSION_TOL = 1e-6
+IMPLICIT_DIFFUSION_MAXITER = 50
+
+
+def box_sum_3x3(x):
+  """Return the sum of the 3x3 neighbourhood of every cell of a [h, w, ...] grid.
+
+  Cells outside of the grid count as zero, like the "SAME" padded patches.
+  """
+  x = jp.pad(x, [(1, 1), (1, 1)] + [(0, 0)] * (x.ndim - 2))
+  rows = x[:-2] + x[1:-1] + x[2:]
+  return rows[:, :-2] + rows[:, 1:-1] + rows[:, 2:]
+
+
+def _neighbourhood_sum(x, diffusion_kernel):
+  """Return the 3x3 neighbourhood sum of every channel of a [h, w, c] grid."""
+  if diffusion_kernel != "patches":
+    return box_sum_3x3(x)
+  neigh_x = jax.lax.conv_general_dilated_patches(
+      x[None,:],
+      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
+  # we want to have [h,w,9,c] so that the indexing is intuitive and consistent
+  # for both neigh vectors.
+  neigh_x = neigh_x.reshape(
+      neigh_x.shape[:2] + (x.shape[-1], 9)).transpose((0, 1, 3, 2))
+  return neigh_x.sum(2)
+
+
+def _masked_diffusion(nutrient, mask, rate, diffusion_kernel):
+  """Return the change of a [h, w] nutrient diffusing among the cells in mask."""
+  if diffusion_kernel == "stencil":
+    return (box_sum_3x3(nutrient * mask) - nutrient * box_sum_3x3(mask)) * rate
+  neigh_nutrient = jax.lax.conv_general_dilated_patches(
+      nutrient[None,:,:, None],
+      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
+  neigh_mask = jax.lax.conv_general_dilated_patches(
+      mask[None,:,:, None],
+      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
+  return ((neigh_nutrient - nutrient[:,:, None]) * neigh_mask * rate).sum(-1)
+
+
+def _implicit_diffusion(nutrient, free_mask, source_mask, rate):
+  """Return nutrient after one backward Euler diffusion step.
+
+  Only cells in free_mask change. Cells in source_mask keep their nutrient and
+  act as boundary values for their free neighbours.
+  """
+  degree = box_sum_3x3(free_mask + source_mask)
+  # The center term of every neighbourhood cancels out of the diffusion.
+  diagonal = 1. + rate * (degree - 1.) * free_mask
+
+  def operator(x):
+    return jp.where(
+        free_mask > 0,
+        x + rate * (degree * x - box_sum_3x3(x * free_mask)),
+        x)
+
+  rhs = jp.where(
+      free_mask > 0,
+      nutrient + rate * box_sum_3x3(nutrient * source_mask),
+      nutrient)
+  new_nutrient, _ = jax.scipy.sparse.linalg.cg(
+      operator, rhs, x0=nutrient, tol=IMPLICIT_DIFFUSION_TOL,
+      maxiter=IMPLICIT_DIFFUSION_MAXITER, M=lambda x: x / diagonal)
+  return new_nutrient
+
+
+def _diffuse(nutrient, free_mask, source_mask, rate, diffusion_kernel,
+             diffusion_substeps):
+  """Return the change of a [h, w] nutrient after diffusion_substeps sub-steps.
+
+  Every sub-step diffuses with rate / diffusion_substeps. Cells in source_mask
+  keep their nutrient between sub-steps. Only the change of free cells is
+  meaningful.
+  """
+  substep_rate = rate / diffusion_substeps
+  if diffusion_kernel == "implicit":
+    new_nutrient = nutrient
+    for _ in range(diffusion_substeps):
+      new_nutrient = _implicit_diffusion(
+          new_nutrient, free_mask, source_mask, substep_rate)
+    return (new_nutrient - nutrient) * free_mask
+  if diffusion_substeps == 1:
+    return _masked_diffusion(
+        nutrient, free_mask + source_mask, rate, diffusion_kernel)
+  d_nutrient = jp.zeros_like(nutrient)
+  for _ in range(diffusion_substeps):
+    d_nutrient += _masked_diffusion(
+        nutrient + d_nutrient, free_mask + source_mask, substep_rate,
+        diffusion_kernel) * free_mask
+  return d_nutrient
+
+
+def diffusion_kernel_error(
+    env: Environment, config: EnvConfig, soil_diffusion_rate=0.1,
+    air_diffusion_rate=0.1, diffusion_kernel="stencil",
+    diffusion_substeps=1, reference_substeps=None):
+  """Compare process_energy with diffusion_kernel against the "patches" kernel.
+
+  The reference takes reference_substeps sub-steps, by default as many as the
+  candidate. Returns the maximum absolute difference of the state grids and the
+  number of cells whose type differs. The latter can only be nonzero if an
+  agent ends with an amount of nutrients that is zero in one kernel and a
+  floating point error away from zero in the other.
+  """
+  reference = process_energy(
+      env, config, soil_diffusion_rate, air_diffusion_rate,
+      diffusion_kernel="patches",
+      diffusion_substeps=reference_substeps or diffusion_substeps)
+  candidate = process_energy(
+      env, config, soil_diffusion_rate, air_diffusion_rate,
+      diffusion_kernel=diffusion_kernel, diffusion_substeps=diffusion_substeps)
+  return (jp.abs(candidate.state_grid - reference.state_grid).max(),
+          (candidate.type_grid != reference.type_grid).sum())
+
+
+def process_energy(env: Environment, config: EnvConfig, soil_diffusion_rate = 0.1, air_diffusion_rate = 0.1, return_audit=False, diffusion_kernel="patches", diffusion_substeps=1) -> Environment:
   """Process one step of energy transfer and dissipation.
   
   This function works in different steps:
@@ -1530,7 +2286,20 @@ def process_energy(env: Environment, config: EnvConfig, soil_diffusion_rate = 0.
   4) Kill energy-less agents. If an agent doesn't have either of the required
     nutrients, it gets killed and converted to either Earth, Air, or Void, 
     depending on what kind of nutrients are left.
+
+  If return_audit is True, also return a dict with the per nutrient kind totals
+  of this step: 'injected' (by IMMOVABLE and SUN), 'absorbed' (by agents),
+  'dissipated', 'leaked' (by aging), 'clipped' (to nutrient_cap), 'discarded'
+  (held by cells that cannot store that nutrient) and 'died' (held by agents
+  that got converted into materials).
+
+  diffusion_kernel selects how nutrients diffuse, one of DIFFUSION_KERNELS.
+  Diffusion is split into diffusion_substeps sub-steps, each with a fraction of
+  the diffusion rates, which keeps the fields smooth at high rates.
   """
+  if diffusion_kernel not in DIFFUSION_KERNELS:
+    raise ValueError(f"Unknown diffusion kernel {diffusion_kernel}, expected "
+                     f"one of {DIFFUSION_KERNELS}")
   # How it works: The top gets padded with 'air' that contains maximum air nutrient.
   # IMMOVABLE (for now) is treated as earth as it had maximum earth nutrient.
   # then, we perform diffusion of the nutrients (air to air, earth to earth).
@@ -1549,14 +2318,9 @@ def process_energy(env: Environment, config: EnvConfig, soil_diffusion_rate = 0.
                                    ] * is_immovable_grid_f)
   # diffuse this nutrient to all earth (+ immovable, which remains unchanged).
   EARTH_DIFFUSION_RATE = soil_diffusion_rate
-  neigh_earth_nutrient = jax.lax.conv_general_dilated_patches(
-      earth_nutrient[None,:,:, None],
-      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
-  neigh_earth_mask = jax.lax.conv_general_dilated_patches(
-      (is_earth_grid_f+is_immovable_grid_f)[None,:,:, None],
-      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
-  d_earth_n = ((neigh_earth_nutrient - earth_nutrient[:,:, None]
-                ) * neigh_earth_mask * EARTH_DIFFUSION_RATE).sum(-1)
+  d_earth_n = _diffuse(
+      earth_nutrient, is_earth_grid_f, is_immovable_grid_f,
+      EARTH_DIFFUSION_RATE, diffusion_kernel, diffusion_substeps)
 
   # discard immovable nutrients.
   new_earth_nutrient = (earth_nutrient + d_earth_n) * is_earth_grid_f
@@ -1570,15 +2334,9 @@ def process_energy(env: Environment, config: EnvConfig, soil_diffusion_rate = 0.
   # diffuse this nutrient to all air (+ sun, which remains unchanged.)
   AIR_DIFFUSION_RATE = air_diffusion_rate
 
-  # compute neighbors
-  neigh_air_nutrient = jax.lax.conv_general_dilated_patches(
-      air_nutrient[None,:,:, None],
-      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
-  neigh_air_mask = jax.lax.conv_general_dilated_patches(
-      (is_air_grid_f+is_sun_grid_f)[None,:,:, None],
-      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
-  d_air_n = ((neigh_air_nutrient - air_nutrient[:,:, None]
-              ) * neigh_air_mask * AIR_DIFFUSION_RATE).sum(-1)
+  d_air_n = _diffuse(
+      air_nutrient, is_air_grid_f, is_sun_grid_f,
+      AIR_DIFFUSION_RATE, diffusion_kernel, diffusion_substeps)
 
   # discard sun nutrients.
   new_air_nutrient = (air_nutrient + d_air_n) * is_air_grid_f
@@ -1594,28 +2352,14 @@ def process_energy(env: Environment, config: EnvConfig, soil_diffusion_rate = 0.
   # this is how much is available.
   available_nutrients = jp.stack([new_earth_nutrient, new_air_nutrient], -1)
   # compute the total amount of asking nutrients per cell and nutrient kind.
-  neigh_asking_nutrients = jax.lax.conv_general_dilated_patches(
-      asking_nutrients[None,:],
-      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
-  # we want to have [h,w,9,c] so that the indexing is intuitive and consistent
-  # for both neigh vectors.
-  neigh_asking_nutrients = neigh_asking_nutrients.reshape(
-      neigh_asking_nutrients.shape[:2] + (2, 9)).transpose((0, 1, 3, 2))
-  tot_asking_nutrients = neigh_asking_nutrients.sum(2)
+  tot_asking_nutrients = _neighbourhood_sum(asking_nutrients, diffusion_kernel)
   # then output the percentage you can give.
   perc_to_give = (available_nutrients / tot_asking_nutrients.clip(1e-6)
                   ).clip(0, 1)
   # also update your nutrients accordingly.
   new_mat_nutrients = (available_nutrients - tot_asking_nutrients).clip(0.)
   # and give this energy to the agents, scaled by this percentage.
-  absorb_perc = jax.lax.conv_general_dilated_patches(
-      perc_to_give[None,:],
-      (3, 3), (1, 1), "SAME", dimension_numbers=("NHWC", "OIHW", "NHWC"))[0]
-  # we want to have [h,w,9,c] so that the indexing is intuitive and consistent
-  # for both neigh vectors.
-  absorb_perc = absorb_perc.reshape(
-      absorb_perc.shape[:2] + (2, 9)).transpose((0, 1, 3, 2))
-  absorb_perc = absorb_perc.sum(2)
+  absorb_perc = _neighbourhood_sum(perc_to_give, diffusion_kernel)
   absorbed_energy = absorb_perc * asking_nutrients
 
   ### Energy dissipation at every step.
@@ -1629,12 +2373,14 @@ def process_energy(env: Environment, config: EnvConfig, soil_diffusion_rate = 0.
   dissipated_energy = (config.dissipation_per_step * agent_dissipation_rate *
                        is_agent_grid_e_f)
 
+  pre_dissipation_energy = (
+      env.state_grid[:,:, evm.EN_ST:evm.EN_ST+2] + absorbed_energy)
   new_agent_energy = (
       is_agent_grid_e_f * (
-          env.state_grid[:,:, evm.EN_ST:evm.EN_ST+2] + absorbed_energy -
-          dissipated_energy).clip(0, config.nutrient_cap))
+          pre_dissipation_energy - dissipated_energy).clip(0, config.nutrient_cap))
   # new_energy includes earth, air, and agent energies.
   new_energy = new_mat_nutrients + new_agent_energy
+  pre_leak_energy = new_energy
 
   ### AGING: if the cell is older than half max lifetime, they leak energy.
   # energy is leaked in a linearly increasing fashion.
@@ -1666,7 +2412,30 @@ def process_energy(env: Environment, config: EnvConfig, soil_diffusion_rate = 0.
   new_agent_id_grid = (
       env.agent_id_grid * (1 - kill_agent_int) +
       kill_agent_int * (jp.zeros_like(env.type_grid, dtype=jp.uint32)))
-  return Environment(new_type_grid, new_state_grid, new_agent_id_grid)
+  new_env = Environment(new_type_grid, new_state_grid, new_agent_id_grid)
+  if return_audit:
+    # Every sum is over the grid, so that each value has one entry per nutrient
+    # kind: [earth, air].
+    old_energy = env.state_grid[:,:, evm.EN_ST:evm.EN_ST+2]
+    # earth and air only keep their own nutrients, agents keep both.
+    keeps_energy = (jp.stack([is_earth_grid_f, is_air_grid_f], -1) +
+                    is_agent_grid_e_f)
+    # agents pay dissipation only with the nutrients they have.
+    after_dissipation = (pre_dissipation_energy - dissipated_energy).clip(0)
+    audit = {
+        "injected": jp.stack([(d_earth_n * is_earth_grid_f).sum(),
+                              (d_air_n * is_air_grid_f).sum()]),
+        "absorbed": (absorbed_energy * is_agent_grid_e_f).sum((0, 1)),
+        "dissipated": ((pre_dissipation_energy - after_dissipation) *
+                       is_agent_grid_e_f).sum((0, 1)),
+        "leaked": (pre_leak_energy * (1. - keep_perc[..., None])).sum((0, 1)),
+        "clipped": ((after_dissipation - after_dissipation.clip(
+            0, config.nutrient_cap)) * is_agent_grid_e_f).sum((0, 1)),
+        "discarded": (old_energy * (1. - keeps_energy)).sum((0, 1)),
+        "died": (new_energy * kill_agent_e_f).sum((0, 1)),
+    }
+    return new_env, audit
+  return new_env
 
 
 ### Processing age.
@@ -1680,7 +2449,8 @@ def env_increase_age(env: Environment, etd: EnvTypeDef) -> Environment:
 
 ### Balancing the soil
 
-def balance_soil(key: KeyType, env: Environment, config: EnvConfig):
+def balance_soil(key: KeyType, env: Environment, config: EnvConfig,
+                 return_audit=False):
   """Balance the earth/air proportion for each vertical slice.
 
   If any vertical slice has a proportion of Earth to air past the
@@ -1695,6 +2465,9 @@ def balance_soil(key: KeyType, env: Environment, config: EnvConfig):
   Note that if agent cells are at the boundary, nothing happens. So, if plants
   actually survive past the boundary, as long as they don't die, soil is not
   balanced.
+
+  If return_audit is True, also return a dict with the nutrients (per nutrient
+  kind) held by the replaced cells.
   """
   type_grid = env.type_grid
   etd = config.etd
@@ -1739,6 +2512,8 @@ def balance_soil(key: KeyType, env: Environment, config: EnvConfig):
   # We need to reset the state too.
   state_grid = env.state_grid
   old_state_slice = state_grid[target_for_air, column_idx]
+  overwritten = (make_air_mask[..., None] *
+                 old_state_slice[..., evm.EN_ST : evm.EN_ST+2]).sum(0)
   state_grid = state_grid.at[target_for_air, column_idx].set(
       jp.zeros_like(old_state_slice) * make_air_mask[..., None] +
       old_state_slice * (1 - make_air_mask[..., None]))
@@ -1754,9 +2529,13 @@ def balance_soil(key: KeyType, env: Environment, config: EnvConfig):
   env = evm.update_env_type_grid(env, type_grid)
   # We need to reset the state too.
   old_state_slice = state_grid[best_idx_per_column, column_idx]
+  overwritten += (make_earth_mask[..., None] *
+                  old_state_slice[..., evm.EN_ST : evm.EN_ST+2]).sum(0)
   state_grid = state_grid.at[best_idx_per_column, column_idx].set(
       jp.zeros_like(old_state_slice) * make_earth_mask[..., None] +
       old_state_slice * (1 - make_earth_mask[..., None]))
   env = evm.update_env_state_grid(env, state_grid)
 
+  if return_audit:
+    return env, {"overwritten": overwritten}
   return env
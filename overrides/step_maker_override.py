@@ -23,6 +23,7 @@ from typing import Callable, Iterable
 
 from jax import jit
 from jax import vmap
+import jax.numpy as jp
 import jax.random as jr
 
 from self_organising_systems.biomakerca.agent_logic import AgentLogic
@@ -30,20 +31,27 @@ from self_organising_systems.biomakerca.cells_logic import air_cell_op
 from self_organising_systems.biomakerca.cells_logic import earth_cell_op
 from self_organising_systems.biomakerca.env_logic import AgentProgramType
 from self_organising_systems.biomakerca.env_logic import ExclusiveOp
-from self_organising_systems.biomakerca.env_logic import balance_soil
 from self_organising_systems.biomakerca.env_logic import env_increase_age
-from self_organising_systems.biomakerca.env_logic import env_perform_exclusive_update
-from self_organising_systems.biomakerca.env_logic import env_perform_reproduce_update
-from self_organising_systems.biomakerca.env_logic import env_perform_parallel_update
-from self_organising_systems.biomakerca.env_logic import env_process_gravity
 from self_organising_systems.biomakerca.env_logic import EnvTypeType
-from self_organising_systems.biomakerca.env_logic import intercept_reproduce_ops
 from self_organising_systems.biomakerca.env_logic import KeyType
 from self_organising_systems.biomakerca.env_logic import PerceivedData
-from self_organising_systems.biomakerca.env_logic import process_energy
-from self_organising_systems.biomakerca.env_logic import (
-    process_structural_integrity_n_times,
+from overrides.env_logic_override import NutrientAudit
+from overrides.env_logic_override import balance_soil
+from overrides.env_logic_override import compact_agents
+from overrides.env_logic_override import env_perform_exclusive_update
+from overrides.env_logic_override import env_perform_reproduce_update
+from overrides.env_logic_override import env_perform_parallel_update
+from overrides.env_logic_override import env_process_gravity
+from overrides.env_logic_override import intercept_reproduce_ops
+from overrides.env_logic_override import perceive_neighbors
+from overrides.env_logic_override import process_energy
+from overrides.env_logic_override import (
+    process_structural_integrity_with_kernel,
 )
+from overrides.env_logic_override import STAGE_WRITES
+from overrides.env_logic_override import total_nutrients
+from overrides.env_logic_override import update_agent_compaction
+from overrides.env_logic_override import update_perception
 from self_organising_systems.biomakerca.environments import EnvConfig
 from self_organising_systems.biomakerca.environments import Environment
 from self_organising_systems.biomakerca.mutators import Mutator
@@ -59,6 +67,15 @@ from self_organising_systems.biomakerca.mutators import Mutator
         "mutate_programs",
         "mutator",
         "intercept_reproduction",
+        "audit_nutrients",
+        "diffusion_kernel",
+        "diffusion_substeps",
+        "gravity_kernel",
+        "structural_integrity_kernel",
+        "share_perception",
+        "active_region",
+        "n_sparse_max",
+        "batched_seed_placement",
     ],
 )
 def step_env(
@@ -77,6 +94,15 @@ def step_env(
     min_repr_energy_requirement=None,
     soil_diffusion_rate=0.1,
     air_diffusion_rate=0.1,
+    audit_nutrients=False,
+    diffusion_kernel="patches",
+    diffusion_substeps=1,
+    gravity_kernel="scan",
+    structural_integrity_kernel="reference",
+    share_perception=False,
+    active_region=False,
+    n_sparse_max=None,
+    batched_seed_placement=False,
 ):
     """Perform one step for the environment.
 
@@ -113,9 +139,44 @@ def step_env(
       min_repr_energy_requirement: relevant only if intercepting reproductions.
         Determines whether the intercepted seed would have had enough energy to
         count as a successful reproduction.
+      audit_nutrients: if True, also return a NutrientAudit of this step. The
+        audit is computed on device alongside the step and is meant to validate
+        alternative kernels against this one. Every stage reports what its ops
+        destroyed and moved, so see nutrient_audit_residual for the check.
+      diffusion_kernel: how process_energy computes nutrient diffusion, one of
+        DIFFUSION_KERNELS. "patches" is the reference, "stencil" avoids building
+        neighbourhood patch tensors and "implicit" solves every sub-step with
+        backward Euler. See diffusion_kernel_error.
+      diffusion_substeps: the number of diffusion sub-steps per step, each with
+        a fraction of the diffusion rates.
+      gravity_kernel: how gravity is processed, one of GRAVITY_KERNELS. "scan"
+        goes line by line, "parallel" processes all lines at once with the same
+        results. See gravity_kernel_mismatches.
+      structural_integrity_kernel: how the 5 steps of structural integrity
+        are processed, one of STRUCTURAL_INTEGRITY_KERNELS. All give the same
+        results, "converge" stops once the structural integrity is stable. See
+        structural_integrity_mismatches.
+      share_perception: if True, the grid is perceived once before reproduction
+        and that perception is updated after every stage instead of perceived
+        again by every stage. Only the parts of it whose grid changed are
+        recomputed, see update_perception. The results are identical.
+      active_region: if True, agent logic only runs over the bounding box of
+        all agents (plus a margin), rounded up to a few static window sizes.
+        See compute_active_agent_cell_f. The results are identical.
+      n_sparse_max: if set, agent logic runs sparsely for up to n_sparse_max
+        agents. Stages with more agents alive fall back to the dense (or active
+        region) computation, so no agent is skipped. Every value compiles its
+        own step, so use a few bucketed values, see SparseBudget. The agent
+        cells are compacted once per step and shared by all stages, and only
+        compacted again if reproduction placed new agents.
+      batched_seed_placement: if True, all seeds of a step are placed at once
+        instead of one after the other, see env_try_place_seeds_batched. This
+        changes the random numbers used, so results are only statistically
+        the same.
     Returns:
       an updated environment. If intercept_reproduction is True, returns also the
-      number of successful reproductions intercepted.
+      number of successful reproductions intercepted. If audit_nutrients is True,
+      returns also the NutrientAudit.
     """
     etd = config.etd
     if excl_fs is None:
@@ -129,30 +190,60 @@ def step_env(
         agent_params
     )
 
+    if audit_nutrients:
+        initial_nutrients = total_nutrients(env)
+        overwritten = jp.zeros_like(initial_nutrients)
+        reproduced = jp.zeros_like(initial_nutrients)
+
     if config.soil_unbalance_limit > 0:
         ku, key = jr.split(key)
-        env = balance_soil(ku, env, config)
+        if audit_nutrients:
+            env, balance_audit = balance_soil(ku, env, config, return_audit=True)
+            overwritten += balance_audit["overwritten"]
+        else:
+            env = balance_soil(ku, env, config)
 
     # do a few steps of structural integrity:
-    env = process_structural_integrity_n_times(env, config, 5)
+    env = process_structural_integrity_with_kernel(
+        env, config, 5, structural_integrity_kernel
+    )
 
-    env = env_process_gravity(env, etd)
+    env = env_process_gravity(env, etd, gravity_kernel)
+
+    perc = perceive_neighbors(env, etd) if share_perception else None
+    compaction = (
+        compact_agents(env.type_grid, etd, n_sparse_max)
+        if n_sparse_max is not None
+        else None
+    )
 
     # doing reproduction here to actually show the flowers at least for one step.
     if do_reproduction:
+        before_env = env
         repr_f = agent_logic.repr_f
         if intercept_reproduction:
             # Reproduction just destroys flowers. but we keep track of 'successful'
             # reproductions and return that as an extra value.
             # this is useful only for evolving plants outside of a full environment.
             ku, key = jr.split(key)
-            env, n_successful_repr = intercept_reproduce_ops(
-                ku, env, repr_programs, config, repr_f, min_repr_energy_requirement
-            )
+            if audit_nutrients:
+                env, n_successful_repr, repr_audit = intercept_reproduce_ops(
+                    ku,
+                    env,
+                    repr_programs,
+                    config,
+                    repr_f,
+                    min_repr_energy_requirement,
+                    return_audit=True,
+                )
+            else:
+                env, n_successful_repr = intercept_reproduce_ops(
+                    ku, env, repr_programs, config, repr_f, min_repr_energy_requirement
+                )
         else:
             ku, key = jr.split(key)
             if mutate_programs:
-                env, programs = env_perform_reproduce_update(
+                repr_result = env_perform_reproduce_update(
                     ku,
                     env,
                     repr_programs,
@@ -161,28 +252,144 @@ def step_env(
                     mutate_programs,
                     programs,
                     mutator.mutate,
+                    perc=perc,
+                    active_region=active_region,
+                    n_sparse_max=n_sparse_max,
+                    sparse_fallback=True,
+                    compaction=compaction,
+                    batched_seed_placement=batched_seed_placement,
+                    return_audit=audit_nutrients,
                 )
             else:
-                env = env_perform_reproduce_update(
-                    ku, env, repr_programs, config, repr_f
+                repr_result = env_perform_reproduce_update(
+                    ku,
+                    env,
+                    repr_programs,
+                    config,
+                    repr_f,
+                    perc=perc,
+                    active_region=active_region,
+                    n_sparse_max=n_sparse_max,
+                    sparse_fallback=True,
+                    compaction=compaction,
+                    batched_seed_placement=batched_seed_placement,
+                    return_audit=audit_nutrients,
                 )
+            if audit_nutrients:
+                repr_result, repr_audit = repr_result
+            if mutate_programs:
+                env, programs = repr_result
+            else:
+                env = repr_result
+        if audit_nutrients:
+            reproduced = repr_audit["destroyed"] - repr_audit["seeded"]
+        if share_perception:
+            perc = update_perception(
+                perc, before_env, env, etd, STAGE_WRITES["reproduce"]
+            )
+        # later stages only change the specialization of agents or kill them.
+        if n_sparse_max is not None:
+            compaction = update_agent_compaction(compaction, env.type_grid, etd)
 
     # parallel updates
     k1, key = jr.split(key)
-    env = env_perform_parallel_update(k1, env, par_programs, config, agent_logic.par_f)
+    before_env = env
+    if audit_nutrients:
+        env, parallel_audit = env_perform_parallel_update(
+            k1,
+            env,
+            par_programs,
+            config,
+            agent_logic.par_f,
+            return_audit=True,
+            perc=perc,
+            active_region=active_region,
+            n_sparse_max=n_sparse_max,
+            sparse_fallback=True,
+            compaction=compaction,
+        )
+    else:
+        env = env_perform_parallel_update(
+            k1,
+            env,
+            par_programs,
+            config,
+            agent_logic.par_f,
+            perc=perc,
+            active_region=active_region,
+            n_sparse_max=n_sparse_max,
+            sparse_fallback=True,
+            compaction=compaction,
+        )
+    if share_perception:
+        perc = update_perception(perc, before_env, env, etd, STAGE_WRITES["parallel"])
+    before_env = env
 
     # energy absorbed and generated by materials.
-    env = process_energy(env, config, soil_diffusion_rate, air_diffusion_rate)
+    if audit_nutrients:
+        env, energy_audit = process_energy(
+            env,
+            config,
+            soil_diffusion_rate,
+            air_diffusion_rate,
+            return_audit=True,
+            diffusion_kernel=diffusion_kernel,
+            diffusion_substeps=diffusion_substeps,
+        )
+    else:
+        env = process_energy(
+            env,
+            config,
+            soil_diffusion_rate,
+            air_diffusion_rate,
+            diffusion_kernel=diffusion_kernel,
+            diffusion_substeps=diffusion_substeps,
+        )
+
+    if share_perception:
+        perc = update_perception(perc, before_env, env, etd, STAGE_WRITES["energy"])
 
     # exclusive updates
     k1, key = jr.split(key)
-    env = env_perform_exclusive_update(
-        k1, env, excl_programs, config, excl_fs, agent_logic.excl_f
+    excl_result = env_perform_exclusive_update(
+        k1,
+        env,
+        excl_programs,
+        config,
+        excl_fs,
+        agent_logic.excl_f,
+        perc=perc,
+        active_region=active_region,
+        n_sparse_max=n_sparse_max,
+        sparse_fallback=True,
+        compaction=compaction,
+        return_audit=audit_nutrients,
     )
+    if audit_nutrients:
+        env, exclusive_audit = excl_result
+        overwritten += exclusive_audit["overwritten"]
+    else:
+        env = excl_result
 
     # increase age.
     env = env_increase_age(env, etd)
 
     rval = (env, programs) if mutate_programs else env
     rval = (rval, n_successful_repr) if intercept_reproduction else rval
+    if audit_nutrients:
+        audit = NutrientAudit(
+            initial=initial_nutrients,
+            final=total_nutrients(env),
+            injected=energy_audit["injected"],
+            absorbed=energy_audit["absorbed"],
+            dissipated=energy_audit["dissipated"],
+            leaked=energy_audit["leaked"],
+            clipped=parallel_audit["clipped"] + energy_audit["clipped"],
+            discarded=energy_audit["discarded"],
+            spent=parallel_audit["spent"],
+            died=energy_audit["died"],
+            reproduced=reproduced,
+            overwritten=overwritten,
+        )
+        rval = (rval, audit)
     return rval
@@ -1,110 +1,97 @@
-from glob import glob
+import argparse
 
-from pprint import pprint
-import pandas as pd
-import wandb
-from scipy.stats import ttest_ind, ttest_rel
+import numpy as np
 
+from utils.constants import logger
+from utils.metrics_store import MetricsStore, StoreSink
+from utils.publish_utils import RunSpec, WandbSink, publish_runs
+from utils.resampling_utils import resample_scenarios
+from utils.statistics_utils import SCENARIOS, compare_scenarios, load_results
 
-def main():
-    total_counts_dir = "/home/janneke/Documents/Master/Natural Computing/NaCO_project/analysis_results/general"
-    separate_counts_dir = "/home/janneke/Documents/Master/Natural Computing/NaCO_project/analysis_results/nutrients"
-
-    total_counts = get_total_agent_counts(total_counts_dir)
-    flower_counts, root_counts, leaf_counts = get_separate_agent_counts(separate_counts_dir)
-
-    counts_dict = {
-        "total": total_counts, 
-        "root": root_counts, 
-        "leaf": leaf_counts, 
-        "flower": flower_counts, 
-    }
-
-    pprint(counts_dict)
-
-    for agent_type, year_data in counts_dict.items():
-        run = wandb.init(project="naco_statistics", job_type="general", name=f"{agent_type.capitalize()}s")
-        run.define_metric("P-value")
-        run.define_metric("T-statistic")
-        run.define_metric("Month")
+PROJECT = "naco_statistics"
+COUNT_METRICS = ["agent_count", "root_count", "leaf_count", "flower_count"]
 
-        for month, month_data in year_data.items():
-            normal_counts = month_data["normal"]
-            warm_counts = month_data["warm"]
 
-            result = ttest_rel(normal_counts, warm_counts)
-            wandb.log({
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="Read the per frame metrics from this metrics store file instead of the results dataset.",
+    )
+    parser.add_argument(
+        "--scenarios",
+        nargs=2,
+        default=SCENARIOS,
+        help="Baseline and compared scenario.",
+    )
+    parser.add_argument(
+        "--output-store",
+        default=None,
+        help="Write the statistics to metrics stores in this directory instead of wandb.",
+    )
+    args = parser.parse_args()
+
+    counts = get_agent_counts(args.store, args.scenarios)
+    baseline, compared_scenario = args.scenarios
+    compared, statistics = compare_scenarios(counts, baseline)
+    _, resampled = resample_scenarios(counts, baseline, seed=0)
+    statistics.update(resampled)
+    compared_index = compared.index(compared_scenario)
+
+    runs = []
+    for metric_index, metric in enumerate(counts.metrics):
+        agent_type = "total" if metric == "agent_count" else metric.split("_")[0]
+        logger.info(
+            f"{agent_type}: p-values {np.round(statistics['p_value'][compared_index, :, metric_index], 4)}"
+        )
+        rows = [
+            {
                 "Month": month,
-                f"P-value": result[1],
-                f"T-statistic": result[0],
-            })
-
-        run.finish()
-    
-    run = wandb.init(project="naco_statistics", job_type="general", name=f"Threshold")
-    run.define_metric("P-value")
-    for month in range(1, 13):
-        wandb.log({
-            "P-value": 0.05,
-            "Month": month
-        })
-    run.finish()
-    
-
-def get_total_agent_counts(dir: str):
-    sim_files_normal = glob(f"{dir}/basic_seasons/*")
-    sim_files_warm = glob(f"{dir}/warm_winter_month/*")
-
-    counts = {}
-
-    for file_month_normal, file_month_warm in zip(sim_files_normal, sim_files_warm):
-        normal_count = list(pd.read_csv(file_month_normal)["Total in Month"])
-        warm_count = list(pd.read_csv(file_month_warm)["Total in Month"])
-
-        for month in range(1, 13):
-            if month not in counts:
-                counts[month] = {"normal": [], "warm": []}
-            counts[month]["normal"].append(normal_count[month - 1])
-            counts[month]["warm"].append(warm_count[month - 1])
-
-    return counts
-
-
-def get_separate_agent_counts(dir: str):
-    sim_files_normal = glob(f"{dir}/basic_seasons/*")
-    sim_files_warm = glob(f"{dir}/warm_winter_month/*")
-
-    flower_counts = {}
-    root_counts = {}
-    leaf_counts = {}
-
-    for file_month_normal, file_month_warm in zip(sim_files_normal, sim_files_warm):
-        normal_count = pd.read_csv(file_month_normal)
-        normal_flower_count = list(normal_count[normal_count["Agent Type"] == "flower agent count"]["Agent Type Count"])
-        normal_root_count = list(normal_count[normal_count["Agent Type"] == "root agent count"]["Agent Type Count"])
-        normal_leaf_count = list(normal_count[normal_count["Agent Type"] == "leaf agent count"]["Agent Type Count"])
-
-        warm_count = pd.read_csv(file_month_warm)
-        warm_flower_count = list(warm_count[warm_count["Agent Type"] == "flower agent count"]["Agent Type Count"])
-        warm_root_count = list(warm_count[warm_count["Agent Type"] == "root agent count"]["Agent Type Count"])
-        warm_leaf_count = list(warm_count[warm_count["Agent Type"] == "leaf agent count"]["Agent Type Count"])
-
-        for month in range(1, 13):
-            if month not in flower_counts:
-                flower_counts[month] = {"normal": [], "warm": []}
-                root_counts[month] = {"normal": [], "warm": []}
-                leaf_counts[month] = {"normal": [], "warm": []}
-            
-            flower_counts[month]["normal"].append(normal_flower_count[month - 1])
-            root_counts[month]["normal"].append(normal_root_count[month - 1])
-            leaf_counts[month]["normal"].append(normal_leaf_count[month - 1])
-
-            flower_counts[month]["warm"].append(warm_flower_count[month - 1])
-            root_counts[month]["warm"].append(warm_root_count[month - 1])
-            leaf_counts[month]["warm"].append(warm_leaf_count[month - 1])
-
-    return flower_counts, root_counts, leaf_counts
+                "P-value": statistics["p_value"][compared_index, month - 1, metric_index],
+                "T-statistic": statistics["t_statistic"][compared_index, month - 1, metric_index],
+                "Permutation P-value": statistics["permutation_p_value"][compared_index, month - 1, metric_index],
+                "Difference CI Low": statistics["ci_low"][compared_index, month - 1, metric_index],
+                "Difference CI High": statistics["ci_high"][compared_index, month - 1, metric_index],
+            }
+            for month in range(1, len(counts.months) + 1)
+        ]
+        runs.append((make_run_spec(f"{agent_type.capitalize()}s"), rows))
+
+    runs.append(
+        (
+            make_run_spec("Threshold"),
+            [{"P-value": 0.05, "Month": month} for month in range(1, 13)],
+        )
+    )
+
+    sink = StoreSink(args.output_store) if args.output_store else WandbSink()
+    failed = publish_runs(
+        sink,
+        runs,
+        metrics=["P-value", "T-statistic", "Permutation P-value", "Month"],
+        max_workers=1,
+    )
+    if isinstance(sink, StoreSink):
+        sink.close()
+    if failed:
+        logger.error(f"Failed to publish {len(failed)} runs: {failed}")
+
+
+def make_run_spec(name):
+    return RunSpec(PROJECT, None, "general", name, None, {})
+
+
+def get_agent_counts(store_file=None, scenarios=SCENARIOS):
+    """Return the total and per agent type counts as one SimulationResults."""
+    if store_file is None:
+        return load_results(COUNT_METRICS, scenarios=scenarios)
+    store = MetricsStore(store_file)
+    try:
+        return load_results(COUNT_METRICS, scenarios=scenarios, store=store)
+    finally:
+        store.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
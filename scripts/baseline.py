@@ -1,7 +1,7 @@
 import json
 import random
 import json
-import cv2
+from contextlib import ExitStack
 from datetime import datetime
 
 import jax.random as jr
@@ -17,10 +17,18 @@ from self_organising_systems.biomakerca.mutators import (
 )
 
 import overrides.env_logic_override as env_override
+from utils.budget_utils import SparseBudget
 
 # Overriding the default environment logic with a custom one
 from utils.environment_utils import EnvironmentHistory
 from utils.pickle_utils import load_environment
+from utils.rendering_utils import (
+    render_environment_views,
+    thumbnail_view,
+    tracking_view,
+    view_frame_shape,
+)
+from utils.video_utils import VideoSink
 
 env_logic.process_energy = env_override.process_energy
 
@@ -38,19 +46,9 @@ from utils.biomaker_utils import (
     start_simulation,
 )
 
-
-def pad_text(img, text):
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    orgin = (5, 15)
-    fontScale = 0.5
-    color = (0, 0, 0)
-    thickness = 1
-
-    new_h = img.shape[0] // 15
-    new_h = new_h if new_h % 2 == 0 else new_h + 1
-    img = np.concatenate([np.ones([new_h, img.shape[1], img.shape[2]]), img], 0)
-    img = cv2.putText(img, text, orgin, font, fontScale, color, thickness, cv2.LINE_AA)
-    return img
+# Views written next to the full video, from the same frames, e.g.
+# [thumbnail_view(4), tracking_view((32, 64), zoom_sz=4)].
+EXTRA_VIEWS = []
 
 
 def make_configs(base_config: SeasonsConfig):
@@ -119,12 +117,34 @@ def run_seasons(
     environmentHistory = EnvironmentHistory(base_config, days_since_start, folder)
 
     frame = start_simulation(env, base_config, env_config)
-    with media.VideoWriter(
-        base_config.out_file, shape=frame.shape[:2], fps=base_config.fps, crf=18
-    ) as video:
+    view_frames = render_environment_views([env], env_config, EXTRA_VIEWS)
+    with ExitStack() as videos:
+        video = videos.enter_context(
+            VideoSink(
+                base_config.out_file, shape=frame.shape[:2], fps=base_config.fps, crf=18
+            )
+        )
+        extra_videos = [
+            (
+                view,
+                videos.enter_context(
+                    VideoSink(
+                        base_config.out_file.replace(".mp4", f"_{view.name}.mp4"),
+                        shape=view_frame_shape(view, view_frames[view.name]),
+                        fps=base_config.fps,
+                        crf=18,
+                    )
+                ),
+            )
+            for view in EXTRA_VIEWS
+        ]
+        sparse_budget = (
+            SparseBudget(env.type_grid.size) if base_config.sparse_budget else None
+        )
         step = 0
         for year in range(base_config.years):
             for month_params in base_config.month_params.items():
+                frame_steps = []
                 step, env, programs, env_history = perform_simulation(
                     env,
                     programs,
@@ -138,9 +158,16 @@ def run_seasons(
                     frame,
                     step=step,
                     season=f"{month_params[0]} {year + 1}",
+                    frame_steps=frame_steps,
+                    extra_videos=extra_videos,
+                    sparse_budget=sparse_budget,
                 )
                 environmentHistory.add_all(
-                    env_history, month_params[1]['Season'], month_params[0], year
+                    env_history,
+                    month_params[1]['Season'],
+                    month_params[0],
+                    year,
+                    steps=frame_steps,
                 )
 
     return programs, env, environmentHistory
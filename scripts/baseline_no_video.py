@@ -1,7 +1,6 @@
 import json
 import random
 
-import cv2
 import jax.random as jr
 import mediapy as media
 import numpy as np
@@ -37,20 +36,6 @@ from utils.biomaker_util_no_video import (
 )
 
 
-def pad_text(img, text):
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    orgin = (5, 15)
-    fontScale = 0.5
-    color = (0, 0, 0)
-    thickness = 1
-
-    new_h = img.shape[0] // 15
-    new_h = new_h if new_h % 2 == 0 else new_h + 1
-    img = np.concatenate([np.ones([new_h, img.shape[1], img.shape[2]]), img], 0)
-    img = cv2.putText(img, text, orgin, font, fontScale, color, thickness, cv2.LINE_AA)
-    return img
-
-
 def make_configs(base_config: SeasonsConfig):
     run_id = random.randint(0, 99999999)
     config_dict = dict(
@@ -122,6 +107,7 @@ def run_seasons(
     step = 0
     for year in range(base_config.years):
         for month_params in base_config.month_params.items():
+            frame_steps = []
             step, env, programs, env_history = perform_simulation(
                 env,
                 programs,
@@ -135,9 +121,14 @@ def run_seasons(
                 frame,
                 step=step,
                 season=f"{month_params[0]} {year + 1}",
+                frame_steps=frame_steps,
             )
             environmentHistory.add_all(
-                env_history, month_params[1]['Season'], month_params[0], year
+                env_history,
+                month_params[1]['Season'],
+                month_params[0],
+                year,
+                steps=frame_steps,
             )
 
     return programs, env, environmentHistory
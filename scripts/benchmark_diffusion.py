@@ -0,0 +1,79 @@
+import argparse
+import time
+from functools import partial
+
+import jax
+from jax import jit
+from self_organising_systems.biomakerca import environments as evm
+
+from overrides.env_logic_override import diffusion_kernel_error, process_energy
+from utils.constants import logger
+
+
+def time_process_energy(env, env_config, rate, diffusion_kernel, diffusion_substeps, repeats):
+    """Return the mean seconds of one compiled process_energy call."""
+    step = jit(
+        partial(
+            process_energy,
+            config=env_config,
+            soil_diffusion_rate=rate,
+            air_diffusion_rate=rate,
+            diffusion_kernel=diffusion_kernel,
+            diffusion_substeps=diffusion_substeps,
+        )
+    )
+    jax.block_until_ready(step(env))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        jax.block_until_ready(step(env))
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time process_energy per diffusion kernel over grid sizes. "
+        "Errors are the max absolute state difference to the patches kernel with "
+        "the same number of sub-steps as the explicit runs."
+    )
+    parser.add_argument("--ec-id", default="pestilence")
+    parser.add_argument("--width-type", default="landscape")
+    parser.add_argument("--heights", type=int, nargs="+", default=[72, 150, 300, 600])
+    parser.add_argument("--rate", type=float, default=0.1)
+    parser.add_argument("--substeps", type=int, default=8)
+    parser.add_argument("--implicit-substeps", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    runs = [
+        ("patches", args.substeps),
+        ("stencil", args.substeps),
+        ("implicit", args.implicit_substeps),
+    ]
+    for h in args.heights:
+        env, env_config = evm.get_env_and_config(
+            args.ec_id, width_type=args.width_type, h=h
+        )
+        for diffusion_kernel, diffusion_substeps in runs:
+            seconds = time_process_energy(
+                env, env_config, args.rate, diffusion_kernel, diffusion_substeps, args.repeats
+            )
+            error, _ = jit(
+                partial(
+                    diffusion_kernel_error,
+                    config=env_config,
+                    soil_diffusion_rate=args.rate,
+                    air_diffusion_rate=args.rate,
+                    diffusion_kernel=diffusion_kernel,
+                    diffusion_substeps=diffusion_substeps,
+                    reference_substeps=args.substeps,
+                )
+            )(env)
+            logger.info(
+                f"{h}x{env.type_grid.shape[1]} {diffusion_kernel:>8} "
+                f"substeps={diffusion_substeps:<3} {seconds * 1e3:9.3f} ms "
+                f"max error {float(error):.2e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
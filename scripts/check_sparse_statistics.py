@@ -0,0 +1,118 @@
+import argparse
+import sys
+import tempfile
+
+import numpy as np
+
+from configs.seasons_config import SeasonsConfig
+from scripts.run_experiments import make_configs, run_seasons
+from utils.constants import logger
+from utils.metrics_store import MetricsStore, StoreSink, store_path
+from utils.statistics_utils import compare_scenarios, load_results
+
+DENSE_SCENARIO = "dense"
+SPARSE_SCENARIO = "sparse"
+COMPARED_METRICS = [
+    "agent_count",
+    "plant_count",
+    "root_count",
+    "leaf_count",
+    "flower_count",
+    "air_nutrients_in_air",
+    "soil_nutrients_in_soil",
+]
+
+
+def run_sim(scenario, sim, args, sink):
+    """Simulate one sim of a scenario from a fresh env, logging into sink.
+
+    The sparse scenario enables the options that only match the dense step
+    statistically, the dense one keeps them off.
+    """
+    config = SeasonsConfig(scenario, args.years, args.days_in_year, simulation=sim)
+    config.sparse_budget = scenario == SPARSE_SCENARIO and "sparse_budget" in args.options
+    config.batched_seed_placement = (
+        scenario == SPARSE_SCENARIO and "batched_seed_placement" in args.options
+    )
+    env, base_config, env_config, agent_logic, mutator, key, programs = make_configs(config)
+    _, _, environment_history = run_seasons(
+        env,
+        base_config,
+        env_config,
+        agent_logic,
+        mutator,
+        key,
+        programs,
+        folder=scenario,
+        sim=sim,
+        sink=sink,
+    )
+    environment_history.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that sparse agent logic and batched seed placement are "
+        "statistically equivalent to the dense step. Every sim is simulated densely "
+        "and with the options from the same seed, and the monthly means are compared "
+        "with compare_scenarios. Exits with status 1 if any month and metric differs "
+        "significantly after the FDR correction."
+    )
+    parser.add_argument(
+        "--options",
+        nargs="+",
+        default=["sparse_budget", "batched_seed_placement"],
+        choices=["sparse_budget", "batched_seed_placement"],
+    )
+    parser.add_argument("--sims", type=int, default=10)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--days-in-year", type=int, default=365)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="Directory of the metrics store of the runs, a new temporary one if not given.",
+    )
+    args = parser.parse_args()
+
+    path = args.store or tempfile.mkdtemp(prefix="sparse_statistics_")
+    sink = StoreSink(path)
+    try:
+        for sim in range(args.sims):
+            for scenario in (DENSE_SCENARIO, SPARSE_SCENARIO):
+                run_sim(scenario, sim, args, sink)
+    finally:
+        sink.close()
+
+    store = MetricsStore(store_path("naco_simulations", path))
+    try:
+        results = load_results(
+            COMPARED_METRICS, scenarios=[DENSE_SCENARIO, SPARSE_SCENARIO], store=store
+        )
+    finally:
+        store.close()
+    _, statistics = compare_scenarios(results, DENSE_SCENARIO)
+
+    significant = statistics["p_value_fdr"][0] < args.alpha
+    for metric_index, metric in enumerate(results.metrics):
+        logger.info(
+            f"{metric}: min FDR p-value "
+            f"{np.nanmin(statistics['p_value_fdr'][0, :, metric_index]):.4f}, "
+            f"max |effect size| "
+            f"{np.nanmax(np.abs(statistics['effect_size'][0, :, metric_index])):.3f}"
+        )
+    if significant.any():
+        months, metrics = np.nonzero(significant)
+        logger.error(
+            "Significant differences in "
+            + ", ".join(
+                f"{results.metrics[metric]} month {results.months[month]}"
+                for month, metric in zip(months, metrics)
+            )
+        )
+        sys.exit(1)
+    logger.info(f"No significant differences over {len(results.sims)} paired sims.")
+
+
+if __name__ == "__main__":
+    main()
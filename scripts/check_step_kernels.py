@@ -0,0 +1,170 @@
+import argparse
+import sys
+from functools import partial
+
+import jax.numpy as jp
+import jax.random as jr
+from jax import jit, vmap
+from self_organising_systems.biomakerca import environments as evm
+from self_organising_systems.biomakerca.agent_logic import BasicAgentLogic
+from self_organising_systems.biomakerca.mutators import BasicMutator
+
+from overrides.env_logic_override import (
+    gravity_kernel_mismatches,
+    nutrient_audit_residual,
+    structural_integrity_mismatches,
+)
+from overrides.step_maker_override import step_env
+from utils.constants import logger
+
+# Largest audit residual accepted, relative to the nutrients at the start of the step.
+AUDIT_TOLERANCE = 1e-4
+
+
+def check_structural_integrity(key, env, env_config, agent_logic, programs, mutator):
+    """Cells where the "converge" structural integrity differs from "reference"."""
+    return jit(
+        partial(
+            structural_integrity_mismatches,
+            config=env_config,
+            structural_integrity_kernel="converge",
+        )
+    )(env)
+
+
+def check_gravity(key, env, env_config, agent_logic, programs, mutator):
+    """Cells where the "parallel" gravity differs from the "scan" one."""
+    return jit(partial(gravity_kernel_mismatches, etd=env_config.etd))(env)
+
+
+def step_mismatches(key, env, env_config, agent_logic, programs, mutator, **flags):
+    """Cells that differ after one step_env call with flags and one without.
+
+    Both steps use the same key. Any cell whose type, state or agent id differs
+    counts, and so does every program that differs.
+    """
+    step_fn = partial(
+        step_env,
+        config=env_config,
+        agent_logic=agent_logic,
+        do_reproduction=True,
+        mutate_programs=True,
+        mutator=mutator,
+    )
+    reference, reference_programs = step_fn(key, env, programs=programs)
+    candidate, candidate_programs = step_fn(key, env, programs=programs, **flags)
+    return (
+        (
+            (reference.type_grid != candidate.type_grid)
+            | (reference.state_grid != candidate.state_grid).any(-1)
+            | (reference.agent_id_grid != candidate.agent_id_grid)
+        ).sum()
+        + (reference_programs != candidate_programs).any(-1).sum()
+    )
+
+
+def check_share_perception(key, env, env_config, agent_logic, programs, mutator):
+    """Cells where a step with share_perception differs from one without."""
+    return step_mismatches(
+        key, env, env_config, agent_logic, programs, mutator, share_perception=True
+    )
+
+
+def check_active_region(key, env, env_config, agent_logic, programs, mutator):
+    """Cells where a step with active_region differs from a dense one."""
+    return step_mismatches(
+        key, env, env_config, agent_logic, programs, mutator, active_region=True
+    )
+
+
+def check_nutrient_audit(key, env, env_config, agent_logic, programs, mutator):
+    """Nutrient kinds whose audit residual of one step exceeds AUDIT_TOLERANCE."""
+    _, audit = step_env(
+        key,
+        env,
+        env_config,
+        agent_logic,
+        programs,
+        do_reproduction=True,
+        mutate_programs=True,
+        mutator=mutator,
+        audit_nutrients=True,
+    )
+    residual = nutrient_audit_residual(audit)
+    return (jp.abs(residual) > AUDIT_TOLERANCE * jp.maximum(audit.initial, 1)).sum()
+
+
+# Every check returns the number of mismatches of one env, which must be 0.
+CHECKS = {
+    "structural_integrity": check_structural_integrity,
+    "gravity": check_gravity,
+    "share_perception": check_share_perception,
+    "active_region": check_active_region,
+    "nutrient_audit": check_nutrient_audit,
+}
+
+
+def simulate(args):
+    """Run step_env with its reference settings from a seeded env.
+
+    Yields (step, key, env, env_config, agent_logic, programs, mutator) every
+    check_every steps, so the checks see grown plants and not only the seed.
+    """
+    env, env_config = evm.get_env_and_config(
+        args.ec_id, width_type=args.width_type, h=args.height
+    )
+    agent_logic = BasicAgentLogic(env_config, minimal_net=True)
+    mutator = BasicMutator(sd=1e-2, change_perc=0.2)
+    key = jr.PRNGKey(args.seed)
+    ku, key = jr.split(key)
+    programs = vmap(agent_logic.initialize)(jr.split(ku, args.n_max_programs))
+    programs = vmap(mutator.initialize)(jr.split(ku, programs.shape[0]), programs)
+
+    step_fn = partial(
+        step_env,
+        config=env_config,
+        agent_logic=agent_logic,
+        do_reproduction=True,
+        mutate_programs=True,
+        mutator=mutator,
+    )
+    for step in range(args.steps + 1):
+        key, ku = jr.split(key)
+        if step % args.check_every == 0:
+            yield step, ku, env, env_config, agent_logic, programs, mutator
+        env, programs = step_fn(ku, env, programs=programs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the step_env kernels and flags documented as "
+        "identical to the reference give the same grids along a seeded simulation, "
+        "and that the nutrient audit balances. Exits with status 1 if any check "
+        "finds a mismatch."
+    )
+    parser.add_argument("--checks", nargs="+", default=list(CHECKS), choices=list(CHECKS))
+    parser.add_argument("--ec-id", default="pestilence")
+    parser.add_argument("--width-type", default="landscape")
+    parser.add_argument("--height", type=int, default=72)
+    parser.add_argument("--n-max-programs", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--check-every", type=int, default=100)
+    args = parser.parse_args()
+
+    failed = set()
+    for step, *state in simulate(args):
+        n_agents = int(evm.is_agent_fn(state[1].type_grid).sum())
+        for name in args.checks:
+            mismatches = int(CHECKS[name](*state))
+            logger.info(f"step {step} ({n_agents} agents) {name}: {mismatches} mismatches")
+            if mismatches:
+                failed.add(name)
+    if failed:
+        logger.error(f"Checks with mismatches: {sorted(failed)}")
+        sys.exit(1)
+    logger.info("All checks found no mismatches.")
+
+
+if __name__ == "__main__":
+    main()
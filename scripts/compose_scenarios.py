@@ -0,0 +1,47 @@
+import argparse
+import os
+from glob import glob
+
+from utils.compositor_utils import composite_all
+from utils.trajectory_utils import FPS, MAX_WORKERS, TRAJECTORY_PATH
+
+SCENARIO_LABELS = {
+    "basic_seasons": "Regular January",
+    "warm_winter_month": "Warm January",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show the stored trajectories of every sim in all scenarios side by side."
+    )
+    parser.add_argument("--trajectories", default=TRAJECTORY_PATH)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIO_LABELS))
+    parser.add_argument("--output", default="videos/comparisons")
+    parser.add_argument("--zoom", type=int, default=4)
+    parser.add_argument("--columns", type=int, default=None)
+    parser.add_argument("--fps", type=int, default=FPS)
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    sims_per_scenario = [
+        {
+            os.path.basename(path)
+            for path in glob(os.path.join(args.trajectories, scenario, "sim_*"))
+        }
+        for scenario in args.scenarios
+    ]
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [
+        (
+            [os.path.join(args.trajectories, scenario, sim) for scenario in args.scenarios],
+            [SCENARIO_LABELS.get(scenario, scenario) for scenario in args.scenarios],
+            os.path.join(args.output, f"{sim}.mp4"),
+        )
+        for sim in sorted(set.intersection(*sims_per_scenario))
+    ]
+    composite_all(jobs, args.zoom, args.columns, args.fps, args.max_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+from utils.results_utils import import_csv_results
+
+
+def main():
+    # Converts analysis_results/{general,nutrients}/*/sim_N.csv into
+    # analysis_results/dataset/*/sim_N.npz.
+    import_csv_results()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,32 @@
-import os
-import pandas as pd
-import wandb
+import argparse
+
+import numpy as np
+
+from utils.constants import logger
+from utils.metrics_store import StoreSink
+from utils.publish_utils import LocalSink, RunSpec, WandbSink, publish_runs
+from utils.general_utils import MONTHS
+from utils.results_utils import RESULT_AGENT_TYPES, load_results_table
 
 
 # Constants
-GENERAL_PATH = "analysis_results/general"
-NUTRIENTS_PATH = "analysis_results/nutrients"
+PROJECT = "environment_simulation_data_advanced"
 GROUPS = ["basic_seasons", "warm_winter_month"]
+GENERAL_METRICS = {
+    "agent_count": "Agents in Month",
+    "avg_agent_age": "Avg Agent Age",
+    "avg_agent_si": "Avg Agent SI",
+}
+AGENT_TYPE_METRICS = {
+    "count": "Agent Type Count",
+    "avg_air_nutrients": "Avg Air Nutrients",
+    "avg_soil_nutrients": "Avg Soil Nutrients",
+}
+RESULT_METRICS = list(GENERAL_METRICS) + [
+    f"{agent_type}_{metric}"
+    for agent_type in RESULT_AGENT_TYPES
+    for metric in AGENT_TYPE_METRICS
+]
 
 def get_season(month):
   if month in [12, 1, 2]:
@@ -18,103 +38,108 @@ def get_season(month):
   else:
     return 4
 
-def log_general_csv(file_path, group):
-    """Logs a general CSV file to Weights & Biases as a separate run."""
-    data = pd.read_csv(file_path)
-    file_name = os.path.basename(file_path).split('.')[0]
-    run = wandb.init(project="environment_simulation_data_advanced", group=group, job_type="general", name=file_name)
-    run.define_metric("Month")
-    run.define_metric("Season")
-    month_number = 1
-    for _, row in data.iterrows():
-        # Log a plot with the x-axis as the month and three plots for count of agents, average agent age, and average agent SI
-        run.log(
-            {
-                "Month": month_number,
-                "Season": get_season(month_number),
-                "Agents in Month": row["Total in Month"],
-                "Avg Agent Age": row[" Avg Agent Age"],
-                "Avg Agent SI": row[" Avg Agent SI"],
-            }
-        )
-        month_number += 1
-
-    run.finish()
-
-def log_nutrient_csv(file_path, group):
-    """Logs a nutrient CSV file to Weights & Biases as a separate run."""
-    data = pd.read_csv(file_path)
-    file_name = os.path.basename(file_path).split('.')[0]
-
-    total_agents_by_month = {month: 0 for month in data["Season"].unique()}
-    avg_air_nutrients_by_month = {month: 0 for month in data["Season"].unique()}
-    avg_soil_nutrients_by_month =   {month: 0 for month in data["Season"].unique()}
-    for agent_type in data["Agent Type"].unique():
-      agent_type_name = agent_type.split(" ")[0]
-      run = wandb.init(project="environment_simulation_data_advanced", group=group, job_type="nutrients", name=f"{file_name}_{agent_type_name}", tags=[agent_type_name])
-      data_by_agent_type = data[data["Agent Type"] == agent_type]
-      wandb.define_metric("Month")
-      wandb.define_metric("Season")
-      month_number = 1
-      for _, row in data_by_agent_type.iterrows():
-          month = row["Season"]
-          avg_air_nutrients = row[" Avg Air Nutrients"]
-          avg_soil_nutrients = row[" Avg Soil Nutrients"]
-          agent_count = row["Agent Type Count"]
-          # Log individual agent type data
-          run.log(
-
-              {
-                  "Month": month_number,
-                  "Season": get_season(month_number),
-                  f"Agent Type Count {agent_type_name}": agent_count,
-                  f"Avg Air Nutrients {agent_type_name}": avg_air_nutrients,
-                  f"Avg Soil Nutrients {agent_type_name}": avg_soil_nutrients,
-              }
-          )
-          month_number += 1
-
-          total_agents_by_month[month] += agent_count
-          avg_air_nutrients_by_month[month] += avg_air_nutrients
-          avg_soil_nutrients_by_month[month] += avg_soil_nutrients
-      run.finish()
-
-    run = wandb.init(project="environment_simulation_data_advanced", group=group, job_type="nutrients", name=f"{file_name}_aggregated")
-    run.define_metric("Month")
-    run.define_metric("Season")
-    month_number = 1
-    # Log aggregated data
-    for month in total_agents_by_month.keys():
-        run.log(
+
+def monthly_means(table):
+    """Average every month of every scenario and sim over its years, weighted by
+    the number of frames.
+
+    Unlike statistics_utils.load_results, sims are not paired across scenarios,
+    so every sim that has results is kept. Returns the (scenario, sim) keys and
+    the [run, month, metric] means.
+    """
+    keys, run_idx = np.unique(
+        np.stack([table["scenario"].astype(str), table["sim"].astype(str)], -1),
+        axis=0,
+        return_inverse=True,
+    )
+    run_idx = run_idx.ravel()
+    month_idx = table["month"].astype(np.int64) - 1
+    # Legacy results have no frame counts, weight their rows equally.
+    weights = np.maximum(table["n_frames"], 1).astype(np.float64)
+    values = np.stack([table[metric] for metric in RESULT_METRICS], -1)
+
+    shape = (len(keys), len(MONTHS))
+    totals = np.zeros(shape + (len(RESULT_METRICS),))
+    total_weights = np.zeros(shape)
+    np.add.at(totals, (run_idx, month_idx), values * weights[:, None])
+    np.add.at(total_weights, (run_idx, month_idx), weights)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        data = totals / total_weights[..., None]
+    return [(scenario, int(sim)) for scenario, sim in keys], data
+
+
+def make_runs(table):
+    """Make one run per scenario and sim, holding general, per agent type and
+    aggregated metrics for every month."""
+    keys, data = monthly_means(table)
+    names = list(GENERAL_METRICS.values()) + [
+        f"{name} {agent_type}"
+        for agent_type in RESULT_AGENT_TYPES
+        for name in AGENT_TYPE_METRICS.values()
+    ]
+
+    per_agent_type = data[..., len(GENERAL_METRICS) :].reshape(
+        data.shape[:-1] + (len(RESULT_AGENT_TYPES), len(AGENT_TYPE_METRICS))
+    )
+    aggregated = np.stack(
+        [
+            per_agent_type[..., 0].sum(-1),
+            np.nansum(per_agent_type[..., 1], -1) / len(RESULT_AGENT_TYPES) / 5,
+            np.nansum(per_agent_type[..., 2], -1) / len(RESULT_AGENT_TYPES) / 5,
+        ],
+        -1,
+    )
+    data = np.concatenate([data, aggregated], -1)
+    names += ["Total Agent Count", "Avg Air Nutrients (Sum)", "Avg Soil Nutrients (Sum)"]
+
+    runs = []
+    for run_index, (scenario, sim) in enumerate(keys):
+        rows = [
             {
-                "Month": month_number,
-                "Season": get_season(month_number),
-                "Total Agent Count": total_agents_by_month[month],
-                "Avg Air Nutrients (Sum)": avg_air_nutrients_by_month[month] / data["Agent Type"].nunique() / 5,
-                "Avg Soil Nutrients (Sum)": avg_soil_nutrients_by_month[month] / data["Agent Type"].nunique() / 5,
+                "Month": month,
+                "Season": get_season(month),
+                **dict(zip(names, data[run_index, month_index].tolist())),
             }
+            for month_index, month in enumerate(MONTHS)
+        ]
+        run_spec = RunSpec(
+            PROJECT, scenario, "simulation", f"sim_{sim}", [scenario], {"sim": sim}
         )
-        month_number += 1
-    run.finish()
-
-def process_directory(base_path, data_type):
-    """Processes a directory and logs files to Weights & Biases."""
-    for group in GROUPS:
-        group_path = os.path.join(base_path, group)
-        for file_name in os.listdir(group_path):
-            if file_name.endswith(".csv"):
-                file_path = os.path.join(group_path, file_name)
-                if data_type == "general":
-                    log_general_csv(file_path, group)
-                elif data_type == "nutrients":
-                    log_nutrient_csv(file_path, group)
+        runs.append((run_spec, rows))
+    return runs
+
 
 def main():
-    # Process and log general data files
-    process_directory(GENERAL_PATH, "general")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--local",
+        default=None,
+        help="Write the runs to this directory instead of publishing them to wandb.",
+    )
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="Write the runs to metrics stores in this directory instead of publishing them to wandb.",
+    )
+    parser.add_argument("--max-workers", type=int, default=8)
+    args = parser.parse_args()
 
-    # Process and log nutrients data files
-    process_directory(NUTRIENTS_PATH, "nutrients")
+    table = load_results_table(
+        ["year", "month", "n_frames"] + RESULT_METRICS, scenarios=GROUPS
+    )
+    if args.local:
+        sink = LocalSink(args.local)
+    elif args.store:
+        sink = StoreSink(args.store)
+    else:
+        sink = WandbSink()
+    failed = publish_runs(
+        sink, make_runs(table), metrics=["Month", "Season"], max_workers=args.max_workers
+    )
+    if isinstance(sink, StoreSink):
+        sink.close()
+    if failed:
+        logger.error(f"Failed to publish {len(failed)} runs: {failed}")
 
 if __name__ == "__main__":
     main()
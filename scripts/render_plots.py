@@ -0,0 +1,35 @@
+import argparse
+
+from utils.batch_plotting_utils import (
+    FORMATS,
+    MAX_WORKERS,
+    PLOT_SPECS,
+    PLOTS_PATH,
+    render_plots,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store", help="Metrics store file to plot.")
+    parser.add_argument("--plots", nargs="+", choices=list(PLOT_SPECS), default=None)
+    parser.add_argument("--scenarios", nargs="+", default=None)
+    parser.add_argument("--sims", nargs="+", type=int, default=None)
+    parser.add_argument("--formats", nargs="+", choices=["png", "svg"], default=FORMATS)
+    parser.add_argument("--output", default=PLOTS_PATH)
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    render_plots(
+        args.store,
+        args.plots,
+        args.scenarios,
+        args.sims,
+        args.output,
+        args.formats,
+        args.max_workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import os
+from glob import glob
+
+from utils.trajectory_utils import (
+    FPS,
+    MAX_WORKERS,
+    SEGMENT_CHUNKS,
+    TRAJECTORY_PATH,
+    render_trajectories,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render videos of all stored trajectories, {trajectories}/{scenario}/sim_{sim}."
+    )
+    parser.add_argument("--trajectories", default=TRAJECTORY_PATH)
+    parser.add_argument("--scenarios", nargs="+", default=None)
+    parser.add_argument("--output", default="videos/trajectories")
+    parser.add_argument("--zoom", type=int, default=4)
+    parser.add_argument("--fps", type=int, default=FPS)
+    parser.add_argument("--no-text", action="store_true")
+    parser.add_argument("--segment-chunks", type=int, default=SEGMENT_CHUNKS)
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    jobs = []
+    for trajectory_path in sorted(glob(os.path.join(args.trajectories, "*", "sim_*"))):
+        scenario = os.path.basename(os.path.dirname(trajectory_path))
+        if args.scenarios is not None and scenario not in args.scenarios:
+            continue
+        out_file = os.path.join(
+            args.output, scenario, f"{os.path.basename(trajectory_path)}.mp4"
+        )
+        os.makedirs(os.path.dirname(out_file), exist_ok=True)
+        jobs.append((trajectory_path, out_file))
+
+    render_trajectories(
+        jobs,
+        args.zoom,
+        args.fps,
+        not args.no_text,
+        args.segment_chunks,
+        args.max_workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
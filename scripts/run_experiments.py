@@ -1,7 +1,6 @@
 import os
 import pickle
 
-import cv2
 import jax.random as jr
 import numpy as np
 import self_organising_systems.biomakerca.env_logic as env_logic
@@ -16,6 +15,9 @@ from self_organising_systems.biomakerca.mutators import (
 import overrides.env_logic_override as env_override
 from utils.constants import logger
 from utils.environment_utils import EnvironmentHistory
+from utils.metrics_store import StoreSink
+from utils.budget_utils import SparseBudget
+from utils.trajectory_utils import TRAJECTORY_PATH, TrajectoryWriter
 
 env_logic.process_energy = env_override.process_energy
 
@@ -30,11 +32,10 @@ from configs.seasons_config import SeasonsConfig
 from utils.biomaker_util_no_video import perform_simulation
 
 USE_WANDB = False
-TEXT_FONT = cv2.FONT_HERSHEY_SIMPLEX
-TEXT_ORIGIN = (5, 15)
-TEXT_FONT_SCALE = 0.5
-TEXT_COLOR = (0, 0, 0)
-TEXT_THICKNESS = 1
+# Directory of the local metrics stores, logs to wandb instead if None.
+METRICS_STORE = None
+# Store compact trajectories in TRAJECTORY_PATH to render videos later.
+RECORD_TRAJECTORIES = False
 # Constants
 NUM_SIMS = 25
 MAX_WORKERS = 1
@@ -52,23 +53,6 @@ EARLY_EXTINCTION_MONTH_COUNT = 6
 os.makedirs(PICKLE_DIR, exist_ok=True)
 
 
-def pad_text(img, text):
-    new_height = img.shape[0] // 15
-    new_height = new_height if new_height % 2 == 0 else new_height + 1
-    img = np.concatenate([np.ones([new_height, img.shape[1], img.shape[2]]), img], 0)
-    img = cv2.putText(
-        img,
-        text,
-        TEXT_ORIGIN,
-        TEXT_FONT,
-        TEXT_FONT_SCALE,
-        TEXT_COLOR,
-        TEXT_THICKNESS,
-        cv2.LINE_AA,
-    )
-    return img
-
-
 def make_configs(base_config: SeasonsConfig):
     config_dict = {
         name: getattr(base_config, name)
@@ -126,15 +110,27 @@ def run_seasons(
     folder="",
     sim=0,
     fail_on_extinction=False,
+    sink=None,
 ):
     environment_history = EnvironmentHistory(
-        base_config, days_since_start, folder, sim, USE_WANDB
+        base_config, days_since_start, folder, sim, USE_WANDB, sink=sink
+    )
+
+    trajectory = (
+        TrajectoryWriter(os.path.join(TRAJECTORY_PATH, folder, f"sim_{sim}"), env_config)
+        if RECORD_TRAJECTORIES
+        else None
+    )
+
+    sparse_budget = (
+        SparseBudget(env.type_grid.size) if base_config.sparse_budget else None
     )
 
     step = 0
     for year in range(base_config.years):
         extinction_counter = 0
         for month_name, month_params in base_config.month_params.items():
+            frame_steps = []
             step, env, programs, env_history = perform_simulation(
                 env,
                 programs,
@@ -148,9 +144,12 @@ def run_seasons(
                 None,
                 step=step,
                 season=f"{month_name} {year + 1}",
+                trajectory=trajectory,
+                sparse_budget=sparse_budget,
+                frame_steps=frame_steps,
             )
             environment_history.add_all(
-                env_history, month_params["Season"], month_name, year
+                env_history, month_params["Season"], month_name, year, steps=frame_steps
             )
             agent_count = environment_history.return_agent_count_of_last_env()
             if agent_count == 0:
@@ -173,7 +172,7 @@ def run_seasons(
     return programs, env, environment_history
 
 
-def run_single_simulation(type_of_january, sim, twenty_year_burn_in_env):
+def run_single_simulation(type_of_january, sim, twenty_year_burn_in_env, sink=None):
     if type_of_january == "warm":
         experiment_config = SeasonsConfig(
             "warm_winter_month",
@@ -202,17 +201,18 @@ def run_single_simulation(type_of_january, sim, twenty_year_burn_in_env):
         days_since_start=DAYS_IN_BURN_IN,
         folder=folder,
         sim=sim,
+        sink=sink,
     )
 
     environment_history.save_results(folder, sim)
 
 
-def run_experiments(sim, burn_in_env):
+def run_experiments(sim, burn_in_env, sink=None):
     for type_of_january in SEASON_TYPES:
-        run_single_simulation(type_of_january, sim, burn_in_env)
+        run_single_simulation(type_of_january, sim, burn_in_env, sink)
 
 
-def run_burn_in_simulation(sim):
+def run_burn_in_simulation(sim, sink=None):
     pickle_path = os.path.join(PICKLE_DIR, f"burn_in_env_sim_{sim}.pkl")
 
     if os.path.exists(pickle_path):
@@ -249,7 +249,9 @@ def run_burn_in_simulation(sim):
                 folder=BURN_IN_FOLDER,
                 sim=sim,
                 fail_on_extinction=True,
+                sink=sink,
             )
+            environment_history.finish()
 
             # Save the burn-in environment to a pickle file
             with open(pickle_path, "wb") as f:
@@ -268,14 +270,20 @@ def run_burn_in_simulation(sim):
 def main():
 
     burn_in_environments = [None] * NUM_SIMS
-
-    # Run burn-in simulations
-    for sim in range(NUM_SIMS):
-        burn_in_environments[sim] = run_burn_in_simulation(sim)
-
-    # Run experiments for each simulation
-    for sim in range(NUM_SIMS):
-        run_experiments(sim, burn_in_environments[sim])
+    # One sink for all runs, so every store file is opened once.
+    sink = StoreSink(METRICS_STORE) if METRICS_STORE else None
+
+    try:
+        # Run burn-in simulations
+        for sim in range(NUM_SIMS):
+            burn_in_environments[sim] = run_burn_in_simulation(sim, sink)
+
+        # Run experiments for each simulation
+        for sim in range(NUM_SIMS):
+            run_experiments(sim, burn_in_environments[sim], sink)
+    finally:
+        if sink:
+            sink.close()
 
 
 if __name__ == "__main__":
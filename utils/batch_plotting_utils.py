@@ -0,0 +1,179 @@
+import concurrent.futures
+import os
+from collections import namedtuple
+
+from utils.constants import logger
+from utils.metrics_store import MetricsStore
+
+PLOTS_PATH = "images/plots"
+FORMATS = ("png",)
+MAX_WORKERS = os.cpu_count()
+
+# Seasons of the SeasonsConfig months.
+MONTH_SEASONS = {
+    1: "Winter",
+    2: "Winter",
+    3: "Spring",
+    4: "Spring",
+    5: "Spring",
+    6: "Summer",
+    7: "Summer",
+    8: "Summer",
+    9: "Autumn",
+    10: "Autumn",
+    11: "Autumn",
+    12: "Winter",
+}
+
+# metrics maps line labels to stored per frame metrics.
+PlotSpec = namedtuple("PlotSpec", "title y_label legend_title metrics y_axis_limits")
+
+# Same plots as the EnvironmentHistory plot_* methods, by file name.
+PLOT_SPECS = {
+    "agent_type_hist": PlotSpec(
+        "History of Agent Type Counts",
+        "Count",
+        "Agent Types",
+        {name: f"{name} Count" for name in ["Unassigned", "Root", "Leaf", "Flower"]},
+        (0, 500),
+    ),
+    "nutrient_hist_air_soil": PlotSpec(
+        "History of Nutrient Counts of Soil and Air",
+        "Nutrient Count",
+        "Nutrients",
+        {name: name for name in ["Air Nutrients in Air", "Soil Nutrients in Soil"]},
+        None,
+    ),
+    "nutrient_hist": PlotSpec(
+        "History of Average Nutrient Counts Per Agent",
+        "Average Nutrient Count",
+        "Nutrients",
+        {
+            f"Avg {nutrient} Nutrients in {agent}": f"Avg {nutrient} Nutrients in {agent}"
+            for nutrient in ["Air", "Soil"]
+            for agent in ["Roots", "Leafs", "Flowers"]
+        },
+        (0, 5),
+    ),
+    "plant_count": PlotSpec(
+        "History of Plant Counts", "Count", "", {"Plant Count": "plant_count"}, None
+    ),
+    "agent_count_hist": PlotSpec(
+        "History of Agent Counts",
+        "Count",
+        "",
+        {"Agent Count": "total_agents"},
+        (200, 1000),
+    ),
+    "avg_agent_age_hist": PlotSpec(
+        "History of Average Agent Age",
+        "Age",
+        "",
+        {"Average Agent Age": "average_agent_age"},
+        None,
+    ),
+    "avg_agent_structural_integrity_hist": PlotSpec(
+        "History of Average Agent Structural Integrity",
+        "Structural Integrity",
+        "",
+        {"Average Agent SI": "average_agent_structural_integrity"},
+        None,
+    ),
+}
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def render_run_plots(store_file, scenario, sim, plot_names, output_dir, formats):
+    """Render the given plots of one run of a store, reusing a single figure.
+
+    Returns the written files, {output_dir}/{scenario}/sim_{sim}/{plot}.{format}.
+    """
+    import matplotlib.pyplot as plt
+
+    from utils.plotting_utils import plot_histogram
+
+    metrics = sorted(
+        {metric for name in plot_names for metric in PLOT_SPECS[name].metrics.values()}
+    )
+    store = MetricsStore(store_file)
+    try:
+        [(run_id, *_)] = store.runs(scenarios=[scenario], sims=[sim])
+        days_since_start = store.run_config(run_id).get("days_since_start", 0)
+        samples = store.query(["month"] + metrics, scenarios=[scenario], sims=[sim])
+    finally:
+        store.close()
+    seasons = [MONTH_SEASONS.get(int(month), "Unknown") for month in samples["month"]]
+
+    run_dir = os.path.join(output_dir, scenario, f"sim_{sim}")
+    os.makedirs(run_dir, exist_ok=True)
+    written = []
+    fig = plt.figure(figsize=(10, 6))
+    try:
+        for name in plot_names:
+            spec = PLOT_SPECS[name]
+            file_names = [os.path.join(run_dir, f"{name}.{file_format}") for file_format in formats]
+            plot_histogram(
+                {label: samples[metric] for label, metric in spec.metrics.items()},
+                seasons,
+                spec.title,
+                "Day",
+                spec.y_label,
+                spec.legend_title,
+                file_names,
+                days_since_start,
+                *(spec.y_axis_limits or (None, None)),
+                fig=fig,
+            )
+            written.extend(file_names)
+    finally:
+        plt.close(fig)
+    return written
+
+
+def render_plots(
+    store_file,
+    plot_names=None,
+    scenarios=None,
+    sims=None,
+    output_dir=PLOTS_PATH,
+    formats=FORMATS,
+    max_workers=MAX_WORKERS,
+):
+    """Render plots of all selected runs of a store, one run per worker process.
+
+    Only reads the store, so it can run next to or after the simulations.
+    Returns the written files.
+    """
+    plot_names = list(PLOT_SPECS) if plot_names is None else list(plot_names)
+    unknown = set(plot_names) - set(PLOT_SPECS)
+    if unknown:
+        raise ValueError(f"Unknown plots: {sorted(unknown)}")
+    store = MetricsStore(store_file)
+    try:
+        runs = [(scenario, sim) for _, _, scenario, sim, _ in store.runs(None, scenarios, sims)]
+    finally:
+        store.close()
+
+    written = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker
+    ) as executor:
+        futures = {
+            executor.submit(
+                render_run_plots, store_file, scenario, sim, plot_names, output_dir, formats
+            ): (scenario, sim)
+            for scenario, sim in runs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            scenario, sim = futures[future]
+            try:
+                written.extend(future.result())
+            except Exception as e:
+                logger.error(f"Could not render plots of {scenario} sim {sim}: {e}")
+    logger.info(f"Rendered {len(written)} plots of {len(runs)} runs to {output_dir}")
+    return written
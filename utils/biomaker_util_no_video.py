@@ -24,9 +24,20 @@ def perform_simulation(
     frame,
     step=0,
     season="",
+    trajectory=None,
+    sparse_budget=None,
+    frame_steps=None,
 ):
+    """If a SparseBudget is given, it chooses the n_sparse_max of every step.
+
+    If frame_steps is a list, the step of every env_history frame is appended to it.
+    """
     # video.add_image(frame)
     env_history = [env]
+    if frame_steps is not None:
+        frame_steps.append(step)
+    # (step, speed, season) of every frame for the trajectory.
+    trajectory_infos = []
     for i in range(base_config.n_frames):
         if i in base_config.when_to_double_speed:
             base_config.steps_per_frame *= 2
@@ -35,6 +46,11 @@ def perform_simulation(
         for j in range(base_config.steps_per_frame):
             step += 1
             key, ku = jr.split(key)
+            n_sparse_max = (
+                sparse_budget.update(step, env, env_config.etd)
+                if sparse_budget is not None
+                else None
+            )
             env, programs = step_env(
                 ku,
                 env,
@@ -46,6 +62,14 @@ def perform_simulation(
                 mutator=mutator,
                 soil_diffusion_rate=season_info["SOIL_DIFFUSION_RATE"],
                 air_diffusion_rate=season_info["AIR_DIFFUSION_RATE"],
+                diffusion_kernel=base_config.diffusion_kernel,
+                diffusion_substeps=base_config.diffusion_substeps,
+                gravity_kernel=base_config.gravity_kernel,
+                structural_integrity_kernel=base_config.structural_integrity_kernel,
+                share_perception=base_config.share_perception,
+                active_region=base_config.active_region,
+                n_sparse_max=n_sparse_max,
+                batched_seed_placement=base_config.batched_seed_placement,
             )
 
             if base_config.replace_if_extinct and step % 50 == 0:
@@ -81,6 +105,9 @@ def perform_simulation(
                     # for stop_i in range(10):
                     #     video.add_image(frame)
         env_history.append(env)
+        trajectory_infos.append((step, base_config.steps_per_frame, season))
+        if frame_steps is not None:
+            frame_steps.append(step)
 
         # video.add_image(
         #     make_frame(
@@ -92,4 +119,6 @@ def perform_simulation(
         #         season
         #     )
         # )
+    if trajectory is not None:
+        trajectory.add(env_history[1:], trajectory_infos)
     return step, env, programs, env_history
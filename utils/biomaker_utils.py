@@ -1,7 +1,6 @@
 import time
 from functools import partial
 
-import cv2
 import jax
 import jax.numpy as jp
 import jax.random as jr
@@ -10,7 +9,6 @@ import tqdm
 from jax import jit, vmap
 from self_organising_systems.biomakerca import environments as evm
 from self_organising_systems.biomakerca.agent_logic import BasicAgentLogic
-from self_organising_systems.biomakerca.display_utils import zoom
 from self_organising_systems.biomakerca.env_logic import (
     ReproduceOp,
     env_perform_one_reproduce_op,
@@ -22,31 +20,24 @@ from self_organising_systems.biomakerca.mutators import (
 from self_organising_systems.biomakerca.step_maker import step_env
 
 from configs.base_config import BaselineConfig
+from utils.rendering_utils import (
+    add_text_bands,
+    frame_text,
+    full_view,
+    render_environment_views,
+    render_environments,
+)
 
 
-def pad_text(img, text):
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    orgin = (5, 15)
-    fontScale = 0.5
-    color = (0, 0, 0)
-    thickness = 1
-
-    # ensure to preserve even size (assumes the input size was even.
-    new_h = img.shape[0] // 15
-    new_h = new_h if new_h % 2 == 0 else new_h + 1
-    img = np.concatenate([np.ones([new_h, img.shape[1], img.shape[2]]), img], 0)
-    img = cv2.putText(img, text, orgin, font, fontScale, color, thickness, cv2.LINE_AA)
-    return img
+def make_frame(env, step, speed, env_config, zoom_sz, season):
+    return make_frames([env], [(step, speed, season)], env_config, zoom_sz)[0]
 
 
-def make_frame(env, step, speed, env_config, zoom_sz, season):
-    if season == "":
-      padText = "Step {:<7} Speed: {}x".format(step, speed)
-    else:
-      padText = "Step {:<7} Speed: {}x   Season: {}".format(step, speed, season)
-    return pad_text(
-        zoom(evm.grab_image_from_env(env, env_config), zoom_sz),
-        padText,
+def make_frames(envs, frame_infos, env_config, zoom_sz):
+    """Render (step, speed, season) annotated uint8 frames of a list of environments."""
+    return add_text_bands(
+        render_environments(envs, env_config, zoom_sz),
+        [frame_text(*frame_info) for frame_info in frame_infos],
     )
 
 
@@ -56,18 +47,27 @@ def count_agents_f(env, etd):
 
 def start_simulation(env, base_config, env_config):
     step = 0
-    frame = pad_text(
-        zoom(evm.grab_image_from_env(env, env_config), base_config.zoom_sz),
-        "Step {:<7} Speed: {}x".format(step, base_config.steps_per_frame),
+    return make_frame(
+        env, step, base_config.steps_per_frame, env_config, base_config.zoom_sz, ""
     )
-    return frame
 
 
 def perform_simulation(
-    env, programs, base_config, season_info, env_config, agent_logic, mutator, key, video, frame, step=0, season=""
+    env, programs, base_config, season_info, env_config, agent_logic, mutator, key, video, frame, step=0, season="", trajectory=None, extra_videos=(), sparse_budget=None, frame_steps=None
 ):
+    """extra_videos are (RenderView, video) pairs rendered from the same frames as video.
+
+    If a SparseBudget is given, it chooses the n_sparse_max of every step. If
+    frame_steps is a list, the step of every env_history frame is appended to it.
+    """
     video.add_image(frame)
     env_history = [env]
+    if frame_steps is not None:
+        frame_steps.append(step)
+    # (step, speed, season) of every frame for the trajectory.
+    trajectory_infos = []
+    # Frames are rendered together at the end of the month, each shown repeats times.
+    frame_envs, frame_infos, frame_repeats = [], [], []
     for i in range(base_config.n_frames):
         if i in base_config.when_to_double_speed:
             base_config.steps_per_frame *= 2
@@ -76,6 +76,11 @@ def perform_simulation(
         for j in range(base_config.steps_per_frame):
             step += 1
             key, ku = jr.split(key)
+            n_sparse_max = (
+                sparse_budget.update(step, env, env_config.etd)
+                if sparse_budget is not None
+                else None
+            )
             env, programs = step_env(
                 ku,
                 env,
@@ -87,6 +92,14 @@ def perform_simulation(
                 mutator=mutator,
                 soil_diffusion_rate=season_info["SOIL_DIFFUSION_RATE"],
                 air_diffusion_rate=season_info["AIR_DIFFUSION_RATE"],
+                diffusion_kernel=base_config.diffusion_kernel,
+                diffusion_substeps=base_config.diffusion_substeps,
+                gravity_kernel=base_config.gravity_kernel,
+                structural_integrity_kernel=base_config.structural_integrity_kernel,
+                share_perception=base_config.share_perception,
+                active_region=base_config.active_region,
+                n_sparse_max=n_sparse_max,
+                batched_seed_placement=base_config.batched_seed_placement,
             )
 
             if base_config.replace_if_extinct and step % 50 == 0:
@@ -118,21 +131,32 @@ def perform_simulation(
                     )
 
                     # show it, though
-                    frame = make_frame(env, step, base_config.steps_per_frame, season)
-                    for stop_i in range(10):
-                        video.add_image(frame)
+                    frame_envs.append(env)
+                    frame_infos.append((step, base_config.steps_per_frame, season))
+                    frame_repeats.append(10)
         env_history.append(env)
+        trajectory_infos.append((step, base_config.steps_per_frame, season))
+        if frame_steps is not None:
+            frame_steps.append(step)
 
-        video.add_image(
-            make_frame(
-                env,
-                step,
-                base_config.steps_per_frame,
-                env_config,
-                base_config.zoom_sz,
-                season
-            )
-        )
+        frame_envs.append(env)
+        frame_infos.append((step, base_config.steps_per_frame, season))
+        frame_repeats.append(1)
+
+    videos = [(full_view(base_config.zoom_sz), video)] + list(extra_videos)
+    view_frames = render_environment_views(
+        frame_envs, env_config, [view for view, _ in videos]
+    )
+    texts = [frame_text(*frame_info) for frame_info in frame_infos]
+    for view, view_video in videos:
+        frames = view_frames[view.name]
+        if view.annotate:
+            frames = add_text_bands(frames, texts)
+        for frame, repeats in zip(frames, frame_repeats):
+            for _ in range(repeats):
+                view_video.add_image(frame)
+    if trajectory is not None:
+        trajectory.add(env_history[1:], trajectory_infos)
     return step, env, programs, env_history
 
 
@@ -0,0 +1,62 @@
+import math
+from functools import partial
+
+from jax import jit
+
+from utils.constants import logger
+
+# Static n_sparse_max values, every one of them compiles its own step_env.
+SPARSE_BUDGET_BUCKETS = (128, 256, 512, 1024, 2048, 4096)
+# Budget for this many times the observed agents, since plants grow between checks.
+SPARSE_BUDGET_HEADROOM = 1.5
+# Counting agents waits for the device, so only count every few steps.
+SPARSE_BUDGET_CHECK_EVERY = 10
+
+
+@partial(jit, static_argnames=["etd"])
+def count_agents(type_grid, etd):
+    return etd.is_agent_fn(type_grid).sum()
+
+
+class SparseBudget:
+    """Choose the n_sparse_max of step_env from the observed number of agents.
+
+    The budget is the smallest bucket holding the agents with some headroom, or
+    None (dense) if no bucket is smaller than the grid. Between checks the
+    population can outgrow the budget, step_env then falls back to the dense
+    computation. n_overflows counts the checks that found more agents than the
+    budget, not the steps that fell back, which are not observed here.
+    """
+
+    def __init__(
+        self,
+        grid_cells,
+        buckets=SPARSE_BUDGET_BUCKETS,
+        headroom=SPARSE_BUDGET_HEADROOM,
+        check_every=SPARSE_BUDGET_CHECK_EVERY,
+    ):
+        # A budget as large as the grid is not cheaper than the dense computation.
+        self.buckets = tuple(sorted(bucket for bucket in buckets if bucket < grid_cells))
+        self.headroom = headroom
+        self.check_every = check_every
+        self.n_sparse_max = None
+        self.n_checks = 0
+        self.n_overflows = 0
+
+    def update(self, step, env, etd):
+        """Return the n_sparse_max to use for this step."""
+        if self.n_checks > 0 and step % self.check_every != 0:
+            return self.n_sparse_max
+        n_agents = int(count_agents(env.type_grid, etd))
+        self.n_checks += 1
+        if self.n_sparse_max is not None and n_agents > self.n_sparse_max:
+            self.n_overflows += 1
+            logger.warning(
+                f"Agent count {n_agents} exceeded the sparse budget of "
+                f"{self.n_sparse_max} at the check of step {step}."
+            )
+        needed = math.ceil(n_agents * self.headroom)
+        self.n_sparse_max = next(
+            (bucket for bucket in self.buckets if bucket >= needed), None
+        )
+        return self.n_sparse_max
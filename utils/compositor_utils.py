@@ -0,0 +1,140 @@
+import concurrent.futures
+import math
+import multiprocessing
+
+import jax
+import numpy as np
+
+from utils.constants import logger
+from utils.rendering_utils import (
+    add_text_bands,
+    frame_text,
+    render_frames,
+    text_band_height,
+    text_overlay,
+)
+from utils.trajectory_utils import FPS, MAX_WORKERS, list_chunks, load_chunk, load_env_config
+from utils.video_utils import VideoSink
+
+
+def label_bands(labels, height, width):
+    """Return [len(labels), band_height, width, 3] uint8 white bands with the labels."""
+    bands = np.full((len(labels), text_band_height(height), width, 3), 255, np.uint8)
+    return text_overlay(bands.shape[1]).draw(bands, labels)
+
+
+def tile_panels(frames, bands, columns):
+    """Tile [panel, frame, h, w, 3] frames, each below its label band, into a grid.
+
+    Returns [frame, rows * (band_h + h), columns * w, 3] frames, missing panels
+    of the last row are white.
+    """
+    n_panels, n_frames = frames.shape[:2]
+    rows = math.ceil(n_panels / columns)
+    panels = np.concatenate(
+        [np.broadcast_to(bands[:, None], (n_panels, n_frames) + bands.shape[1:]), frames],
+        2,
+    )
+    grid = np.full((rows * columns,) + panels.shape[1:], 255, np.uint8)
+    grid[:n_panels] = panels
+    _, _, height, width, channels = grid.shape
+    grid = grid.reshape(rows, columns, n_frames, height, width, channels)
+    return grid.transpose(2, 0, 3, 1, 4, 5).reshape(
+        n_frames, rows * height, columns * width, channels
+    )
+
+
+class PanelCompositor:
+    """Write several synchronized sims side by side into one video.
+
+    Every add call renders the frames of all panels in a single device call and
+    tiles them under per-panel labels, with the frame text of the first panel on
+    top. Encoding happens in the background in a VideoSink.
+    """
+
+    def __init__(self, out_file, labels, env_config, zoom_sz, columns=None, fps=FPS):
+        self.out_file = out_file
+        self.labels = list(labels)
+        self.env_config = env_config
+        self.zoom_sz = zoom_sz
+        self.columns = columns or len(self.labels)
+        self.fps = fps
+        self.bands = None
+        self.video = None
+
+    def add(self, envs, frame_infos):
+        """Add stacked [panel, frame] environments and the (step, speed, season) per frame."""
+        n_panels, n_frames = envs.type_grid.shape[:2]
+        if n_panels != len(self.labels):
+            raise ValueError(f"Got {n_panels} panels for {len(self.labels)} labels.")
+        flat_envs = jax.tree_util.tree_map(
+            lambda grid: grid.reshape((n_panels * n_frames,) + grid.shape[2:]), envs
+        )
+        frames = np.asarray(render_frames(flat_envs, self.env_config, self.zoom_sz))
+        frames = frames.reshape((n_panels, n_frames) + frames.shape[1:])
+        if self.bands is None:
+            self.bands = label_bands(self.labels, *frames.shape[2:4])
+        frames = add_text_bands(
+            tile_panels(frames, self.bands, self.columns),
+            [frame_text(*frame_info) for frame_info in frame_infos],
+        )
+        if self.video is None:
+            self.video = VideoSink(self.out_file, shape=frames.shape[1:3], fps=self.fps)
+        self.video.add_images(frames)
+
+    def close(self):
+        if self.video is not None:
+            self.video.close()
+            self.video = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def composite_trajectories(
+    trajectory_paths, labels, out_file, zoom_sz, columns=None, fps=FPS
+):
+    """Tile stored trajectories into one video, synchronized by chunk and frame.
+
+    Trajectories are cut to the shortest one. They must share the grid size,
+    the env_config of the first trajectory is used for rendering.
+    """
+    env_config = load_env_config(trajectory_paths[0])
+    chunk_lists = [list_chunks(path) for path in trajectory_paths]
+    n_chunks = min(len(chunks) for chunks in chunk_lists)
+    if n_chunks < max(len(chunks) for chunks in chunk_lists):
+        logger.warning(f"Cutting all trajectories to {n_chunks} chunks.")
+
+    with PanelCompositor(out_file, labels, env_config, zoom_sz, columns, fps) as compositor:
+        for chunk_files in zip(*(chunks[:n_chunks] for chunks in chunk_lists)):
+            chunks = [load_chunk(chunk_file, env_config) for chunk_file in chunk_files]
+            n_frames = min(len(frame_infos) for _, frame_infos in chunks)
+            envs = jax.tree_util.tree_map(
+                lambda *grids: np.stack([grid[:n_frames] for grid in grids]),
+                *(panel_envs for panel_envs, _ in chunks),
+            )
+            compositor.add(envs, chunks[0][1][:n_frames])
+    return out_file
+
+
+def composite_all(jobs, zoom_sz, columns=None, fps=FPS, max_workers=MAX_WORKERS):
+    """Run (trajectory_paths, labels, out_file) jobs in parallel worker processes."""
+    written = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {
+            executor.submit(
+                composite_trajectories, paths, labels, out_file, zoom_sz, columns, fps
+            ): out_file
+            for paths, labels, out_file in jobs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                written.append(future.result())
+            except Exception as e:
+                logger.error(f"Could not composite {futures[future]}: {e}")
+    return written
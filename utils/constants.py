@@ -6,6 +6,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger("utils_logger")
 
+# Logged with every per frame metrics row, the simulation step of its frame.
+SIMULATION_STEP = "simulation_step"
+
 SEASON_COLORS = {
     "Spring": "palegreen",
     "Summer": "lightcoral",
@@ -1,7 +1,10 @@
 from collections import Counter
+from functools import partial
 
+import jax
 import jax.numpy as jp
 import numpy as np
+from jax import jit, vmap
 
 from utils.constants import (
     AGE_IDX,
@@ -106,10 +109,16 @@ def nutrient_avgs(env, agent_type_def=AGENT_TYPE_DEF):
         root_indices = type_grid[:, :] == agent_type_def.types.AGENT_ROOT
         leaf_indices = type_grid[:, :] == agent_type_def.types.AGENT_LEAF
         flower_indices = type_grid[:, :] == agent_type_def.types.AGENT_FLOWER
+        unspecialized_indices = (
+            type_grid[:, :] == agent_type_def.types.AGENT_UNSPECIALIZED
+        )
 
         root_count = count_agents_of_type(agent_type_def.types.AGENT_ROOT)
         leaf_count = count_agents_of_type(agent_type_def.types.AGENT_LEAF)
         flower_count = count_agents_of_type(agent_type_def.types.AGENT_FLOWER)
+        unspecialized_count = count_agents_of_type(
+            agent_type_def.types.AGENT_UNSPECIALIZED
+        )
 
         air_nutrient_col = EN_ST + AIR_NUTRIENT_RPOS
         soil_nutrient_col = EN_ST + EARTH_NUTRIENT_RPOS
@@ -132,6 +141,18 @@ def nutrient_avgs(env, agent_type_def=AGENT_TYPE_DEF):
         add_nutrient_avg(
             "Avg Soil Nutrients in Flowers", flower_indices, soil_nutrient_col, flower_count
         )
+        add_nutrient_avg(
+            "Avg Air Nutrients in Unassigneds",
+            unspecialized_indices,
+            air_nutrient_col,
+            unspecialized_count,
+        )
+        add_nutrient_avg(
+            "Avg Soil Nutrients in Unassigneds",
+            unspecialized_indices,
+            soil_nutrient_col,
+            unspecialized_count,
+        )
 
         logger.debug(f"Nutrient averages: {nutrient_avgs}")
         return nutrient_avgs
@@ -168,3 +189,85 @@ def count_plants(env):
     except Exception as e:
         logger.error(f"Error counting plants: {e}")
         return 0
+
+
+# Names of the columns of batch_env_metrics, matching the keys logged so far.
+ENV_METRIC_NAMES = [
+    "plant_count",
+    "total_agents",
+    "average_agent_age",
+    "average_agent_structural_integrity",
+    "Avg Air Nutrients in Roots",
+    "Avg Air Nutrients in Leafs",
+    "Avg Air Nutrients in Flowers",
+    "Avg Soil Nutrients in Roots",
+    "Avg Soil Nutrients in Leafs",
+    "Avg Soil Nutrients in Flowers",
+    "Air Nutrients in Air",
+    "Soil Nutrients in Soil",
+    "Unassigned Count",
+    "Root Count",
+    "Leaf Count",
+    "Flower Count",
+    "Avg Air Nutrients in Unassigneds",
+    "Avg Soil Nutrients in Unassigneds",
+]
+
+
+def _env_metrics(type_grid, state_grid, agent_id_grid, n_max_programs):
+    types = AGENT_TYPE_DEF.types
+    num_agents = (agent_id_grid != 0).sum()
+    # same as count_plants, as long as agent ids are < n_max_programs.
+    agents_per_id = jax.ops.segment_sum(
+        (agent_id_grid != 0).flatten().astype(jp.int32),
+        agent_id_grid.flatten(),
+        num_segments=n_max_programs,
+    )
+    safe_num_agents = jp.maximum(num_agents, 1)
+    has_agents = num_agents > 0
+
+    air_nutrients = state_grid[:, :, EN_ST + AIR_NUTRIENT_RPOS]
+    soil_nutrients = state_grid[:, :, EN_ST + EARTH_NUTRIENT_RPOS]
+
+    def nutrient_avg(nutrients, agent_type):
+        is_type = type_grid == agent_type
+        return (nutrients * is_type).sum() / is_type.sum()
+
+    return jp.stack(
+        [
+            (agents_per_id > 0).sum(),
+            num_agents,
+            jp.where(has_agents, state_grid[:, :, AGE_IDX].sum() / safe_num_agents, 0),
+            jp.where(has_agents, state_grid[:, :, STR_IDX].sum() / safe_num_agents, 0),
+            nutrient_avg(air_nutrients, types.AGENT_ROOT),
+            nutrient_avg(air_nutrients, types.AGENT_LEAF),
+            nutrient_avg(air_nutrients, types.AGENT_FLOWER),
+            nutrient_avg(soil_nutrients, types.AGENT_ROOT),
+            nutrient_avg(soil_nutrients, types.AGENT_LEAF),
+            nutrient_avg(soil_nutrients, types.AGENT_FLOWER),
+            (air_nutrients * (type_grid == types.AIR)).sum(),
+            (soil_nutrients * (type_grid == types.EARTH)).sum(),
+            (type_grid == types.AGENT_UNSPECIALIZED).sum(),
+            (type_grid == types.AGENT_ROOT).sum(),
+            (type_grid == types.AGENT_LEAF).sum(),
+            (type_grid == types.AGENT_FLOWER).sum(),
+            nutrient_avg(air_nutrients, types.AGENT_UNSPECIALIZED),
+            nutrient_avg(soil_nutrients, types.AGENT_UNSPECIALIZED),
+        ]
+    ).astype(jp.float32)
+
+
+@partial(jit, static_argnames=["n_max_programs"])
+def batch_env_metrics(envs, n_max_programs):
+    """Compute ENV_METRIC_NAMES on device for a batch of stacked environments.
+
+    Returns a [n_envs, len(ENV_METRIC_NAMES)] array.
+    """
+    return vmap(partial(_env_metrics, n_max_programs=n_max_programs))(
+        envs.type_grid, envs.state_grid, envs.agent_id_grid
+    )
+
+
+def stack_environments(environments):
+    """Stack a list of environments into one environment with a leading axis."""
+    return jax.tree_util.tree_map(lambda *grids: jp.stack(grids), *environments)
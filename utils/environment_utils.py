@@ -1,24 +1,48 @@
 import os
 
+import jax
+import numpy as np
 import wandb
-from utils.constants import logger
+from utils.constants import SIMULATION_STEP, logger
 from utils.count_utils import (
+    ENV_METRIC_NAMES,
     average_agent_age,
     average_agent_structural_integrity,
+    batch_env_metrics,
     count_agent_types,
     count_agents,
     count_plants,
     nutrient_avgs,
     nutrient_counts,
+    stack_environments,
 )
 from utils.general_utils import month_to_number
+from utils.logging_utils import BufferedLogger
 from utils.plotting_utils import filter_and_plot_histogram
+from utils.publish_utils import RunSpec, WandbSink
+from utils.results_utils import METRIC_COLUMNS, RESULT_METRIC_NAMES, write_results
+
+
+def scenario_key(scenario):
+    """Key of a scenario in the results dataset and the metrics store."""
+    return scenario.lower().replace(" ", "_")
 
 
 class EnvironmentHistory:
     def __init__(
-        self, base_config, days_since_start=0, folder="", sim=0, use_wandb=False
+        self,
+        base_config,
+        days_since_start=0,
+        folder="",
+        sim=0,
+        use_wandb=False,
+        sink=None,
     ):
+        """sink is a publish_utils sink for the per frame metrics, wandb by default.
+
+        The run group is the scenario, the folder (or the config name without
+        a folder), the same key save_results uses for the results dataset.
+        """
         self.history = []
         self.seasons = []
         self.months = []
@@ -27,6 +51,10 @@ class EnvironmentHistory:
         self.base_config = base_config
         self.sim = sim
         self.cache = {}
+        self.run = None
+        self.metric_logger = None
+        # Device arrays of batch_env_metrics, one row per environment in history.
+        self.frame_metrics = []
 
         if not base_config:
             logger.error("No base config provided.")
@@ -37,22 +65,32 @@ class EnvironmentHistory:
         os.makedirs(self.image_dir, exist_ok=True)
         self.use_wandb = use_wandb
 
-        run_name = f"sim_{sim}_{base_config.name}"
-        self.run = wandb.init(
-            mode="disabled" if not use_wandb else "online",
-            project="naco_simulations",
-            settings=wandb.Settings(start_method="fork"),
-            name=run_name,
-            group=base_config.name,
-            tags=[base_config.name, str(sim)],
-            config={
-                "days_since_start": days_since_start,
-                "years": base_config.years,
-                "days_in_year": base_config.days_in_year,
-                "folder": folder,
-                "sim": sim,
-            },
+        scenario = scenario_key(folder or base_config.name)
+        if sink is None:
+            sink = WandbSink(
+                mode="disabled" if not use_wandb else "online",
+                settings=wandb.Settings(start_method="fork"),
+            )
+        self.run = sink.start(
+            RunSpec(
+                project="naco_simulations",
+                group=scenario,
+                job_type=None,
+                name=f"sim_{sim}_{base_config.name}",
+                tags=[base_config.name, str(sim)],
+                config={
+                    "days_since_start": days_since_start,
+                    "years": base_config.years,
+                    "days_in_year": base_config.days_in_year,
+                    "months_in_year": len(base_config.month_params),
+                    "n_frames": base_config.n_frames,
+                    "steps_per_frame": base_config.steps_per_frame,
+                    "folder": folder,
+                    "sim": sim,
+                },
+            )
         )
+        self.metric_logger = BufferedLogger(self.run, ENV_METRIC_NAMES)
 
     def _cache_result(self, func, env):
         key = (func.__name__, id(env))
@@ -60,7 +98,30 @@ class EnvironmentHistory:
             self.cache[key] = func(env)
         return self.cache[key]
 
-    def add(self, environment, season, month, year):
+    def _log_metrics(self, environments, month, year, steps=None):
+        """Compute the metrics of all environments in one device call, keep them
+        for save_results and hand them to the background logger without waiting
+        for the result.
+
+        steps are the simulation steps of the environments, logged with every
+        row as SIMULATION_STEP so the day of a row does not depend on the speed.
+        """
+        if not self.base_config:
+            return
+        metrics = batch_env_metrics(
+            stack_environments(environments), self.base_config.n_max_programs
+        )
+        self.frame_metrics.append(metrics)
+        if not self.metric_logger:
+            return
+        self.metric_logger.log_batch(
+            metrics,
+            per_row={SIMULATION_STEP: steps} if steps is not None else None,
+            month=month_to_number(month),
+            year=year + 1,
+        )
+
+    def add(self, environment, season, month, year, step=None):
         if not season:
             logger.warning("No season provided for environment.")
             return
@@ -72,32 +133,25 @@ class EnvironmentHistory:
             logger.info(
                 f"Environment added to history. Current history length: {len(self.history)}"
             )
-            plant_count = self._cache_result(count_plants, self.history[-1])
-            logger.info(f"Plant count in last environment: {plant_count}\n")
-
-            wandb.log(
-                {
-                    "month": month_to_number(month),
-                    "year": year + 1,
-                    "plant_count": plant_count,
-                    "total_agents": self._cache_result(count_agents, environment),
-                    "average_agent_age": self._cache_result(
-                        average_agent_age, environment
-                    ),
-                    "average_agent_structural_integrity": self._cache_result(
-                        average_agent_structural_integrity, environment
-                    ),
-                    **self._cache_result(nutrient_avgs, environment),
-                    **self._cache_result(nutrient_counts, environment),
-                }
+            self._log_metrics(
+                [environment], month, year, None if step is None else [step]
             )
         else:
             logger.warning("Attempted to add an empty environment to history.")
 
-    def add_all(self, environments, season, month, year):
+    def add_all(self, environments, season, month, year, steps=None):
+        """Add the frames of one month, as returned by perform_simulation.
+
+        perform_simulation starts with the environment it was given, which is
+        the last frame of the previous month, so that frame is only added once.
+        steps are the frame_steps of perform_simulation, one per environment.
+        """
         if not season:
             logger.warning("No season provided for environments.")
             return
+        if environments and self.history and environments[0] is self.history[-1]:
+            environments = environments[1:]
+            steps = None if steps is None else steps[1:]
         if environments:
             self.history.extend(environments)
             self.seasons.extend([season] * len(environments))
@@ -106,25 +160,7 @@ class EnvironmentHistory:
             logger.info(
                 f"{len(environments)} environments added to history. Current history length: {len(self.history)}"
             )
-            plant_count = self._cache_result(count_plants, self.history[-1])
-            logger.info(f"Plant count in last environment: {plant_count}\n")
-
-            for env in environments:
-
-                wandb.log(
-                    {
-                        "month": month_to_number(month),
-                        "year": year + 1,
-                        "plant_count": self._cache_result(count_plants, env),
-                        "total_agents": self._cache_result(count_agents, env),
-                        "average_agent_age": self._cache_result(average_agent_age, env),
-                        "average_agent_structural_integrity": self._cache_result(
-                            average_agent_structural_integrity, env
-                        ),
-                        **self._cache_result(nutrient_avgs, env),
-                        **self._cache_result(nutrient_counts, env),
-                    }
-                )
+            self._log_metrics(environments, month, year, steps)
         else:
             logger.warning("Attempted to add empty environments to history.")
 
@@ -269,114 +305,38 @@ class EnvironmentHistory:
         return self._cache_result(count_agents, self.history[-1])
 
     def save_results(self, result_type: str, result_number=0):
-        self.finish()
-        self.months = [month.lower() for month in self.months]
-        result_type = result_type.lower().replace(" ", "_")
-        nutrient_avg_per_agent = {
-            month: {
-                nutrient: 0
-                for nutrient in [
-                    "Avg Air Nutrients in Leafs",
-                    "Avg Air Nutrients in Roots",
-                    "Avg Air Nutrients in Flowers",
-                    "Avg Air Nutrients in Unspecializeds",
-                    "Avg Soil Nutrients in Leafs",
-                    "Avg Soil Nutrients in Roots",
-                    "Avg Soil Nutrients in Flowers",
-                    "Avg Soil Nutrients in Unspecializeds",
-                ]
-            }
-            for month in self.months
-        }
-        agent_type_count_per_month = {
-            month: {
-                "leaf agent count": 0,
-                "root agent count": 0,
-                "flower agent count": 0,
-                "unspecialized agent count": 0,
-            }
-            for month in self.months
-        }
-        total_agent_count_per_month = {month: 0 for month in self.months}
-        avg_agent_age_per_month = {month: 0 for month in self.months}
-        avg_structural_integrity_per_month = {month: 0 for month in self.months}
-        month_occurrences = {
-            "january": 0,
-            "february": 0,
-            "march": 0,
-            "april": 0,
-            "may": 0,
-            "june": 0,
-            "july": 0,
-            "august": 0,
-            "september": 0,
-            "october": 0,
-            "november": 0,
-            "december": 0,
-        }
-
-        for i, env in enumerate(self.history):
-            month = self.months[i].lower()
-            month_occurrences[month] += 1
-
-            nutrient_counts = self._cache_result(nutrient_avgs, env)
-            agent_type_counts = self._cache_result(count_agent_types, env)
-            total_agent_count = self._cache_result(count_agents, env)
-
-            for nutrient, count in nutrient_counts.items():
-                nutrient_avg_per_agent[month][nutrient] += count
-
-            for agent_type, count in agent_type_counts.items():
-                if agent_type.lower() in ["leaf", "root", "flower", "unspecialized"]:
-                    agent_key = f"{agent_type.lower()} agent count"
-                    agent_type_count_per_month[month][agent_key] += count
-
-            avg_agent_age_per_month[month] += self._cache_result(average_agent_age, env)
-            avg_structural_integrity_per_month[month] += self._cache_result(
-                average_agent_structural_integrity, env
-            )
-            total_agent_count_per_month[month] += total_agent_count
-
-        for month in nutrient_avg_per_agent:
-            for nutrient in nutrient_avg_per_agent[month]:
-                nutrient_avg_per_agent[month][nutrient] /= month_occurrences[month]
+        """Save the monthly means of the history as one results dataset partition.
 
-            for agent in agent_type_count_per_month[month]:
-                agent_type_count_per_month[month][agent] /= month_occurrences[month]
-
-            total_agent_count_per_month[month] /= month_occurrences[month]
-            avg_agent_age_per_month[month] /= month_occurrences[month]
-            avg_structural_integrity_per_month[month] /= month_occurrences[month]
-
-        os.makedirs(f"analysis_results/nutrients/{result_type}", exist_ok=True)
-        os.makedirs(f"analysis_results/general/{result_type}", exist_ok=True)
+        result_type is the scenario and result_number the sim.
+        """
+        self.finish()
+        scenario = scenario_key(result_type)
+        row_keys = [
+            (year + 1, month_to_number(month))
+            for year, month in zip(self.years, self.months)
+        ]
+        rows = {key: row for row, key in enumerate(dict.fromkeys(row_keys))}
+        row_idx = np.array([rows[key] for key in row_keys], dtype=np.int64)
+        frame_metrics = np.concatenate(jax.device_get(self.frame_metrics)).astype(
+            np.float64
+        )
 
-        with open(
-            f"analysis_results/nutrients/{result_type}/sim_{result_number}.csv", "w"
-        ) as result_file:
-            result_file.write(
-                "Season,Agent Type,Agent Type Count, Avg Air Nutrients, Avg Soil Nutrients\n"
-            )
-            for month, nutrient_data in nutrient_avg_per_agent.items():
-                for agent, count in agent_type_count_per_month[month].items():
-                    air_nutrient = nutrient_data[
-                        f"Avg Air Nutrients in {agent.split()[0].title()}s"
-                    ]
-                    soil_nutrient = nutrient_data[
-                        f"Avg Soil Nutrients in {agent.split()[0].title()}s"
-                    ]
-                    result_file.write(
-                        f"{month},{agent},{int(count)},{air_nutrient},{soil_nutrient}\n"
-                    )
-
-        with open(
-            f"analysis_results/general/{result_type}/sim_{result_number}.csv", "w"
-        ) as result_file:
-            result_file.write("Season,Total in Month, Avg Agent Age, Avg Agent SI\n")
-            for month in nutrient_avg_per_agent:
-                result_file.write(
-                    f"{month}, {int(total_agent_count_per_month[month])},{avg_agent_age_per_month[month]},{avg_structural_integrity_per_month[month]}\n"
-                )
+        columns = {
+            "year": np.array([year for year, _ in rows]),
+            "month": np.array([month for _, month in rows]),
+            "n_frames": np.bincount(row_idx, minlength=len(rows)),
+        }
+        # Averages over agent types without cells are NaN, so every column is
+        # the mean of its valid frames only.
+        for name in METRIC_COLUMNS:
+            values = frame_metrics[:, ENV_METRIC_NAMES.index(RESULT_METRIC_NAMES[name])]
+            valid = np.isfinite(values)
+            sums = np.bincount(row_idx, np.where(valid, values, 0), len(rows))
+            counts = np.bincount(row_idx, valid.astype(np.float64), len(rows))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                columns[name] = sums / counts
+
+        write_results(columns, scenario, result_number)
 
     def __len__(self):
         return len(self.history)
@@ -385,8 +345,12 @@ class EnvironmentHistory:
         return iter(self.history)
 
     def finish(self):
-        if self.use_wandb and self.run:
+        if getattr(self, "metric_logger", None):
+            self.metric_logger.close()
+            self.metric_logger = None
+        if getattr(self, "run", None):
             self.run.finish()
+            self.run = None
 
     def __del__(self):
         self.finish()
@@ -0,0 +1,55 @@
+import queue
+import threading
+
+import numpy as np
+
+from utils.constants import logger
+
+
+class BufferedLogger:
+    """Log metric batches to a publish_utils run on a background thread.
+
+    log_batch only queues its arguments, so the simulation never waits on the
+    device transfer, the row formatting or the logging backend. close flushes
+    everything that was queued.
+    """
+
+    def __init__(self, run, names):
+        self.run = run
+        self.names = list(names)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def log_batch(self, values, per_row=None, **constants):
+        """Queue a [n_rows, len(names)] batch, every row extended by constants.
+
+        per_row maps further names to sequences with one value per row.
+        """
+        if not self.thread.is_alive():
+            logger.warning("Logger is closed, dropping metrics batch.")
+            return
+        self.queue.put((values, per_row or {}, constants))
+
+    def _work(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            values, per_row, constants = batch
+            try:
+                rows = [
+                    {**constants, **dict(zip(self.names, row))}
+                    for row in np.asarray(values).tolist()
+                ]
+                for name, column in per_row.items():
+                    for row, value in zip(rows, np.asarray(column).tolist()):
+                        row[name] = value
+                self.run.log(rows)
+            except Exception as e:
+                logger.error(f"Error logging metrics batch: {e}")
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
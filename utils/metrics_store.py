@@ -0,0 +1,330 @@
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+from numbers import Number
+
+import numpy as np
+
+from utils.constants import logger
+from utils.publish_utils import _to_builtin_dict
+from utils.results_utils import METRIC_COLUMNS, RESULT_METRIC_NAMES, RESULTS_SCHEMA
+
+STORE_PATH = "metrics_store"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    experiment TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    sim INTEGER NOT NULL,
+    name TEXT,
+    config TEXT,
+    UNIQUE (experiment, scenario, sim)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    metric_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, step, metric_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS samples_by_metric ON samples (metric_id, run_id, step);
+"""
+
+
+def store_path(experiment, path=STORE_PATH):
+    return os.path.join(path, f"{experiment}.sqlite")
+
+
+class MetricsStore:
+    """One SQLite file per experiment holding per step metrics of many runs.
+
+    Runs are keyed by (experiment, scenario, sim), samples by (run, step, metric).
+    Several processes can write to the same file, writes are serialized by SQLite.
+    """
+
+    def __init__(self, file_path):
+        if os.path.dirname(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file_path = file_path
+        # Runs are created on the simulation thread and logged from a background one.
+        self.connection = sqlite3.connect(
+            file_path, timeout=60, check_same_thread=False
+        )
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+        self._metric_ids = {}
+
+    def create_run(self, experiment, scenario, sim, name=None, config=None):
+        """Return the id of the run, removing the samples of an earlier run with the same key."""
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT run_id FROM runs WHERE experiment = ? AND scenario = ? AND sim = ?",
+                (experiment, scenario, sim),
+            ).fetchone()
+            if row:
+                run_id = row[0]
+                logger.warning(
+                    f"Overwriting run {experiment}/{scenario}/sim_{sim} in {self.file_path}"
+                )
+                self.connection.execute("DELETE FROM samples WHERE run_id = ?", (run_id,))
+                self.connection.execute(
+                    "UPDATE runs SET name = ?, config = ? WHERE run_id = ?",
+                    (name, json.dumps(_to_builtin_dict(config)), run_id),
+                )
+            else:
+                run_id = self.connection.execute(
+                    "INSERT INTO runs (experiment, scenario, sim, name, config) VALUES (?, ?, ?, ?, ?)",
+                    (experiment, scenario, sim, name, json.dumps(_to_builtin_dict(config))),
+                ).lastrowid
+        return run_id
+
+    def _metric_id(self, name):
+        if name not in self._metric_ids:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO metrics (name) VALUES (?)", (name,)
+            )
+            self._metric_ids[name] = self.connection.execute(
+                "SELECT metric_id FROM metrics WHERE name = ?", (name,)
+            ).fetchone()[0]
+        return self._metric_ids[name]
+
+    def insert(self, run_id, first_step, names, values):
+        """Bulk insert a [n_steps, len(names)] array of values starting at first_step."""
+        values = np.asarray(values, dtype=np.float64)
+        with self.lock, self.connection:
+            metric_ids = [self._metric_id(name) for name in names]
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO samples (run_id, step, metric_id, value) VALUES (?, ?, ?, ?)",
+                (
+                    (run_id, first_step + row, metric_id, None if np.isnan(value) else value)
+                    for row, row_values in enumerate(values.tolist())
+                    for metric_id, value in zip(metric_ids, row_values)
+                ),
+            )
+
+    def runs(self, experiment=None, scenarios=None, sims=None):
+        """Return the (run_id, experiment, scenario, sim, name) of the selected runs."""
+        query, parameters = self._run_filter(experiment, scenarios, sims)
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT run_id, experiment, scenario, sim, name FROM runs WHERE {query} "
+                "ORDER BY experiment, scenario, sim",
+                parameters,
+            ).fetchall()
+
+    def run_config(self, run_id):
+        with self.lock:
+            (config,) = self.connection.execute(
+                "SELECT config FROM runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return json.loads(config) if config else {}
+
+    def metric_names(self):
+        with self.lock:
+            return [
+                name
+                for (name,) in self.connection.execute(
+                    "SELECT name FROM metrics ORDER BY metric_id"
+                )
+            ]
+
+    def query(self, metrics, experiment=None, scenarios=None, sims=None):
+        """Return the selected metrics of the selected runs as columns.
+
+        The result holds "scenario", "sim" and "step" arrays plus one float array
+        per metric, one entry per logged step. Missing values are NaN.
+        """
+        runs = self.runs(experiment, scenarios, sims)
+        metrics = list(metrics)
+        with self.lock:
+            metric_ids = dict(
+                self.connection.execute(
+                    f"SELECT name, metric_id FROM metrics WHERE name IN ({', '.join('?' * len(metrics))})",
+                    metrics,
+                ).fetchall()
+            )
+        unknown = [metric for metric in metrics if metric not in metric_ids]
+        if unknown:
+            logger.warning(f"Metrics {unknown} were never logged, returning NaN.")
+
+        known = [metric for metric in metrics if metric in metric_ids]
+        if not runs or not known:
+            return {
+                "scenario": np.zeros(0, dtype=str),
+                "sim": np.zeros(0, dtype=np.int32),
+                "step": np.zeros(0, dtype=np.int64),
+                **{metric: np.zeros(0, dtype=np.float64) for metric in metrics},
+            }
+        run_ids = [run[0] for run in runs]
+        with self.lock:
+            samples = np.array(
+                self.connection.execute(
+                    f"SELECT run_id, step, metric_id, value FROM samples "
+                    f"WHERE run_id IN ({', '.join('?' * len(run_ids))}) "
+                    f"AND metric_id IN ({', '.join('?' * len(known))})",
+                    run_ids + [metric_ids[metric] for metric in known],
+                ).fetchall(),
+                dtype=np.float64,
+            ).reshape(-1, 4)
+
+        # Pivot the (run, step, metric, value) samples into one row per run and
+        # step.
+        keys, row_idx = np.unique(
+            samples[:, :2].astype(np.int64), axis=0, return_inverse=True
+        )
+        row_idx = row_idx.ravel()
+        column_of = np.full(max(metric_ids.values()) + 1, -1)
+        column_of[[metric_ids[metric] for metric in known]] = [
+            metrics.index(metric) for metric in known
+        ]
+        values = np.full((len(keys), len(metrics)), np.nan)
+        values[row_idx, column_of[samples[:, 2].astype(np.int64)]] = samples[:, 3]
+
+        # Keep the run order of self.runs.
+        run_ids = np.array(run_ids)
+        run_order = np.argsort(run_ids)
+        run_index = run_order[np.searchsorted(run_ids, keys[:, 0], sorter=run_order)]
+        order = np.lexsort((keys[:, 1], run_index))
+        run_index = run_index[order]
+        scenarios = np.array([run[2] for run in runs])
+        sims = np.array([run[3] for run in runs], dtype=np.int32)
+        return {
+            "scenario": scenarios[run_index],
+            "sim": sims[run_index],
+            "step": keys[order, 1],
+            **{metric: values[order, column] for column, metric in enumerate(metrics)},
+        }
+
+    @staticmethod
+    def _run_filter(experiment, scenarios, sims):
+        clauses, parameters = ["1"], []
+        if experiment is not None:
+            clauses.append("experiment = ?")
+            parameters.append(experiment)
+        if scenarios is not None:
+            clauses.append(f"scenario IN ({', '.join('?' * len(scenarios))})")
+            parameters.extend(scenarios)
+        if sims is not None:
+            clauses.append(f"sim IN ({', '.join('?' * len(sims))})")
+            parameters.extend(int(sim) for sim in sims)
+        return " AND ".join(clauses), parameters
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def load_store_results_table(store, columns=None, experiment=None, scenarios=None, sims=None):
+    """Load results schema columns from a store, like results_utils.load_results_table.
+
+    Per step metrics are averaged over every (scenario, sim, year, month), the
+    number of steps is stored in n_frames.
+    """
+    columns = list(RESULTS_SCHEMA) if columns is None else list(columns)
+    unknown = set(columns) - set(RESULTS_SCHEMA)
+    if unknown:
+        raise ValueError(f"Unknown result columns: {sorted(unknown)}")
+    metrics = [column for column in columns if column in METRIC_COLUMNS]
+    samples = store.query(
+        ["year", "month"] + [RESULT_METRIC_NAMES[metric] for metric in metrics],
+        experiment,
+        scenarios,
+        sims,
+    )
+    if not len(samples["step"]):
+        raise FileNotFoundError(f"No runs found in {store.file_path}.")
+
+    scenario_names, scenario_idx = np.unique(samples["scenario"], return_inverse=True)
+    keys = np.stack(
+        [scenario_idx, samples["sim"], samples["year"], samples["month"]], -1
+    ).astype(np.int64)
+    unique_keys, row_idx = np.unique(keys, axis=0, return_inverse=True)
+    row_idx = row_idx.reshape(-1)
+    n_frames = np.bincount(row_idx, minlength=len(unique_keys))
+
+    table = {
+        "scenario": scenario_names[unique_keys[:, 0]],
+        "sim": unique_keys[:, 1].astype(np.int32),
+        "year": unique_keys[:, 2],
+        "month": unique_keys[:, 3],
+        "n_frames": n_frames,
+    }
+    for metric in metrics:
+        totals = np.zeros(len(unique_keys))
+        np.add.at(totals, row_idx, samples[RESULT_METRIC_NAMES[metric]])
+        table[metric] = totals / n_frames
+    return {name: table[name] for name in ["scenario", "sim"] + columns}
+
+
+class StoreRun:
+    def __init__(self, store, run_spec):
+        self.store = store
+        self.run_id = store.create_run(
+            run_spec.project,
+            run_spec.group or run_spec.name,
+            int((run_spec.config or {}).get("sim", 0)),
+            run_spec.name,
+            run_spec.config,
+        )
+        self.step = 0
+
+    def define_metrics(self, metrics):
+        pass
+
+    def log(self, rows):
+        rows = [
+            {
+                name: value
+                for name, value in _to_builtin_dict(row).items()
+                if isinstance(value, Number)
+            }
+            for row in rows
+        ]
+        names = list(dict.fromkeys(name for row in rows for name in row))
+        values = [[row.get(name, np.nan) for name in names] for row in rows]
+        self.store.insert(self.run_id, self.step, names, values)
+        self.step += len(rows)
+
+    def finish(self):
+        # Samples are committed by every insert, the store is shared by the runs of a sink.
+        pass
+
+
+class StoreSink:
+    """Write runs into one MetricsStore file per project, see store_path.
+
+    The run scenario is the run group (or its name without a group) and its
+    sim the "sim" config entry. Runs of the same project share one connection,
+    which stays open until close.
+    """
+
+    # Writes of all runs are serialized by the lock of their store.
+    executor_class = concurrent.futures.ThreadPoolExecutor
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.stores = {}
+        self.lock = threading.Lock()
+
+    def start(self, run_spec):
+        file_path = store_path(run_spec.project, self.path)
+        with self.lock:
+            if file_path not in self.stores:
+                self.stores[file_path] = MetricsStore(file_path)
+            store = self.stores[file_path]
+        return StoreRun(store, run_spec)
+
+    def close(self):
+        with self.lock:
+            for store in self.stores.values():
+                store.close()
+            self.stores = {}
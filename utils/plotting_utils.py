@@ -15,9 +15,21 @@ def plot_histogram(
     days_since_start=0,
     y_axis_lower_limit=None,
     y_axis_upper_limit=None,
+    fig=None,
 ):
+    """Plot data lines over a season background and save them to file_name.
+
+    file_name can also be a list, to save the same plot in several formats.
+    A given fig is cleared and reused, otherwise a new figure is created and
+    closed again after saving.
+    """
+    own_fig = fig is None
     try:
-        fig, ax = plt.subplots(figsize=(10, 6))
+        if own_fig:
+            fig = plt.figure(figsize=(10, 6))
+        else:
+            fig.clear()
+        ax = fig.add_subplot()
         time_points = range(len(season_hist))
         lines = plot_data_lines(ax, data, time_points)
         add_season_background(ax, season_hist)
@@ -33,11 +45,15 @@ def plot_histogram(
             ax.set_ylim(top=y_axis_upper_limit)
         adjust_x_axis_labels(ax, days_since_start)
 
-        plt.subplots_adjust(right=0.7)
-        plt.savefig(file_name)
-        logger.info(f"Saved plot to {file_name}")
+        fig.subplots_adjust(right=0.7)
+        for path in [file_name] if isinstance(file_name, str) else file_name:
+            fig.savefig(path)
+            logger.info(f"Saved plot to {path}")
     except Exception as e:
         logger.error(f"Error plotting histogram: {e}")
+    finally:
+        if own_fig and fig is not None:
+            plt.close(fig)
 
 
 def adjust_x_axis_labels(ax, days_since_start):
@@ -65,20 +81,23 @@ def plot_data_lines(ax, data, time_points):
 
 
 def add_season_background(ax, season_hist):
-    current_season_base = season_hist[0].split()[0]
-    start_index = 0
-    for i, season in enumerate(season_hist):
-        base_season = season.split()[0]
-        if base_season != current_season_base or i == len(season_hist) - 1:
-            end_index = i if i < len(season_hist) - 1 else i + 1
-            ax.axvspan(
-                start_index,
-                end_index,
-                color=SEASON_COLORS.get(current_season_base, "grey"),
-                alpha=0.2,
-            )
-            current_season_base = base_season
-            start_index = i
+    """Shade every run of equal seasons, with one call per season colour."""
+    if not len(season_hist):
+        return
+    base_seasons = np.array([season.split()[0] for season in season_hist])
+    starts = np.concatenate(
+        [[0], np.flatnonzero(base_seasons[1:] != base_seasons[:-1]) + 1]
+    )
+    ends = np.append(starts[1:], len(base_seasons))
+    for base_season in np.unique(base_seasons[starts]):
+        in_season = base_seasons[starts] == base_season
+        ax.broken_barh(
+            list(zip(starts[in_season], ends[in_season] - starts[in_season])),
+            (0, 1),
+            transform=ax.get_xaxis_transform(),
+            color=SEASON_COLORS.get(base_season, "grey"),
+            alpha=0.2,
+        )
 
 
 def add_legend(ax, lines, legend_title):
@@ -118,6 +137,7 @@ def filter_and_plot_histogram(
     days_since_start=0,
     y_axis_lower_limit=None,
     y_axis_upper_limit=None,
+    fig=None,
 ):
     if filter_keys is None:
         filter_keys = set(hist_data[0].keys())
@@ -138,4 +158,5 @@ def filter_and_plot_histogram(
         days_since_start,
         y_axis_lower_limit,
         y_axis_upper_limit,
+        fig,
     )
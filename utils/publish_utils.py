@@ -0,0 +1,179 @@
+import concurrent.futures
+import json
+import os
+import time
+import uuid
+from collections import namedtuple
+
+import numpy as np
+import wandb
+
+from utils.constants import logger
+
+LOCAL_SINK_PATH = "local_runs"
+MAX_WORKERS = 8
+RETRIES = 3
+RETRY_BACKOFF = 2.0
+
+# Everything needed to create a run, in wandb terms. A run with an id resumes
+# the run with that id if it exists, see publish_run.
+RunSpec = namedtuple(
+    "RunSpec", "project group job_type name tags config id", defaults=(None,)
+)
+
+
+def _to_builtin(value):
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    if hasattr(value, "tolist"):
+        # jax arrays.
+        return value.tolist()
+    return value
+
+
+def _to_builtin_dict(values):
+    return {key: _to_builtin(value) for key, value in (values or {}).items()}
+
+
+class WandbRun:
+    def __init__(self, run_spec, mode="online", **init_kwargs):
+        self.run = wandb.init(
+            mode=mode,
+            project=run_spec.project,
+            group=run_spec.group,
+            job_type=run_spec.job_type,
+            name=run_spec.name,
+            tags=run_spec.tags,
+            config=run_spec.config,
+            id=run_spec.id,
+            resume="allow" if run_spec.id else None,
+            reinit=True,
+            **init_kwargs,
+        )
+        # Rows an earlier attempt already logged to a resumed run are skipped.
+        self.skip = self.run.step if run_spec.id and self.run.resumed else 0
+
+    def define_metrics(self, metrics):
+        for metric in metrics:
+            self.run.define_metric(metric)
+
+    def log(self, rows):
+        rows = list(rows)
+        skipped = min(self.skip, len(rows))
+        self.skip -= skipped
+        for row in rows[skipped:]:
+            self.run.log(row)
+
+    def finish(self):
+        self.run.finish()
+
+
+class WandbSink:
+    # wandb only handles one active run per process well.
+    executor_class = concurrent.futures.ProcessPoolExecutor
+
+    def __init__(self, mode="online", **init_kwargs):
+        self.mode = mode
+        self.init_kwargs = init_kwargs
+
+    def start(self, run_spec):
+        return WandbRun(run_spec, self.mode, **self.init_kwargs)
+
+
+class LocalRun:
+    def __init__(self, file_path, run_spec):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file = open(file_path, "w")
+        run_info = run_spec._asdict()
+        run_info["config"] = _to_builtin_dict(run_spec.config)
+        self._write({"run": run_info})
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def define_metrics(self, metrics):
+        self._write({"metrics": list(metrics)})
+
+    def log(self, rows):
+        self.file.writelines(
+            json.dumps({"log": _to_builtin_dict(row)}) + "\n" for row in rows
+        )
+
+    def finish(self):
+        self.file.close()
+
+
+class LocalSink:
+    """File-backed stand-in for wandb, one JSON lines file per run.
+
+    Files live in {path}/{project}/{group}/{name}.jsonl, see read_local_run.
+    """
+
+    executor_class = concurrent.futures.ThreadPoolExecutor
+
+    def __init__(self, path=LOCAL_SINK_PATH):
+        self.path = path
+
+    def start(self, run_spec):
+        file_path = os.path.join(
+            self.path, run_spec.project, run_spec.group or "", f"{run_spec.name}.jsonl"
+        )
+        return LocalRun(file_path, run_spec)
+
+
+def read_local_run(file_path):
+    """Return the run info, defined metrics and logged rows of a LocalSink run."""
+    run_info, metrics, rows = None, [], []
+    with open(file_path) as run_file:
+        for line in run_file:
+            record = json.loads(line)
+            if "run" in record:
+                run_info = record["run"]
+            elif "metrics" in record:
+                metrics.extend(record["metrics"])
+            else:
+                rows.append(record["log"])
+    return run_info, metrics, rows
+
+
+def publish_run(sink, run_spec, rows, metrics=(), retries=RETRIES):
+    """Publish all rows of one run, retrying the whole run on failure.
+
+    Every attempt uses the same run id, so a retry continues the run a failed
+    attempt left behind instead of creating a second one.
+    """
+    if run_spec.id is None:
+        run_spec = run_spec._replace(id=uuid.uuid4().hex)
+    for attempt in range(retries + 1):
+        try:
+            run = sink.start(run_spec)
+            try:
+                run.define_metrics(metrics)
+                run.log(rows)
+            finally:
+                run.finish()
+            return run_spec.name
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning(
+                f"Publishing run {run_spec.name} failed ({e}), retrying {attempt + 1}/{retries}."
+            )
+            time.sleep(RETRY_BACKOFF**attempt)
+
+
+def publish_runs(sink, runs, metrics=(), max_workers=MAX_WORKERS, retries=RETRIES):
+    """Publish (run_spec, rows) pairs concurrently. Returns the failed run names."""
+    failed = []
+    with sink.executor_class(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(publish_run, sink, run_spec, rows, metrics, retries): run_spec.name
+            for run_spec, rows in runs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Could not publish run {futures[future]}: {e}")
+                failed.append(futures[future])
+    return failed
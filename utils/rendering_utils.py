@@ -0,0 +1,252 @@
+from collections import namedtuple
+from functools import lru_cache, partial
+
+import cv2
+import jax
+import jax.numpy as jp
+import numpy as np
+from jax import jit, lax, vmap
+from self_organising_systems.biomakerca import environments as evm
+
+from utils.count_utils import stack_environments
+
+TEXT_FONT = cv2.FONT_HERSHEY_SIMPLEX
+TEXT_ORIGIN = (5, 15)
+TEXT_FONT_SCALE = 0.5
+TEXT_COLOR = (0, 0, 0)
+TEXT_THICKNESS = 1
+# Printable ASCII, other characters are drawn as "?".
+TEXT_CHARACTERS = [chr(code) for code in range(32, 127)]
+
+
+# One output of render_views. mode is "full", "thumbnail", "crop" or "tracking".
+# Crops are (height, width) cells at origin (row, column); tracking crops move
+# to the region with most agents of every rendered batch. Thumbnails and crops
+# are padded with white to even sizes, which yuv420p video needs.
+RenderView = namedtuple(
+    "RenderView", "name mode zoom_sz stride crop_shape crop_origin annotate"
+)
+
+
+def full_view(zoom_sz, name="full"):
+    return RenderView(name, "full", zoom_sz, 1, None, None, True)
+
+
+def thumbnail_view(stride, name="thumbnail"):
+    return RenderView(name, "thumbnail", 1, stride, None, None, False)
+
+
+def crop_view(crop_origin, crop_shape, zoom_sz, name="crop"):
+    return RenderView(name, "crop", zoom_sz, 1, tuple(crop_shape), tuple(crop_origin), True)
+
+
+def tracking_view(crop_shape, zoom_sz, name="tracking"):
+    return RenderView(name, "tracking", zoom_sz, 1, tuple(crop_shape), None, True)
+
+
+def _to_uint8(images, zoom_sz):
+    images = jp.repeat(jp.repeat(images, zoom_sz, 1), zoom_sz, 2)
+    return (jp.clip(images, 0.0, 1.0) * 255).round().astype(jp.uint8)
+
+
+def _even_shape(height, width):
+    return height + height % 2, width + width % 2
+
+
+def _pad_to_even(frames):
+    """Pad [n, h, w, 3] frames with white at the bottom and right to even h and w."""
+    _, height, width, _ = frames.shape
+    even_height, even_width = _even_shape(height, width)
+    return jp.pad(
+        frames,
+        ((0, 0), (0, even_height - height), (0, even_width - width), (0, 0)),
+        constant_values=255,
+    )
+
+
+def _densest_origin(is_agent, crop_shape):
+    """Origin of the crop_shape window holding most agents over all frames."""
+    counts = jp.pad(is_agent.sum(0).astype(jp.int32), ((1, 0), (1, 0)))
+    integral = counts.cumsum(0).cumsum(1)
+    height, width = crop_shape
+    window_counts = (
+        integral[height:, width:]
+        - integral[:-height, width:]
+        - integral[height:, :-width]
+        + integral[:-height, :-width]
+    )
+    return jp.unravel_index(window_counts.argmax(), window_counts.shape)
+
+
+@partial(jit, static_argnames=["env_config", "zoom_sz"])
+def render_frames(envs, env_config, zoom_sz):
+    """Colour map and zoom stacked environments into [n, h * zoom_sz, w * zoom_sz, 3] uint8 frames."""
+    images = vmap(partial(evm.grab_image_from_env, config=env_config))(envs)
+    return _to_uint8(images, zoom_sz)
+
+
+@partial(jit, static_argnames=["env_config", "views"])
+def render_views(envs, env_config, views):
+    """Colour map stacked environments once and cut every view out of it.
+
+    Returns a dict of view name to [n, h, w, 3] uint8 frames, so only the
+    pixels of the views are zoomed and transferred.
+    """
+    images = vmap(partial(evm.grab_image_from_env, config=env_config))(envs)
+    n_frames, grid_height, grid_width, channels = images.shape
+    outputs = {}
+    for view in views:
+        if view.mode == "full":
+            view_images = images
+        elif view.mode == "thumbnail":
+            view_images = images[:, :: view.stride, :: view.stride]
+        elif view.mode in ("crop", "tracking"):
+            crop_shape = (
+                min(view.crop_shape[0], grid_height),
+                min(view.crop_shape[1], grid_width),
+            )
+            if view.mode == "crop":
+                origin = view.crop_origin
+            else:
+                origin = _densest_origin(
+                    env_config.etd.is_agent_fn(envs.type_grid), crop_shape
+                )
+            view_images = lax.dynamic_slice(
+                images, (0, origin[0], origin[1], 0), (n_frames,) + crop_shape + (channels,)
+            )
+        else:
+            raise ValueError(f"Unknown render view mode {view.mode}")
+        view_frames = _to_uint8(view_images, view.zoom_sz)
+        outputs[view.name] = (
+            view_frames if view.mode == "full" else _pad_to_even(view_frames)
+        )
+    return outputs
+
+
+def render_environments(environments, env_config, zoom_sz):
+    """Render a list of environments in one device call, fetched as a numpy array."""
+    return np.asarray(
+        render_frames(stack_environments(environments), env_config, zoom_sz)
+    )
+
+
+def render_environment_views(environments, env_config, views):
+    """Render all views of a list of environments with one device call and fetch."""
+    return jax.device_get(
+        render_views(stack_environments(environments), env_config, tuple(views))
+    )
+
+
+def frame_text(step, speed, season=""):
+    if season == "":
+        return "Step {:<7} Speed: {}x".format(step, speed)
+    return "Step {:<7} Speed: {}x   Season: {}".format(step, speed, season)
+
+
+def text_band_height(frame_height):
+    # ensure to preserve even size (assumes the input size was even).
+    band_height = frame_height // 15
+    return band_height if band_height % 2 == 0 else band_height + 1
+
+
+class TextOverlay:
+    """Draws text bands from a glyph atlas that is rasterized once with cv2.
+
+    Every glyph is stored as an anti-aliased coverage mask, placed at the
+    advance of the previous glyphs, so whole batches of strings are composited
+    with array operations instead of a cv2.putText call per frame.
+    """
+
+    def __init__(self, band_height):
+        self.band_height = band_height
+        sizes = [
+            cv2.getTextSize(character, TEXT_FONT, TEXT_FONT_SCALE, TEXT_THICKNESS)[0]
+            for character in TEXT_CHARACTERS
+        ]
+        # Anti-aliasing can draw outside of the advance width.
+        self.margin = TEXT_THICKNESS + 2
+        self.cell_width = max(width for width, _ in sizes) + 2 * self.margin
+        self.advances = np.array([width for width, _ in sizes] + [0], dtype=np.int64)
+        # The last glyph is empty, used to pad shorter strings.
+        self.atlas = np.zeros(
+            (len(TEXT_CHARACTERS) + 1, band_height, self.cell_width), np.uint8
+        )
+        for glyph, character in zip(self.atlas, TEXT_CHARACTERS):
+            cv2.putText(
+                glyph,
+                character,
+                (self.margin, TEXT_ORIGIN[1]),
+                TEXT_FONT,
+                TEXT_FONT_SCALE,
+                255,
+                TEXT_THICKNESS,
+                cv2.LINE_AA,
+            )
+        self.glyph_index = {
+            character: index for index, character in enumerate(TEXT_CHARACTERS)
+        }
+        self.unknown_glyph = self.glyph_index["?"]
+        self.empty_glyph = len(TEXT_CHARACTERS)
+
+    def coverage(self, texts, width):
+        """Return the [len(texts), band_height, width] uint8 text coverage."""
+        max_length = max((len(text) for text in texts), default=0)
+        glyphs = np.full((len(texts), max_length), self.empty_glyph, np.int64)
+        for row, text in enumerate(texts):
+            glyphs[row, : len(text)] = [
+                self.glyph_index.get(character, self.unknown_glyph) for character in text
+            ]
+        advances = self.advances[glyphs]
+        starts = TEXT_ORIGIN[0] - self.margin + np.cumsum(advances, 1) - advances
+        # Columns outside of the band go to a spare column that is cut off.
+        columns = np.clip(starts[..., None] + np.arange(self.cell_width), 0, width)
+        rows = np.arange(len(texts))[:, None]
+
+        coverage = np.zeros((len(texts), width + 1, self.band_height), np.uint8)
+        # Glyphs of neighbouring characters overlap, but the glyphs at one
+        # position never do, so every position is one buffered gather and store.
+        for position in range(max_length):
+            position_columns = columns[:, position]
+            coverage[rows, position_columns] = np.maximum(
+                coverage[rows, position_columns],
+                self.atlas[glyphs[:, position]].transpose(0, 2, 1),
+            )
+        return coverage[:, :width].transpose(0, 2, 1)
+
+    def draw(self, bands, texts):
+        """Draw the texts onto [len(texts), band_height, width, 3] uint8 bands in place."""
+        alpha = self.coverage(texts, bands.shape[2])[..., None].astype(np.uint16)
+        color = np.array(TEXT_COLOR, np.uint16)
+        bands[:] = (bands * (255 - alpha) + color * alpha + 127) // 255
+        return bands
+
+
+@lru_cache(maxsize=None)
+def text_overlay(band_height):
+    return TextOverlay(band_height)
+
+
+def view_frame_shape(view, frames):
+    """(height, width) of the written frames of a view, given its rendered frames."""
+    height, width = frames.shape[1:3]
+    if view.mode != "full":
+        height, width = _even_shape(height, width)
+    return (height + text_band_height(height) if view.annotate else height, width)
+
+
+def add_text_bands(frames, texts):
+    """Return uint8 frames with a white band holding the given text on top."""
+    n_frames, height, width, channels = frames.shape
+    band_height = text_band_height(height)
+    padded = np.empty((n_frames, band_height + height, width, channels), np.uint8)
+    padded[:, :band_height] = 255
+    padded[:, band_height:] = frames
+    text_overlay(band_height).draw(padded[:, :band_height], texts)
+    return padded
+
+
+def pad_text(img, text):
+    """Add a text band on top of a single float [0, 1] or uint8 image."""
+    if img.dtype != np.uint8:
+        img = (np.clip(img, 0, 1) * 255).round().astype(np.uint8)
+    return add_text_bands(img[None], [text])[0]
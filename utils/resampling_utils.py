@@ -0,0 +1,143 @@
+import concurrent.futures
+
+import numpy as np
+
+from utils.statistics_utils import BASELINE_SCENARIO
+
+N_RESAMPLES = 10000
+BATCH_SIZE = 1000
+# Above this many resamples, batches are spread over a process pool.
+PARALLEL_THRESHOLD = 50000
+
+
+def _bootstrap_batch(differences, seed_sequence, batch_size):
+    rng = np.random.default_rng(seed_sequence)
+    n_sims = differences.shape[0]
+    indices = rng.integers(0, n_sims, size=(batch_size, n_sims))
+    return differences[indices].mean(1)
+
+
+def _sign_flip_batch(differences, seed_sequence, batch_size):
+    rng = np.random.default_rng(seed_sequence)
+    n_sims = differences.shape[0]
+    signs = rng.choice(np.array([-1.0, 1.0]), size=(batch_size, n_sims))
+    signs = signs.reshape(signs.shape + (1,) * (differences.ndim - 1))
+    return (signs * differences[None]).mean(1)
+
+
+def _resample(batch_f, differences, n_resamples, seed, batch_size, max_workers):
+    """Evaluate batch_f over all batches and stack the [n_resamples, ...] result.
+
+    Every batch has its own seed spawned from seed, so results do not depend on
+    whether batches run serially or in a worker pool. seed is an int or a
+    SeedSequence.
+    """
+    batch_sizes = [batch_size] * (n_resamples // batch_size)
+    if n_resamples % batch_size:
+        batch_sizes.append(n_resamples % batch_size)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seed_sequences = seed.spawn(len(batch_sizes))
+
+    if n_resamples < PARALLEL_THRESHOLD or max_workers == 1:
+        batches = [
+            batch_f(differences, seed_sequence, size)
+            for seed_sequence, size in zip(seed_sequences, batch_sizes)
+        ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            batches = list(
+                executor.map(
+                    batch_f,
+                    [differences] * len(batch_sizes),
+                    seed_sequences,
+                    batch_sizes,
+                )
+            )
+    return np.concatenate(batches, 0)
+
+
+def bootstrap_ci(
+    a,
+    b,
+    n_resamples=N_RESAMPLES,
+    confidence=0.95,
+    seed=0,
+    batch_size=BATCH_SIZE,
+    max_workers=None,
+):
+    """Percentile bootstrap CI of the mean paired difference a - b.
+
+    a and b are [sim, ...] arrays, the remaining axes are resampled jointly.
+    Returns the lower and upper bounds, each shaped like a[0].
+    """
+    differences = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    means = _resample(
+        _bootstrap_batch, differences, n_resamples, seed, batch_size, max_workers
+    )
+    alpha = (1 - confidence) / 2
+    return np.quantile(means, alpha, axis=0), np.quantile(means, 1 - alpha, axis=0)
+
+
+def paired_permutation_test(
+    a, b, n_resamples=N_RESAMPLES, seed=0, batch_size=BATCH_SIZE, max_workers=None
+):
+    """Two-sided sign-flip permutation test of the mean paired difference a - b.
+
+    a and b are [sim, ...] arrays. Returns p-values shaped like a[0].
+    """
+    differences = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    observed = np.abs(differences.mean(0))
+    permuted = _resample(
+        _sign_flip_batch, differences, n_resamples, seed, batch_size, max_workers
+    )
+    # Allow for floating point noise when counting ties.
+    n_extreme = (np.abs(permuted) >= observed - 1e-12).sum(0)
+    return (n_extreme + 1) / (n_resamples + 1)
+
+
+def resample_scenarios(
+    results,
+    baseline=BASELINE_SCENARIO,
+    n_resamples=N_RESAMPLES,
+    confidence=0.95,
+    seed=0,
+    max_workers=None,
+):
+    """Bootstrap CIs and permutation p-values of every scenario against baseline.
+
+    Returns the list of compared scenarios and a dict of [scenario, month, metric]
+    arrays, like statistics_utils.compare_scenarios. Every bootstrap and
+    permutation test gets its own child seed of seed, so their resamples are
+    independent.
+    """
+    baseline_data = results.data[results.scenarios.index(baseline)]
+    others = [scenario for scenario in results.scenarios if scenario != baseline]
+
+    seed_sequences = np.random.SeedSequence(seed).spawn(2 * len(others))
+    statistics = {"ci_low": [], "ci_high": [], "permutation_p_value": []}
+    for scenario_index, scenario in enumerate(others):
+        bootstrap_seed, permutation_seed = seed_sequences[
+            2 * scenario_index : 2 * scenario_index + 2
+        ]
+        scenario_data = results.data[results.scenarios.index(scenario)]
+        ci_low, ci_high = bootstrap_ci(
+            baseline_data,
+            scenario_data,
+            n_resamples,
+            confidence,
+            bootstrap_seed,
+            max_workers=max_workers,
+        )
+        statistics["ci_low"].append(ci_low)
+        statistics["ci_high"].append(ci_high)
+        statistics["permutation_p_value"].append(
+            paired_permutation_test(
+                baseline_data,
+                scenario_data,
+                n_resamples,
+                permutation_seed,
+                max_workers=max_workers,
+            )
+        )
+    return others, {name: np.stack(values) for name, values in statistics.items()}
@@ -0,0 +1,184 @@
+import os
+import re
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from utils.constants import logger
+from utils.general_utils import month_to_number
+
+DATASET_PATH = "analysis_results/dataset"
+CSV_RESULTS_PATH = "analysis_results"
+
+RESULT_AGENT_TYPES = ["leaf", "root", "flower", "unspecialized"]
+# Results schema agent types and their names in count_agent_types.
+RESULT_AGENT_TYPE_NAMES = {
+    "leaf": "Leaf",
+    "root": "Root",
+    "flower": "Flower",
+    "unspecialized": "Unassigned",
+}
+# Legacy CSV results averaged every month over all years.
+ALL_YEARS = -1
+
+# Every partition (one scenario and sim) holds one row per year and month.
+# Metric columns are means over the frames of that month.
+KEY_COLUMNS = {
+    "year": np.int16,
+    "month": np.int8,
+    "n_frames": np.int32,
+}
+METRIC_COLUMNS = {
+    "agent_count": np.float64,
+    "plant_count": np.float64,
+    "avg_agent_age": np.float64,
+    "avg_agent_si": np.float64,
+    "air_nutrients_in_air": np.float64,
+    "soil_nutrients_in_soil": np.float64,
+    **{f"{agent}_count": np.float64 for agent in RESULT_AGENT_TYPES},
+    **{f"{agent}_avg_air_nutrients": np.float64 for agent in RESULT_AGENT_TYPES},
+    **{f"{agent}_avg_soil_nutrients": np.float64 for agent in RESULT_AGENT_TYPES},
+}
+RESULTS_SCHEMA = {**KEY_COLUMNS, **METRIC_COLUMNS}
+
+# Results schema columns and the per frame metric they are averaged from.
+RESULT_METRIC_NAMES = {
+    "agent_count": "total_agents",
+    "plant_count": "plant_count",
+    "avg_agent_age": "average_agent_age",
+    "avg_agent_si": "average_agent_structural_integrity",
+    "air_nutrients_in_air": "Air Nutrients in Air",
+    "soil_nutrients_in_soil": "Soil Nutrients in Soil",
+    **{
+        f"{agent}_count": f"{RESULT_AGENT_TYPE_NAMES[agent]} Count"
+        for agent in RESULT_AGENT_TYPES
+    },
+    **{
+        f"{agent}_avg_air_nutrients": f"Avg Air Nutrients in {RESULT_AGENT_TYPE_NAMES[agent]}s"
+        for agent in RESULT_AGENT_TYPES
+    },
+    **{
+        f"{agent}_avg_soil_nutrients": f"Avg Soil Nutrients in {RESULT_AGENT_TYPE_NAMES[agent]}s"
+        for agent in RESULT_AGENT_TYPES
+    },
+}
+
+
+def partition_path(scenario, sim, results_path=DATASET_PATH):
+    return os.path.join(results_path, scenario, f"sim_{sim}.npz")
+
+
+def write_results(columns, scenario, sim, results_path=DATASET_PATH):
+    """Write the columns of one scenario and sim, cast to RESULTS_SCHEMA."""
+    missing = set(RESULTS_SCHEMA) - set(columns)
+    unknown = set(columns) - set(RESULTS_SCHEMA)
+    if missing or unknown:
+        raise ValueError(
+            f"Columns do not match the results schema. Missing: {sorted(missing)}, unknown: {sorted(unknown)}"
+        )
+    n_rows = {len(values) for values in columns.values()}
+    if len(n_rows) != 1:
+        raise ValueError("All result columns must have the same length.")
+
+    file_path = partition_path(scenario, sim, results_path)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    np.savez(
+        file_path,
+        **{
+            name: np.asarray(columns[name], dtype=dtype)
+            for name, dtype in RESULTS_SCHEMA.items()
+        },
+    )
+    logger.info(f"Saved results to {file_path}")
+
+
+def list_partitions(results_path=DATASET_PATH, scenarios=None, sims=None):
+    """Return the sorted (scenario, sim) pairs available in the dataset."""
+    partitions = []
+    for file_path in glob(os.path.join(results_path, "*", "sim_*.npz")):
+        scenario = os.path.basename(os.path.dirname(file_path))
+        sim = int(re.search(r"sim_(\d+)\.npz$", file_path).group(1))
+        if (scenarios is None or scenario in scenarios) and (
+            sims is None or sim in sims
+        ):
+            partitions.append((scenario, sim))
+    return sorted(partitions)
+
+
+def load_results_table(columns=None, scenarios=None, sims=None, results_path=DATASET_PATH):
+    """Load the selected columns of the selected partitions.
+
+    Only the requested columns are read from disk. Returns a dict of column name
+    to array, including the "scenario" and "sim" partition keys. If results_path
+    does not exist yet, the legacy CSV results are converted into it first.
+    """
+    columns = list(RESULTS_SCHEMA) if columns is None else list(columns)
+    unknown = set(columns) - set(RESULTS_SCHEMA)
+    if unknown:
+        raise ValueError(f"Unknown result columns: {sorted(unknown)}")
+    if not os.path.isdir(results_path) and os.path.isdir(
+        os.path.join(CSV_RESULTS_PATH, "general")
+    ):
+        logger.info(
+            f"No results dataset in {results_path}, converting the legacy CSV results in {CSV_RESULTS_PATH}."
+        )
+        import_csv_results(CSV_RESULTS_PATH, results_path)
+    partitions = list_partitions(results_path, scenarios, sims)
+    if not partitions:
+        raise FileNotFoundError(
+            f"No results found in {results_path}. Legacy CSV results can be converted with import_csv_results."
+        )
+
+    table = {name: [] for name in ["scenario", "sim"] + columns}
+    for scenario, sim in partitions:
+        with np.load(partition_path(scenario, sim, results_path)) as partition:
+            n_rows = len(partition["month"])
+            for name in columns:
+                table[name].append(partition[name])
+        table["scenario"].append(np.full(n_rows, scenario))
+        table["sim"].append(np.full(n_rows, sim, dtype=np.int32))
+    return {name: np.concatenate(values) for name, values in table.items()}
+
+
+def _read_csv(file_path):
+    data = pd.read_csv(file_path, skipinitialspace=True)
+    data.columns = data.columns.str.strip()
+    return data
+
+
+def import_csv_results(csv_results_path=CSV_RESULTS_PATH, results_path=DATASET_PATH):
+    """Convert the legacy general and nutrient CSV results into the dataset.
+
+    Legacy results averaged each month over all years, so they get ALL_YEARS as
+    year. Metrics that were not recorded are set to NaN.
+    """
+    for general_path in glob(os.path.join(csv_results_path, "general", "*", "sim_*.csv")):
+        scenario = os.path.basename(os.path.dirname(general_path))
+        sim = int(re.search(r"sim_(\d+)\.csv$", general_path).group(1))
+        nutrients_path = os.path.join(
+            csv_results_path, "nutrients", scenario, f"sim_{sim}.csv"
+        )
+        if not os.path.exists(nutrients_path):
+            logger.warning(f"No nutrient results for {general_path}, skipping.")
+            continue
+
+        general = _read_csv(general_path)
+        nutrients = _read_csv(nutrients_path)
+        n_rows = len(general)
+        columns = {name: np.full(n_rows, np.nan) for name in METRIC_COLUMNS}
+        columns["year"] = np.full(n_rows, ALL_YEARS)
+        columns["month"] = general["Season"].str.strip().map(month_to_number)
+        columns["n_frames"] = np.zeros(n_rows)
+        columns["agent_count"] = general["Total in Month"]
+        columns["avg_agent_age"] = general["Avg Agent Age"]
+        columns["avg_agent_si"] = general["Avg Agent SI"]
+
+        # Nutrient rows are ordered by month, then by agent type.
+        for agent in RESULT_AGENT_TYPES:
+            agent_rows = nutrients[nutrients["Agent Type"] == f"{agent} agent count"]
+            columns[f"{agent}_count"] = agent_rows["Agent Type Count"].to_numpy()
+            columns[f"{agent}_avg_air_nutrients"] = agent_rows["Avg Air Nutrients"].to_numpy()
+            columns[f"{agent}_avg_soil_nutrients"] = agent_rows["Avg Soil Nutrients"].to_numpy()
+
+        write_results(columns, scenario, sim, results_path)
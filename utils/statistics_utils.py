@@ -0,0 +1,137 @@
+from collections import namedtuple
+
+import numpy as np
+from scipy.stats import t as t_distribution
+
+from utils.constants import logger
+from utils.metrics_store import load_store_results_table
+from utils.results_utils import DATASET_PATH, load_results_table
+
+BASELINE_SCENARIO = "basic_seasons"
+SCENARIOS = ["basic_seasons", "warm_winter_month"]
+MONTHS = list(range(1, 13))
+
+# data is [scenario, sim, month, metric], metrics are results schema columns.
+SimulationResults = namedtuple(
+    "SimulationResults", "data scenarios sims months metrics"
+)
+
+
+def paired_sims(scenario_column, sim_column, scenarios):
+    """Return the sorted sims present in every scenario, warning about the others."""
+    sims_per_scenario = [
+        set(sim_column[scenario_column == scenario].tolist()) for scenario in scenarios
+    ]
+    all_sims = set().union(*sims_per_scenario)
+    sims = sorted(set.intersection(*sims_per_scenario))
+    if len(sims) < len(all_sims):
+        logger.warning(f"Dropping unpaired sims {sorted(all_sims - set(sims))}.")
+    return sims
+
+
+def load_results(
+    metrics, results_path=DATASET_PATH, scenarios=SCENARIOS, years=None, store=None
+):
+    """Load the given metrics of all sims of all scenarios as SimulationResults.
+
+    Results are read from the dataset at results_path, or from the per frame
+    metrics in a MetricsStore if store is given.
+
+    Sims are aligned by their sim id, sims missing in any scenario are dropped.
+    Every month is averaged over the selected years (all years if None),
+    weighted by their number of frames.
+    """
+    columns = ["year", "month", "n_frames"] + list(metrics)
+    if store is not None:
+        table = load_store_results_table(store, columns, scenarios=scenarios)
+    else:
+        table = load_results_table(columns, scenarios, None, results_path)
+    sims = paired_sims(table["scenario"], table["sim"], scenarios)
+    keep = np.isin(table["sim"], sims)
+    if years is not None:
+        keep &= np.isin(table["year"], years)
+    scenario_order = np.argsort(scenarios)
+    scenario_idx = scenario_order[
+        np.searchsorted(scenarios, table["scenario"][keep], sorter=scenario_order)
+    ]
+    sim_idx = np.searchsorted(sims, table["sim"][keep])
+    month_idx = table["month"][keep].astype(np.int64) - 1
+    # Legacy results have no frame counts, weight their rows equally.
+    weights = np.maximum(table["n_frames"][keep], 1).astype(np.float64)
+    values = np.stack([table[metric][keep] for metric in metrics], -1)
+
+    shape = (len(scenarios), len(sims), len(MONTHS))
+    totals = np.zeros(shape + (len(metrics),))
+    total_weights = np.zeros(shape)
+    np.add.at(totals, (scenario_idx, sim_idx, month_idx), values * weights[:, None])
+    np.add.at(total_weights, (scenario_idx, sim_idx, month_idx), weights)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        data = totals / total_weights[..., None]
+    return SimulationResults(data, list(scenarios), sims, MONTHS, list(metrics))
+
+
+def select_metrics(results, metrics):
+    """Return the [scenario, sim, month, len(metrics)] data of the given metrics."""
+    return results.data[..., [results.metrics.index(metric) for metric in metrics]]
+
+
+def paired_ttest(a, b, axis=0):
+    """Paired t-test of a against b over the given axis, vectorized otherwise.
+
+    Matches scipy.stats.ttest_rel. Returns the t-statistic and two-sided p-value.
+    """
+    differences = np.asarray(a) - np.asarray(b)
+    n = differences.shape[axis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_statistic = differences.mean(axis) / (
+            differences.std(axis, ddof=1) / np.sqrt(n)
+        )
+    p_value = 2 * t_distribution.sf(np.abs(t_statistic), n - 1)
+    return t_statistic, p_value
+
+
+def paired_effect_size(a, b, axis=0):
+    """Cohen's d for paired samples (mean difference over its std)."""
+    differences = np.asarray(a) - np.asarray(b)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return differences.mean(axis) / differences.std(axis, ddof=1)
+
+
+def fdr_correction(p_values):
+    """Benjamini-Hochberg adjusted p-values over all entries. NaNs are ignored."""
+    p_values = np.asarray(p_values, dtype=np.float64)
+    flat = p_values.ravel()
+    valid = ~np.isnan(flat)
+    valid_p = flat[valid]
+    n = valid_p.size
+    order = np.argsort(valid_p)
+    ranked = valid_p[order] * n / np.arange(1, n + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1].clip(max=1)
+    adjusted = np.empty(n)
+    adjusted[order] = ranked
+    corrected = np.full(flat.shape, np.nan)
+    corrected[valid] = adjusted
+    return corrected.reshape(p_values.shape)
+
+
+def compare_scenarios(results, baseline=BASELINE_SCENARIO):
+    """Compare every other scenario against the baseline, paired by sim.
+
+    Returns the list of compared scenarios and a dict of [scenario, month, metric]
+    arrays. The FDR correction is done over all scenarios, months and metrics.
+    """
+    baseline_index = results.scenarios.index(baseline)
+    others = [
+        scenario for scenario in results.scenarios if scenario != baseline
+    ]
+    other_data = results.data[[results.scenarios.index(s) for s in others]]
+    baseline_data = results.data[baseline_index][None]
+
+    t_statistic, p_value = paired_ttest(baseline_data, other_data, axis=1)
+    return others, {
+        "mean_difference": (baseline_data - other_data).mean(1),
+        "t_statistic": t_statistic,
+        "p_value": p_value,
+        "p_value_fdr": fdr_correction(p_value),
+        "effect_size": paired_effect_size(baseline_data, other_data, axis=1),
+    }
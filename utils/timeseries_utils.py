@@ -0,0 +1,182 @@
+from collections import namedtuple
+
+import numpy as np
+from scipy.stats import t as t_distribution
+
+from utils.constants import SIMULATION_STEP, logger
+from utils.statistics_utils import SCENARIOS, paired_sims
+
+SCENARIO_AXIS = 0
+SIM_AXIS = 1
+DAY_AXIS = 2
+
+# data is [scenario, sim, day, metric], NaN on days a sim has no frame.
+# A day is one simulation step, days are days since the start of the simulation
+# (burn-in included) and period is the number of steps in a simulated year.
+DailySeries = namedtuple("DailySeries", "data scenarios sims days metrics period")
+Decomposition = namedtuple("Decomposition", "trend seasonal residual")
+
+
+def load_daily_series(store, metrics, scenarios=SCENARIOS, experiment=None):
+    """Load the per frame metrics of all sims of all scenarios as a DailySeries.
+
+    The day of a frame is its logged SIMULATION_STEP plus the first day of its
+    run, see run_first_day. The period is the number of steps of the first
+    simulated year, which includes any speed changes. Rows logged without a
+    simulation step are dropped. Sims are aligned by their sim id, sims missing
+    in any scenario are dropped.
+    """
+    runs = store.runs(experiment, scenarios)
+    samples = store.query(list(metrics) + [SIMULATION_STEP, "year"], experiment, scenarios)
+    sims = paired_sims(samples["scenario"], samples["sim"], scenarios)
+
+    keep = np.isin(samples["sim"], sims)
+    missing = keep & np.isnan(samples[SIMULATION_STEP])
+    if missing.any():
+        logger.warning(
+            f"Dropping {missing.sum()} rows logged without {SIMULATION_STEP}."
+        )
+        keep &= ~missing
+    scenario_order = np.argsort(scenarios)
+    scenario_idx = scenario_order[
+        np.searchsorted(scenarios, samples["scenario"][keep], sorter=scenario_order)
+    ]
+    sim_idx = np.searchsorted(sims, samples["sim"][keep])
+    step = samples[SIMULATION_STEP][keep].astype(np.int64)
+
+    # Runs start at step 0, so the last frame of the first year is at its number of steps.
+    first_year = samples["year"][keep] == 1
+    run_periods = np.zeros((len(scenarios), len(sims)), dtype=np.int64)
+    np.maximum.at(
+        run_periods, (scenario_idx[first_year], sim_idx[first_year]), step[first_year]
+    )
+    periods = set(run_periods[run_periods > 0].tolist())
+    if len(periods) > 1:
+        raise ValueError(f"Runs have different years of {sorted(periods)} steps.")
+    period = periods.pop() if periods else None
+
+    first_days = np.zeros((len(scenarios), len(sims)), dtype=np.int64)
+    for run_id, _, scenario, sim, _ in runs:
+        if sim in sims and period:
+            first_days[scenarios.index(scenario), sims.index(sim)] = run_first_day(
+                store.run_config(run_id), period
+            )
+
+    day = first_days[scenario_idx, sim_idx] + step
+    days = np.arange(day.min(), day.max() + 1) if len(day) else np.zeros(0, np.int64)
+
+    data = np.full((len(scenarios), len(sims), len(days), len(metrics)), np.nan)
+    data[scenario_idx, sim_idx, day - days[:1]] = np.stack(
+        [samples[metric][keep] for metric in metrics], -1
+    )
+    return DailySeries(data, list(scenarios), sims, days, list(metrics), period)
+
+
+def run_first_day(config, period):
+    """Return the first day of a store run, given the period of its years.
+
+    The days_since_start of the run config are in years of days_in_year days.
+    """
+    days_in_year = config.get("days_in_year", 365)
+    years_since_start = config.get("days_since_start", 0) / days_in_year
+    return round(years_since_start * period)
+
+
+def select_days(series, first_day, last_day):
+    """Return the part of a DailySeries from first_day up to and including last_day."""
+    keep = (series.days >= first_day) & (series.days <= last_day)
+    return series._replace(data=series.data[:, :, keep], days=series.days[keep])
+
+
+def _window_mean(data, starts, ends, min_count):
+    """NaN-aware mean of data[..., start:end] for every (start, end) on the last axis."""
+    valid = ~np.isnan(data)
+    zeros = np.zeros(data.shape[:-1] + (1,))
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, data, 0), -1)], -1)
+    counts = np.concatenate([zeros, np.cumsum(valid, -1)], -1)
+    starts = np.clip(starts, 0, data.shape[-1])
+    ends = np.clip(ends, 0, data.shape[-1])
+    window_counts = counts[..., ends] - counts[..., starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = (sums[..., ends] - sums[..., starts]) / window_counts
+    return np.where(window_counts >= min_count, means, np.nan)
+
+
+def rolling_mean(data, window, axis=DAY_AXIS, center=False, min_count=1):
+    """Mean over a window of days, ignoring NaNs.
+
+    The window ends at every day, or is centered on it if center is set.
+    Windows with less than min_count values are NaN.
+    """
+    data = np.moveaxis(np.asarray(data, dtype=np.float64), axis, -1)
+    positions = np.arange(data.shape[-1])
+    starts = positions - window // 2 if center else positions - window + 1
+    means = _window_mean(data, starts, starts + window, min_count)
+    return np.moveaxis(means, -1, axis)
+
+
+def confidence_band(data, confidence=0.95, axis=SIM_AXIS):
+    """Mean and t-distribution confidence interval of the mean over sims.
+
+    Returns the mean, lower and upper bound, reduced over axis. NaNs are ignored.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n = (~np.isnan(data)).sum(axis)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.nansum(data, axis) / n
+        variance = np.nansum((data - np.expand_dims(mean, axis)) ** 2, axis) / (n - 1)
+        half_width = t_distribution.ppf((1 + confidence) / 2, n - 1) * np.sqrt(
+            variance / n
+        )
+    return mean, mean - half_width, mean + half_width
+
+
+def seasonal_decomposition(data, days, period, axis=DAY_AXIS):
+    """Classical additive decomposition into trend, seasonal and residual parts.
+
+    The trend is a centered moving average over one period (2 x period for even
+    periods), NaN where the window is incomplete. The seasonal part is the mean
+    detrended value of every day of the period, computed from days so series with
+    different starts share their phase. period is the period of a DailySeries.
+    """
+    data = np.moveaxis(np.asarray(data, dtype=np.float64), axis, -1)
+    positions = np.arange(data.shape[-1])
+    starts = positions - period // 2
+    trend = _window_mean(data, starts, starts + period, period)
+    if period % 2 == 0:
+        trend = (trend + _window_mean(data, starts + 1, starts + period + 1, period)) / 2
+
+    detrended = data - trend
+    phase = np.asarray(days) % period
+    valid = ~np.isnan(detrended)
+    phase_sums = np.zeros((period,) + data.shape[:-1])
+    phase_counts = np.zeros((period,) + data.shape[:-1])
+    np.add.at(phase_sums, phase, np.moveaxis(np.where(valid, detrended, 0), -1, 0))
+    np.add.at(phase_counts, phase, np.moveaxis(valid, -1, 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        phase_means = phase_sums / phase_counts
+    phase_means -= np.nanmean(phase_means, 0)
+    seasonal = np.moveaxis(phase_means[phase], 0, -1)
+
+    return Decomposition(
+        *(
+            np.moveaxis(part, -1, axis)
+            for part in (trend, seasonal, data - trend - seasonal)
+        )
+    )
+
+
+def to_tidy(values, **labels):
+    """Flatten an array into one column per axis label plus a "value" column.
+
+    labels are given in axis order, e.g.
+    to_tidy(mean, scenario=series.scenarios, day=series.days, metric=series.metrics).
+    """
+    values = np.asarray(values)
+    if values.ndim != len(labels):
+        raise ValueError(f"Got {len(labels)} labels for {values.ndim} axes.")
+    grids = np.meshgrid(*(np.asarray(label) for label in labels.values()), indexing="ij")
+    return {
+        **{name: grid.ravel() for name, grid in zip(labels, grids)},
+        "value": values.ravel(),
+    }
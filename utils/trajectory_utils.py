@@ -0,0 +1,204 @@
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import pickle
+import shutil
+import subprocess
+import tempfile
+from glob import glob
+
+import jax.numpy as jp
+import numpy as np
+from jax import jit
+from self_organising_systems.biomakerca import environments as evm
+
+from utils.constants import EN_ST, logger
+from utils.count_utils import stack_environments
+
+TRAJECTORY_PATH = "trajectories"
+# Chunks are months, so segments are years by default.
+SEGMENT_CHUNKS = 12
+MAX_WORKERS = os.cpu_count()
+FPS = 30
+
+
+def chunk_path(trajectory_path, index):
+    return os.path.join(trajectory_path, f"chunk_{index:05d}.npz")
+
+
+def list_chunks(trajectory_path):
+    return sorted(glob(os.path.join(trajectory_path, "chunk_*.npz")))
+
+
+@jit
+def _compact(envs):
+    # Rendering only needs the types, agent ids and nutrients of every cell.
+    return (
+        envs.type_grid.astype(jp.uint8),
+        envs.agent_id_grid.astype(jp.uint16),
+        envs.state_grid[..., EN_ST : EN_ST + 2].astype(jp.float16),
+    )
+
+
+class TrajectoryWriter:
+    """Store the frames of one sim as compact chunks, one per add call.
+
+    A trajectory is a directory holding the env_config and chunk_*.npz files
+    with uint8 types, uint16 agent ids, float16 nutrients and the step, speed
+    and season of every frame. Existing chunks in the directory are removed.
+    """
+
+    def __init__(self, trajectory_path, env_config):
+        os.makedirs(trajectory_path, exist_ok=True)
+        for file_path in list_chunks(trajectory_path):
+            os.remove(file_path)
+        with open(os.path.join(trajectory_path, "env_config.pkl"), "wb") as handle:
+            pickle.dump(env_config, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.trajectory_path = trajectory_path
+        self.n_chunks = 0
+
+    def add(self, environments, frame_infos):
+        """Store environments with their (step, speed, season) as the next chunk."""
+        type_grid, agent_id_grid, nutrients = (
+            np.asarray(grid) for grid in _compact(stack_environments(environments))
+        )
+        steps, speeds, seasons = zip(*frame_infos)
+        np.savez_compressed(
+            chunk_path(self.trajectory_path, self.n_chunks),
+            type_grid=type_grid,
+            agent_id_grid=agent_id_grid,
+            nutrients=nutrients,
+            step=np.array(steps),
+            speed=np.array(speeds),
+            season=np.array(seasons),
+        )
+        self.n_chunks += 1
+
+
+def load_env_config(trajectory_path):
+    with open(os.path.join(trajectory_path, "env_config.pkl"), "rb") as handle:
+        return pickle.load(handle)
+
+
+def load_chunk(chunk_file, env_config):
+    """Return the stacked environments and (step, speed, season) of a chunk."""
+    with np.load(chunk_file) as chunk:
+        type_grid = chunk["type_grid"]
+        state_grid = np.zeros(type_grid.shape + (env_config.env_state_size,), np.float32)
+        state_grid[..., EN_ST : EN_ST + 2] = chunk["nutrients"]
+        envs = evm.Environment(
+            type_grid=type_grid.astype(np.uint32),
+            state_grid=state_grid,
+            agent_id_grid=chunk["agent_id_grid"].astype(np.uint32),
+        )
+        frame_infos = list(
+            zip(chunk["step"].tolist(), chunk["speed"].tolist(), chunk["season"].tolist())
+        )
+    return envs, frame_infos
+
+
+def render_segment(trajectory_path, chunk_files, segment_file, zoom_sz, fps=FPS, annotate=True):
+    """Render and encode the frames of the given chunks into one video file."""
+    import mediapy as media
+
+    from utils.rendering_utils import add_text_bands, frame_text, render_frames
+
+    env_config = load_env_config(trajectory_path)
+
+    def chunk_frames(chunk_file):
+        envs, frame_infos = load_chunk(chunk_file, env_config)
+        frames = np.asarray(render_frames(envs, env_config, zoom_sz))
+        if not annotate:
+            return frames
+        return add_text_bands(
+            frames, [frame_text(*frame_info) for frame_info in frame_infos]
+        )
+
+    batches = map(chunk_frames, chunk_files)
+    first_batch = next(batches)
+    with media.VideoWriter(
+        segment_file, shape=first_batch.shape[1:3], fps=fps, crf=18
+    ) as video:
+        for frames in itertools.chain([first_batch], batches):
+            for frame in frames:
+                video.add_image(frame)
+    return segment_file
+
+
+def concatenate_segments(segment_files, out_file):
+    """Join segments encoded with the same settings without re-encoding them."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise FileNotFoundError("ffmpeg is needed to concatenate video segments.")
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as segment_list:
+        segment_list.writelines(
+            f"file '{os.path.abspath(segment_file)}'\n" for segment_file in segment_files
+        )
+    try:
+        subprocess.run(
+            [ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+             "-i", segment_list.name, "-c", "copy", out_file],
+            check=True,
+        )
+    finally:
+        os.remove(segment_list.name)
+    logger.info(f"Saved video to {out_file}")
+
+
+def render_trajectories(
+    jobs,
+    zoom_sz,
+    fps=FPS,
+    annotate=True,
+    segment_chunks=SEGMENT_CHUNKS,
+    max_workers=MAX_WORKERS,
+):
+    """Render (trajectory_path, out_file) jobs without simulating.
+
+    The chunks of all trajectories are split into segments of segment_chunks
+    chunks, which are rendered and encoded in parallel worker processes and
+    concatenated per trajectory. Returns the out files that were written.
+    """
+    segments = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {}
+        for trajectory_path, out_file in jobs:
+            chunk_files = list_chunks(trajectory_path)
+            if not chunk_files:
+                logger.warning(f"No chunks found in {trajectory_path}, skipping.")
+                continue
+            segment_dir = f"{out_file}.segments"
+            os.makedirs(segment_dir, exist_ok=True)
+            segments[out_file] = []
+            for start in range(0, len(chunk_files), segment_chunks):
+                segment_file = os.path.join(segment_dir, f"segment_{start:05d}.mp4")
+                segments[out_file].append(segment_file)
+                future = executor.submit(
+                    render_segment,
+                    trajectory_path,
+                    chunk_files[start : start + segment_chunks],
+                    segment_file,
+                    zoom_sz,
+                    fps,
+                    annotate,
+                )
+                futures[future] = out_file
+
+        failed = set()
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Could not render a segment of {futures[future]}: {e}")
+                failed.add(futures[future])
+
+    written = []
+    for out_file, segment_files in segments.items():
+        if out_file not in failed:
+            concatenate_segments(segment_files, out_file)
+            written.append(out_file)
+        shutil.rmtree(f"{out_file}.segments", ignore_errors=True)
+    return written
@@ -0,0 +1,96 @@
+import queue
+import threading
+
+import mediapy as media
+
+from utils.constants import logger
+
+# About 10 seconds of 30 fps video, so bursts of rendered frames do not block.
+MAX_QUEUED_FRAMES = 300
+
+
+class VideoSink:
+    """Drop-in for media.VideoWriter that encodes frames on a writer thread.
+
+    add_image only queues the (uint8) frame. When max_queued_frames frames are
+    waiting, it blocks until the encoder catches up, which bounds the memory use.
+    Every sim uses its own sink, so concurrent sims each write their own file.
+    close (or leaving the with block) encodes all queued frames and finishes the
+    file, errors of the writer thread are raised there and by add_image.
+    """
+
+    def __init__(self, path, shape, fps, crf=18, max_queued_frames=MAX_QUEUED_FRAMES):
+        self.path = path
+        self.queue = queue.Queue(maxsize=max_queued_frames)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(
+            target=self._write, args=(path, shape, fps, crf), daemon=True
+        )
+        self.thread.start()
+
+    def _write(self, path, shape, fps, crf):
+        try:
+            with media.VideoWriter(path, shape=shape, fps=fps, crf=crf) as video:
+                while True:
+                    frame = self.queue.get()
+                    if frame is None:
+                        break
+                    video.add_image(frame)
+        except Exception as e:
+            logger.error(f"Error writing video {path}: {e}")
+            self.error = e
+            # Unblock producers waiting on a full queue.
+            while True:
+                try:
+                    if self.queue.get_nowait() is None:
+                        break
+                except queue.Empty:
+                    break
+
+    def _check_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Writing video {self.path} failed.") from self.error
+
+    def add_image(self, frame):
+        if self.closed:
+            raise RuntimeError(f"Video {self.path} is already closed.")
+        self._check_error()
+        while self.thread.is_alive():
+            try:
+                self.queue.put(frame, timeout=1)
+                return
+            except queue.Full:
+                continue
+        self._check_error()
+
+    def add_images(self, frames):
+        for frame in frames:
+            self.add_image(frame)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.thread.join()
+        self._check_error()
+        logger.info(f"Saved video to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Keep the original exception, but still finish what was written.
+        try:
+            self.close()
+        except Exception as e:
+            logger.error(f"Error closing video {self.path}: {e}")